@@ -0,0 +1,136 @@
+"""Benchmark redisor against a local redis-server, or fakeredis.
+
+    python -m benchmarks                          # spawn redis-server
+    python -m benchmarks --backend fakeredis
+    python -m benchmarks --url redis://localhost:6379/15 --sizes 100,10000
+    python -m benchmarks --compare benchmarks/results/abc1234.json
+
+Each case reports ops/sec, p50/p99 latency, round trips, bytes sent and,
+with a real server, bytes received per operation. Memory per instance of
+each storage mode is measured with a real server too. Results are written to
+`benchmarks/results/<commit>.json`. With `--compare`, cases slower than the
+baseline by more than `--threshold` are listed and the exit status is 1.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import redis
+
+from .cases import CASES, MEMORY_MODELS, bind
+from .harness import LocalServer, measure, measure_memory
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(__file__)).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def connect(args):
+    if args.url:
+        return redis.StrictRedis.from_url(args.url, decode_responses=True), None
+    if args.backend == 'fakeredis':
+        import fakeredis
+        return fakeredis.FakeStrictRedis(decode_responses=True), None
+    server = LocalServer()
+    server.start()
+    return redis.StrictRedis(port=server.port, decode_responses=True), server
+
+
+def compare(results, baseline, threshold):
+    """Print the change of each case against the baseline, return the regressions"""
+    old = {(r['name'], r['size']): r for r in baseline['results']}
+    regressions = []
+    for r in results:
+        before = old.get((r['name'], r['size']))
+        if before is None or not before['ops_per_sec'] or not r['ops_per_sec']:
+            continue
+        change = r['ops_per_sec'] / before['ops_per_sec'] - 1
+        print('%-24s %7d  ops/s %+7.1f%%  p99 %.3f -> %.3fms' % (
+            r['name'], r['size'], change * 100, before['p99_ms'], r['p99_ms']))
+        if change < -threshold:
+            regressions.append(r)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description=__doc__.split('\n')[0])
+    parser.add_argument('--backend', choices=['redis-server', 'fakeredis'], default='redis-server')
+    parser.add_argument('--url', help="use an existing server, its database is flushed")
+    parser.add_argument('--sizes', default='100,1000', help="comma separated data sizes")
+    parser.add_argument('--repeat', type=int, default=200, help="operations timed per case")
+    parser.add_argument('--only', help="run the cases whose name starts with this prefix")
+    parser.add_argument('--output', help="path of the JSON results")
+    parser.add_argument('--compare', help="JSON results to compare with")
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help="relative ops/sec drop reported as a regression")
+    args = parser.parse_args(argv)
+
+    db, server = connect(args)
+    try:
+        bind(db)
+        sizes = [int(size) for size in args.sizes.split(',')]
+        results = []
+        for case in CASES:
+            if args.only and not case.name.startswith(args.only):
+                continue
+            for size in sizes:
+                result = measure(case, db, size, args.repeat)
+                results.append(result)
+                print('%-24s %7d  %9.0f ops/s  p50 %.3fms  p99 %.3fms  %.1f rt  %.0f B' % (
+                    case.name, size, result['ops_per_sec'], result['p50_ms'], result['p99_ms'],
+                    result['round_trips_per_op'], result['bytes_sent_per_op']))
+        memory = []
+        for model_class in MEMORY_MODELS:
+            for size in sizes:
+                per_instance = measure_memory(model_class, db, size)
+                if per_instance is not None:
+                    memory.append({'storage': model_class.__storage__.__class__.__name__,
+                                   'size': size, 'bytes_per_instance': per_instance})
+                    print('%-24s %7d  %9.1f bytes/instance' % (
+                        model_class.__storage__.__class__.__name__, size, per_instance))
+        server_version = db.info('server').get('redis_version') if server or args.url else None
+    finally:
+        if server is not None:
+            server.stop()
+
+    commit = git_commit()
+    report = {
+        'meta': {
+            'commit': commit,
+            'backend': 'url' if args.url else args.backend,
+            'redis_version': server_version,
+            'python': platform.python_version(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'repeat': args.repeat,
+        },
+        'results': results,
+        'memory': memory,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, '%s.json' % (commit or int(time.time())))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('results written to %s' % output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print('%d regressions' % len(regressions))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,164 @@
+"""Benchmark cases, each prepares `size` items and returns the operation to time,
+called with the number of the operation."""
+from redisor import model
+from redisor.structure import List, Set, SortedSet, Hash
+
+
+class Case:
+
+    def __init__(self, name, prepare):
+        self.name = name
+        self.prepare = prepare
+
+
+class BenchPerson(model.Model):
+
+    name = model.StringField(name='name', index=True)
+    group = model.StringField(name='group', index=True)
+    score = model.IntegerField(name='score', default=0, range_index=True)
+    friends = model.ListField(name='friends')
+
+
+class HashItem(model.Model):
+
+    name = model.StringField(name='name')
+    x = model.IntegerField(name='x', default=0)
+
+
+class BucketItem(model.Model):
+
+    __storage__ = model.BucketStorage()
+
+    name = model.StringField(name='name')
+    x = model.IntegerField(name='x', default=0)
+
+
+class BlobItem(model.Model):
+
+    __storage__ = model.BlobStorage()
+
+    name = model.StringField(name='name')
+    x = model.IntegerField(name='x', default=0)
+
+
+MEMORY_MODELS = [HashItem, BucketItem, BlobItem]
+GROUPS = 10
+
+
+def bind(db):
+    for model_class in [BenchPerson] + MEMORY_MODELS:
+        model_class.__database__ = db
+
+
+def _people(size):
+    return BenchPerson.objects.bulk_create(
+        BenchPerson(name='p%d' % (i % 100), group='g%d' % (i % GROUPS), score=i, friends=['a', 'b'])
+        for i in range(size))
+
+
+def model_save(db, size):
+    _people(size)
+    return lambda i: BenchPerson(name='new', group='g0', score=i).save()
+
+
+def model_save_changed(db, size):
+    people = _people(size)
+
+    def op(i):
+        person = people[i % size]
+        person.score += 1
+        person.save()
+    return op
+
+
+def query_get(db, size):
+    _people(size)
+    return lambda i: BenchPerson.objects.get(i % size + 1)
+
+
+def queryset_members(db, size):
+    _people(size)
+    return lambda i: BenchPerson.objects.filter(group='g%d' % (i % GROUPS)).members
+
+
+def queryset_filter_count(db, size):
+    _people(size)
+    return lambda i: BenchPerson.objects.filter(name='p%d' % (i % 100), group='g%d' % (i % GROUPS)).count()
+
+
+def queryset_ordered_page(db, size):
+    _people(size)
+    return lambda i: BenchPerson.objects.order_by('-score')[0:20]
+
+
+def list_append(db, size):
+    items = List(db, 'bench:list')
+    return lambda i: items.append(i)
+
+
+def list_all(db, size):
+    db.rpush('bench:list', *range(size))
+    items = List(db, 'bench:list')
+    return lambda i: items.all()
+
+
+def set_add(db, size):
+    members = Set(db, 'bench:set')
+    return lambda i: members.add(i)
+
+
+def set_iterate(db, size):
+    db.sadd('bench:set', *range(size))
+    members = Set(db, 'bench:set')
+    return lambda i: list(members)
+
+
+def hash_set(db, size):
+    h = Hash(db, 'bench:hash')
+
+    def op(i):
+        h['f%d' % (i % size)] = i
+    return op
+
+
+def hash_get(db, size):
+    db.hset('bench:hash', mapping={'f%d' % i: i for i in range(size)})
+    h = Hash(db, 'bench:hash')
+    return lambda i: h['f%d' % (i % size)]
+
+
+def hash_all(db, size):
+    db.hset('bench:hash', mapping={'f%d' % i: i for i in range(size)})
+    h = Hash(db, 'bench:hash')
+    return lambda i: h.all()
+
+
+def sorted_set_rank(db, size):
+    db.zadd('bench:zset', {'m%d' % i: i for i in range(size)})
+    z = SortedSet(db, 'bench:zset')
+    return lambda i: z.rank('m%d' % (i % size))
+
+
+def sorted_set_iterate(db, size):
+    db.zadd('bench:zset', {'m%d' % i: i for i in range(size)})
+    z = SortedSet(db, 'bench:zset')
+    return lambda i: list(z)
+
+
+CASES = [
+    Case('model.save', model_save),
+    Case('model.save_changed', model_save_changed),
+    Case('query.get', query_get),
+    Case('queryset.members', queryset_members),
+    Case('queryset.filter_count', queryset_filter_count),
+    Case('queryset.ordered_page', queryset_ordered_page),
+    Case('list.append', list_append),
+    Case('list.all', list_all),
+    Case('set.add', set_add),
+    Case('set.iterate', set_iterate),
+    Case('hash.set', hash_set),
+    Case('hash.get', hash_get),
+    Case('hash.all', hash_all),
+    Case('sorted_set.rank', sorted_set_rank),
+    Case('sorted_set.iterate', sorted_set_iterate),
+]
@@ -0,0 +1,130 @@
+import shutil
+import socket
+import statistics
+import subprocess
+import time
+
+import redis
+
+from redisor import trace
+
+
+class LocalServer:
+    """A redis-server spawned on a free port, without persistence"""
+
+    def __init__(self, executable='redis-server'):
+        self.executable = shutil.which(executable)
+        if self.executable is None:
+            raise RuntimeError("%s is not installed, use `--backend fakeredis`" % executable)
+        self.port = None
+        self.process = None
+
+    def start(self, timeout=5):
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            self.port = s.getsockname()[1]
+        self.process = subprocess.Popen(
+            [self.executable, '--port', str(self.port), '--bind', '127.0.0.1',
+             '--save', '', '--appendonly', 'no'],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + timeout
+        db = redis.StrictRedis(port=self.port)
+        while True:
+            try:
+                db.ping()
+                return
+            except redis.ConnectionError:
+                if time.monotonic() > deadline:
+                    self.stop()
+                    raise
+                time.sleep(0.05)
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait()
+            self.process = None
+
+
+class ServerStats:
+    """Bytes written by the server, read from `INFO stats` of a real server.
+    The reply of the INFO command itself is measured once and subtracted."""
+
+    def __init__(self, db):
+        self.db = db
+        self.enabled = True
+        try:
+            first = self.output_bytes()
+            self.overhead = self.output_bytes() - first
+        except (redis.ResponseError, KeyError):
+            self.enabled = False
+
+    def output_bytes(self):
+        return self.db.info('stats')['total_net_output_bytes']
+
+    def __enter__(self):
+        self.received = None
+        if self.enabled:
+            self.start = self.output_bytes()
+        return self
+
+    def __exit__(self, *exc):
+        if self.enabled:
+            self.received = self.output_bytes() - self.start - self.overhead
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def measure(case, db, size, repeat, accounted=50):
+    """Run `repeat` operations of a case on `size` items. Latencies are taken
+    without instrumentation, round trips and bytes on a separate pass of
+    `accounted` operations."""
+    db.flushdb()
+    op = case.prepare(db, size)
+    latencies = []
+    started = time.perf_counter()
+    for i in range(repeat):
+        start = time.perf_counter()
+        op(i)
+        latencies.append(time.perf_counter() - start)
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+
+    accounted = min(accounted, repeat)
+    stats = ServerStats(db)
+    # the INFO commands of `stats` are sent outside of the accounting
+    with stats, trace() as traced:
+        for i in range(repeat, repeat + accounted):
+            op(i)
+    db.flushdb()
+    return {
+        'name': case.name,
+        'size': size,
+        'ops': repeat,
+        'ops_per_sec': repeat / elapsed if elapsed else None,
+        'mean_ms': statistics.mean(latencies) * 1000,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'round_trips_per_op': traced.round_trips / accounted,
+        'bytes_sent_per_op': traced.bytes_sent / accounted,
+        'bytes_received_per_op': stats.received / accounted if stats.received is not None else None,
+    }
+
+
+def measure_memory(model_class, db, size):
+    """Return the server memory used per instance of the model, None without
+    a real server"""
+    db.flushdb()
+    try:
+        before = db.info('memory')['used_memory']
+    except (redis.ResponseError, KeyError):
+        return None
+    model_class.objects.bulk_create(model_class(name='item-%d' % i, x=i) for i in range(size))
+    used = db.info('memory')['used_memory'] - before
+    db.flushdb()
+    return used / size
@@ -1,9 +1,20 @@
 import redis
+import redis.cluster
 
 from .logcenter import logger
+from .instrument import attach
 
 
 class Client(object):
+    """Settings of a redis instance, and the connection pool shared by every
+    connection returned by `db()`. Pool options such as `max_connections`,
+    `socket_keepalive`, `health_check_interval` or `unix_socket_path` are
+    accepted along with the connection settings.
+
+    With `cluster=True`, `db()` returns a `redis.cluster.RedisCluster` started
+    from `host`/`port` or `startup_nodes`. Models declared on a cluster client
+    hash tag their keys, see `Model.__shards__`.
+    """
 
     def __init__(self, **kwargs):
         self.setting = kwargs or {
@@ -13,22 +24,63 @@ class Client(object):
             'encoding': "utf-8",
             'decode_responses': True
         }
+        self._pool = None
+        self._cluster_client = None
+
+    @property
+    def cluster(self):
+        return bool(self.setting.get('cluster'))
+
+    def _cluster_setting(self):
+        setting = dict(self.setting)
+        setting.pop('cluster')
+        # a cluster only has database 0
+        setting.pop('db', None)
+        return setting
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            # the client maps its options, such as `ssl` or `unix_socket_path`,
+            # to the pool and connection class
+            self._pool = redis.StrictRedis(**self.setting).connection_pool
+        return self._pool
 
     def db(self):
-        return redis.StrictRedis(**self.setting)
+        if self.cluster:
+            # the cluster client keeps a pool per node, it is shared like `pool`
+            if self._cluster_client is None:
+                self._cluster_client = attach(redis.cluster.RedisCluster(**self._cluster_setting()))
+            return self._cluster_client
+        return attach(redis.StrictRedis(connection_pool=self.pool))
+
+    def async_db(self):
+        """Return a new `redis.asyncio` client with the same setting. Its pool
+        is bound to the event loop it first connects in, so it isn't shared."""
+        import redis.asyncio
+        if self.cluster:
+            return attach(redis.asyncio.RedisCluster(**self._cluster_setting()))
+        return attach(redis.asyncio.StrictRedis(**self.setting))
 
     def update(self, **kwargs):
         self.setting.update(kwargs)
+        # connections made from the old pool keep it, new ones use the new setting
+        self._pool = None
+        self._cluster_client = None
 
 
-def setup(**kwargs):
-    global connection, client
-    logger.info("setup redis db with params: {}".format(kwargs))
+def setup(router=None, **kwargs):
+    """Update the default client, and route models with `router` if given"""
+    global connection, client, _router
+    logger.debug("setup redis db with params: %s", kwargs)
     if client:
         client.update(**kwargs)
     else:
         client = Client(**kwargs)
     connection = client.db()
+    if router is not None:
+        _router = router
+        router.route_all()
 
 
 def get_client():
@@ -36,8 +88,19 @@ def get_client():
     return connection
 
 
+def get_async_client():
+    return client.async_db()
+
+
+def get_router():
+    return _router
+
+
 client = Client()
 connection = client.db()
+_router = None
+
+from .tracing import trace  # noqa: E402
 
 
-__all__ = ['setup', 'get_client']
+__all__ = ['setup', 'get_client', 'get_async_client', 'get_router', 'trace']
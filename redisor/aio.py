@@ -0,0 +1,534 @@
+"""asyncio flavour of redisor, built on `redis.asyncio`.
+
+Models are declared once with the same fields, only the base class changes:
+
+    class Person(AsyncModel):
+        __database__ = get_async_client()
+        name = StringField(name='name', index=True)
+
+    person = await Person.objects.create(name='Liming')
+    person = await Person.objects.get(1)
+    async for person in Person.objects.filter(name='Liming'):
+        ...
+
+`AutoIncrementField` reads its sequence synchronously and is not supported
+on async models. Fields can't be loaded lazily either: querysets read all ext
+fields by default, and fields left out by `only()`/`defer()` raise AttributeError.
+"""
+import time
+
+from .instrument import operation
+from .model import Model
+from .query import Query, Queryset
+from .structure import Structure, _chunks
+
+
+class AsyncList:
+
+    def __init__(self, db, key):
+        self.db = db
+        self.key = key
+
+    async def all(self):
+        return await self.db.lrange(self.key, 0, -1)
+
+    async def append(self, value):
+        return await self.db.rpush(self.key, value)
+
+    async def extend(self, values):
+        length = None
+        for chunk in _chunks(values, Structure.chunk_size):
+            length = await self.db.rpush(self.key, *chunk)
+        return length
+
+    async def pop(self):
+        return await self.db.rpop(self.key)
+
+    async def shift(self):
+        return await self.db.lpop(self.key)
+
+    async def unshift(self, value):
+        return await self.db.lpush(self.key, value)
+
+    async def remove(self, item):
+        return await self.db.lrem(self.key, 1, item)
+
+    async def length(self):
+        return await self.db.llen(self.key)
+
+    async def get(self, index):
+        return await self.db.lindex(self.key, index)
+
+    async def set(self, index, value):
+        return await self.db.lset(self.key, index, value)
+
+    async def contains(self, item):
+        return await self.db.lpos(self.key, item) is not None
+
+    async def __aiter__(self):
+        for item in await self.all():
+            yield item
+
+
+class AsyncSet:
+
+    def __init__(self, db, key):
+        self.db = db
+        self.key = key
+
+    async def all(self):
+        return await self.db.smembers(self.key)
+
+    async def add(self, item):
+        return await self.db.sadd(self.key, item)
+
+    async def add_many(self, items):
+        added = 0
+        for chunk in _chunks(items, Structure.chunk_size):
+            added += await self.db.sadd(self.key, *chunk)
+        return added
+
+    async def remove_many(self, items):
+        removed = 0
+        for chunk in _chunks(items, Structure.chunk_size):
+            removed += await self.db.srem(self.key, *chunk)
+        return removed
+
+    async def remove(self, item):
+        if not await self.db.srem(self.key, item):
+            raise KeyError(item)
+
+    async def discard(self, item):
+        await self.db.srem(self.key, item)
+
+    async def length(self):
+        return await self.db.scard(self.key)
+
+    async def contains(self, item):
+        return bool(await self.db.sismember(self.key, item))
+
+    async def iter_scan(self, count=None):
+        async for member in self.db.sscan_iter(self.key, count=count):
+            yield member
+
+    def __aiter__(self):
+        return self.iter_scan()
+
+
+class AsyncSortedSet:
+
+    # how many members are read with one ZRANGE while iterating
+    page_size = 1000
+
+    def __init__(self, db, key):
+        self.db = db
+        self.key = key
+
+    async def all(self):
+        return await self.db.zrange(self.key, 0, -1)
+
+    async def add(self, member, score):
+        await self.db.zadd(self.key, {member: score})
+
+    async def zadd(self, mapping):
+        pairs = mapping.items() if isinstance(mapping, dict) else mapping
+        added = 0
+        for chunk in _chunks(pairs, Structure.chunk_size):
+            added += await self.db.zadd(self.key, dict(chunk))
+        return added
+
+    async def remove_many(self, members):
+        removed = 0
+        for chunk in _chunks(members, Structure.chunk_size):
+            removed += await self.db.zrem(self.key, *chunk)
+        return removed
+
+    async def remove(self, member):
+        await self.db.zrem(self.key, member)
+
+    async def rank(self, member, desc=False):
+        """Return the rank of the given member"""
+        if desc:
+            return await self.db.zrevrank(self.key, member)
+        return await self.db.zrank(self.key, member)
+
+    async def count(self, low, high=None):
+        if high is None:
+            high = low
+        return await self.db.zcount(self.key, low, high)
+
+    async def incr_by(self, member, increment):
+        return await self.db.zincrby(self.key, increment, member)
+
+    async def length(self):
+        return await self.db.zcard(self.key)
+
+    async def iter_scan(self, count=None):
+        async for member, score in self.db.zscan_iter(self.key, count=count):
+            yield member, score
+
+    async def __aiter__(self):
+        start = 0
+        while True:
+            members = await self.db.zrange(self.key, start, start + self.page_size - 1)
+            for member in members:
+                yield member
+            if len(members) < self.page_size:
+                break
+            start += self.page_size
+
+
+class AsyncHash:
+
+    def __init__(self, db, key):
+        self.db = db
+        self.key = key
+
+    async def all(self):
+        return await self.db.hgetall(self.key)
+
+    async def keys(self):
+        return await self.db.hkeys(self.key) or []
+
+    async def values(self):
+        return await self.db.hvals(self.key) or []
+
+    async def has_key(self, field):
+        return await self.db.hexists(self.key, field)
+
+    async def get(self, field, default=None):
+        value = await self.db.hget(self.key, field)
+        if value is None:
+            value = default
+        return value
+
+    async def set(self, field, value):
+        return await self.db.hset(self.key, field, value)
+
+    async def update(self, *args, **kwargs):
+        kwargs.update(*args)
+        added = 0
+        for chunk in _chunks(kwargs.items(), Structure.chunk_size):
+            added += await self.db.hset(self.key, mapping=dict(chunk))
+        return added
+
+    async def remove_many(self, fields):
+        removed = 0
+        for chunk in _chunks(fields, Structure.chunk_size):
+            removed += await self.db.hdel(self.key, *chunk)
+        return removed
+
+    async def delete(self, field):
+        if await self.db.hdel(self.key, field) == 0:
+            raise KeyError(field)
+
+    async def length(self):
+        return await self.db.hlen(self.key)
+
+    async def iter_scan(self, count=None):
+        async for field, value in self.db.hscan_iter(self.key, count=count):
+            yield field, value
+
+    async def __aiter__(self):
+        async for field, _ in self.iter_scan():
+            yield field
+
+
+class AsyncQuery(Query):
+    """Reads return awaitables of the async queryset."""
+
+    def get_model_queryset(self):
+        return AsyncQueryset(self.model_class, filters=dict(self._filters))
+
+    @operation('get')
+    async def get(self, id):
+        return await self.get_model_queryset()._get_item_with_id(id)
+
+    @operation('get_many')
+    async def get_many(self, ids, batch_size=None):
+        return await self.get_model_queryset()._get_items_with_ids(ids, batch_size)
+
+    @operation('create')
+    async def create(self, **kwargs):
+        instance = self.model_class(**kwargs)
+        await instance.save()
+        return instance
+
+    @operation('bulk_create')
+    async def bulk_create(self, instances, batch_size=None):
+        batch_size = batch_size or self.batch_size
+        instances = list(instances)
+        db = self.model_class.__database__
+        new_instances = [instance for instance in instances if instance.is_new()]
+        if new_instances:
+            last_id = await db.incrby(self.model_class._key['id']['_sequence'], len(new_instances))
+            self._assign_ids(new_instances, last_id)
+        engine = self.model_class.__engine__
+        for start in range(0, len(instances), batch_size):
+            if engine is not None:
+                await engine.async_save_many(db, instances[start:start + batch_size])
+            else:
+                # instances of sharded models span slots, a MULTI can't hold them
+                pipe = db.pipeline(transaction=self.model_class._shard_keys is None)
+                stored = []
+                for instance in instances[start:start + batch_size]:
+                    stored.append((instance, instance._save(pipe)))
+                await pipe.execute()
+                for instance, args in stored:
+                    instance._mark_stored(*args)
+            for instance in instances[start:start + batch_size]:
+                instance._invalidate_cache()
+        return instances
+
+    @operation('reap')
+    async def reap(self, batch_size=None):
+        batch_size = batch_size or self.batch_size
+        db = self.model_class.__database__
+        removed = 0
+        for ns in self.model_class._namespaces():
+            skipped = 0
+            while True:
+                ids = await db.zrangebyscore(ns['all'], '-inf', time.time(), start=skipped, num=batch_size)
+                if not ids:
+                    break
+                pipe = db.pipeline(transaction=False)
+                self._queue_reap_check(pipe, ns, ids)
+                replies = await pipe.execute()
+                pipe = db.pipeline(transaction=True)
+                expired = self._queue_reap(pipe, ns, ids, replies)
+                await pipe.execute()
+                removed += len(expired)
+                skipped += len(ids) - len(expired)
+        return removed
+
+
+class AsyncQueryset(Queryset):
+    """Queryset whose reads are coroutines, iterate it with `async for`."""
+
+    @operation('getitem')
+    async def __getitem__(self, index):
+        if isinstance(index, slice):
+            if index.step not in (None, 1):
+                raise ValueError("Queryset slicing doesn't support step")
+            start, stop = index.start or 0, index.stop
+            if start < 0 or (stop is not None and stop < 0):
+                start, stop, _ = index.indices(await self.count())
+            return await self._get_items_with_ids(await self._ids(self._window(start, stop)))
+        index = int(index)
+        if index < 0:
+            index += await self.count()
+        ids = await self._ids(self._window(index, index + 1)) if index >= 0 else []
+        if not ids:
+            return None
+        return await self._get_item_with_id(ids[0])
+
+    async def _get_item_with_id(self, id):
+        instances = await self._get_items_with_ids([id])
+        if not instances:
+            raise Exception('%s `id` %s  doest`t exist.' % (self.model_class.__name__, id))
+        return instances[0]
+
+    async def _get_items_with_ids(self, ids, batch_size=None):
+        return [instance async for instance in self._iter_items_with_ids(ids, batch_size)]
+
+    async def _iter_items_with_ids(self, ids, batch_size=None):
+        for chunk in self._chunks(ids, batch_size):
+            found, missing = self._get_cached(chunk)
+            if missing:
+                pipe = self.db.pipeline(transaction=False)
+                self._queue_load(pipe, missing)
+                self._found_from_replies(found, missing, await pipe.execute())
+            for instance in self._build_instances(chunk, found):
+                yield instance
+
+    @property
+    async def set(self):
+        if self._shards is not None:
+            raise TypeError("%s is sharded, it has a set per shard" % self.model_class.__name__)
+        return AsyncSet(self.db, await self._set_key())
+
+    async def _set_key(self):
+        indices = self._filter_indices()
+        if len(indices) < 2:
+            return indices[0] if indices else self.key
+        pipe = self.db.pipeline(transaction=False)
+        cached = self._queue_filter_lookup(pipe, indices)
+        version, key = self._looked_up_filter_key(cached, await pipe.execute())
+        if key is None:
+            pipe = self.db.pipeline()
+            key = self._queue_filter_store(pipe, indices, version)
+            await pipe.execute()
+        return key
+
+    async def _ids(self, limit=None):
+        if self._shards is not None:
+            window = self._shard_window(limit)
+            if window is None:
+                return []
+            pipe = self.db.pipeline(transaction=False)
+            positions = self._queue_shard_ids(pipe, window[1])
+            return self._merge_shard_ids(await pipe.execute(), positions, *window)
+        start, num = self._redis_limit(limit)
+        if num == 0:
+            return []
+        set_key = await self._set_key()
+        if not self._ranges and self._order_by is None:
+            return await self.db.sort(set_key, start=start, num=num)
+        pipe = self.db.pipeline()
+        index = self._queue_range_ids(pipe, set_key, start, num)
+        return (await pipe.execute())[index]
+
+    @property
+    @operation('members')
+    async def members(self):
+        return await self._get_items_with_ids(await self._ids())
+
+    @operation('count')
+    async def count(self):
+        if self._shards is not None and self._counts_shards():
+            pipe = self.db.pipeline(transaction=False)
+            positions = [queryset._queue_count(pipe) for queryset in self._shard_querysets()]
+            replies = await pipe.execute()
+            return sum(replies[position] for position in positions)
+        if not self._ranges and self._limit is None:
+            return await self.db.scard(await self._set_key())
+        if self._counts_live_ids():
+            pipe = self.db.pipeline(transaction=False)
+            position = self._queue_count(pipe)
+            return (await pipe.execute())[position]
+        return len(await self._ids())
+
+    async def _scan_live_ids(self, count):
+        if not self._filters:
+            async for id, expiry in self.db.zscan_iter(self.key, count=count):
+                if expiry > time.time():
+                    yield id
+            return
+        chunk = []
+        async for id in self.db.sscan_iter(await self._set_key(), count=count):
+            chunk.append(id)
+            if len(chunk) == count:
+                for live_id in self._live(chunk, await self.db.zmscore(self.key, chunk)):
+                    yield live_id
+                chunk = []
+        if chunk:
+            for live_id in self._live(chunk, await self.db.zmscore(self.key, chunk)):
+                yield live_id
+
+    async def iter_scan(self, count=None, batch_size=None):
+        batch_size = batch_size or self.batch_size
+        if self._reads_pages():
+            start = 0
+            while True:
+                ids = await self._ids(self._window(start, start + batch_size))
+                async for instance in self._iter_items_with_ids(ids, batch_size):
+                    yield instance
+                if len(ids) < batch_size:
+                    return
+                start += batch_size
+        if self._shards is not None:
+            for queryset in self._shard_querysets():
+                async for instance in queryset.iter_scan(count, batch_size):
+                    yield instance
+            return
+        chunk = []
+        if self._expiring:
+            ids = self._scan_live_ids(count or batch_size)
+        else:
+            ids = self.db.sscan_iter(await self._set_key(), count=count or batch_size)
+        async for id in ids:
+            chunk.append(id)
+            if len(chunk) == batch_size:
+                async for instance in self._iter_items_with_ids(chunk, batch_size):
+                    yield instance
+                chunk = []
+        async for instance in self._iter_items_with_ids(chunk, batch_size):
+            yield instance
+
+    def __aiter__(self):
+        return self.iter_scan()
+
+    def __iter__(self):
+        raise TypeError("Use `async for` to iterate an AsyncQueryset")
+
+
+class AsyncModel(Model):
+    """Model whose writes are coroutines, `__database__` must be a `redis.asyncio` client."""
+
+    __abstract__ = True
+    __query_class__ = AsyncQuery
+    __async__ = True
+
+    @operation('save')
+    async def save(self, update_fields=None, ttl=None):
+        self._set_ttl(ttl)
+        if self.__engine__ is not None:
+            changes = self._changes(self._redis_values(), update_fields)
+            if changes is None:
+                await self.__engine__.async_save(self)
+            elif any(changes):
+                await self.__engine__.async_save(self, *changes)
+            self._invalidate_cache()
+            return True
+        if self.is_new():
+            await self._init_id()
+        pipe = self.db.pipeline(transaction=True)
+        stored = self._save(pipe, update_fields)
+        await pipe.execute()
+        self._mark_stored(*stored)
+        self._invalidate_cache()
+        return True
+
+    @classmethod
+    async def save_many(cls, instances, batch_size=None):
+        return await cls.objects.bulk_create(instances, batch_size)
+
+    @operation('delete')
+    async def delete(self):
+        if self.is_new():
+            raise RuntimeError("No such data")
+        if self.__engine__ is not None:
+            await self.__engine__.async_delete(self)
+            self._invalidate_cache()
+            return True
+        pipe = self.db.pipeline(transaction=True)
+        self._delete(pipe)
+        await pipe.execute()
+        self._invalidate_cache()
+        return True
+
+    @operation('update')
+    async def update(self, *args, **kwargs):
+        kwargs.update(*args)
+        amounts = self._amounts(kwargs)
+        self._check_incr(amounts)
+        fields = self._set_fields(kwargs)
+        if not fields and not amounts:
+            return
+        if self.__engine__ is not None and fields:
+            await self.__engine__.async_save(self, fields=fields, ext_fields=())
+            fields = []
+        pipe = self.db.pipeline(transaction=True)
+        stored = self._save(pipe, update_fields=fields) if fields else None
+        positions = self._queue_incr(pipe, amounts)
+        replies = await pipe.execute()
+        if stored is not None:
+            self._mark_stored(*stored)
+        self._incremented(replies, positions)
+        self._invalidate_cache()
+
+    @operation('incr')
+    async def incr(self, field, amount=1):
+        self._check_incr({field: amount})
+        pipe = self.db.pipeline(transaction=True)
+        positions = self._queue_incr(pipe, {field: amount})
+        self._incremented(await pipe.execute(), positions)
+        self._invalidate_cache()
+        return getattr(self, field)
+
+    async def _init_id(self):
+        setattr(self, 'id', str(await self.db.incr(self._key['id']['_sequence'])))
+
+
+__all__ = ['AsyncList', 'AsyncSet', 'AsyncSortedSet', 'AsyncHash',
+           'AsyncQuery', 'AsyncQueryset', 'AsyncModel']
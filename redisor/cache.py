@@ -0,0 +1,108 @@
+import threading
+import time
+from collections import OrderedDict
+from functools import partial
+
+from redis.cluster import RedisCluster
+
+from .storage import BucketStorage
+
+
+class ModelCache:
+    """LRU cache of instance data read from redis, bounded by `maxsize` entries
+    and, if given, by `ttl` seconds. Enable it per model with `__cache__`:
+
+        class Person(Model):
+            __cache__ = ModelCache(maxsize=10000, ttl=30)
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._listeners = []
+
+    def get(self, id):
+        id = str(id)
+        with self._lock:
+            entry = self._data.get(id)
+            if entry is not None:
+                value, deadline = entry
+                if deadline is None or deadline > time.monotonic():
+                    self._data.move_to_end(id)
+                    self.hits += 1
+                    return value
+                del self._data[id]
+            self.misses += 1
+            return None
+
+    def set(self, id, value):
+        deadline = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._data[str(id)] = (value, deadline)
+            self._data.move_to_end(str(id))
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, id):
+        with self._lock:
+            self._data.pop(str(id), None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._data)}
+
+    def listen(self, db, model_class, sleep_time=0.1):
+        """Invalidate entries on keyspace notifications of the model keys, so writes
+        from other processes are seen. The server must publish them, e.g. with
+        `CONFIG SET notify-keyspace-events Kgh$l`. Notifications are published by
+        the node holding the key, a cluster is listened to on each primary.
+        Return the listener threads.
+        """
+        handler = partial(self._on_keyspace_event, model_class)
+        if isinstance(db, RedisCluster):
+            # a cluster only has database 0
+            pubsubs = [db.pubsub(node=node, ignore_subscribe_messages=True) for node in db.get_primaries()]
+            index = 0
+        else:
+            pubsubs = [db.pubsub(ignore_subscribe_messages=True)]
+            index = db.connection_pool.connection_kwargs.get('db', 0)
+        patterns = {'__keyspace@%s__:%s:*' % (index, ns): handler for ns in model_class._namespaces()}
+        for pubsub in pubsubs:
+            pubsub.psubscribe(**patterns)
+            self._listeners.append(pubsub.run_in_thread(sleep_time=sleep_time, daemon=True))
+        return list(self._listeners)
+
+    def stop(self):
+        for listener in self._listeners:
+            listener.stop()
+        self._listeners = []
+
+    def _on_keyspace_event(self, model_class, message):
+        channel = message['channel']
+        if isinstance(channel, bytes):
+            channel = channel.decode()
+        # `__keyspace@0__:<namespace>:id`, `...:id:ext_field` or `...:b:<bucket>`
+        key = channel.split(':', 1)[1]
+        for ns in model_class._namespaces():
+            if key.startswith(ns + ':'):
+                break
+        else:
+            return
+        parts = key[len(ns) + 1:].split(':')
+        storage = model_class.__storage__
+        if isinstance(storage, BucketStorage) and parts[0] == 'b':
+            # a bucket holds many instances, invalidate the cached ones
+            with self._lock:
+                for id in [id for id in self._data if storage.bucket_key(model_class, id) == key]:
+                    del self._data[id]
+        else:
+            self.invalidate(parts[0])
+
+__all__ = ['ModelCache']
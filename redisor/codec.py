@@ -0,0 +1,151 @@
+"""Codecs turning field values into redis values and back.
+
+Give a codec to a field to store it in a compact form:
+
+    class Point(Model):
+        x = IntegerField(name='x', default=0, codec=IntCodec())
+        data = JsonField(name='data', codec=ZlibCodec(MsgpackCodec()))
+
+Binary codecs produce bytes. Their fields are read without decoding the
+responses, while the other fields of the model are still decoded as text, so
+both work over the same `decode_responses=True` connection. Binary fields
+can't be indexed.
+"""
+import json
+import struct
+import zlib
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+
+class Codec:
+
+    # binary codecs return bytes, which are read without decoding
+    binary = False
+
+    def encode(self, value):
+        raise NotImplementedError
+
+    def decode(self, value):
+        raise NotImplementedError
+
+
+class JsonCodec(Codec):
+
+    def encode(self, value):
+        return json.dumps(value)
+
+    def decode(self, value):
+        return json.loads(value)
+
+
+class MsgpackCodec(Codec):
+
+    binary = True
+
+    def __init__(self):
+        if msgpack is None:
+            raise ImportError("MsgpackCodec requires the `msgpack` package")
+
+    def encode(self, value):
+        return msgpack.packb(value, use_bin_type=True)
+
+    def decode(self, value):
+        return msgpack.unpackb(value, raw=False)
+
+
+class StructCodec(Codec):
+    """Pack a number with a `struct` format, e.g. `StructCodec('<i')`"""
+
+    binary = True
+
+    def __init__(self, fmt):
+        self.struct = struct.Struct(fmt)
+
+    def encode(self, value):
+        return self.struct.pack(value)
+
+    def decode(self, value):
+        return self.struct.unpack(value)[0]
+
+
+class IntCodec(StructCodec):
+
+    def __init__(self):
+        super().__init__('<q')
+
+
+class FloatCodec(StructCodec):
+
+    def __init__(self):
+        super().__init__('<d')
+
+
+class CompressedCodec(Codec):
+    """Compress what the `inner` codec returns, or the value itself as bytes
+    if there is none."""
+
+    binary = True
+
+    def __init__(self, inner=None):
+        self.inner = inner
+
+    def encode(self, value):
+        if self.inner is not None:
+            value = self.inner.encode(value)
+        if isinstance(value, str):
+            value = value.encode()
+        return self.compress(value)
+
+    def decode(self, value):
+        value = self.decompress(value)
+        if self.inner is None:
+            return value
+        if not self.inner.binary:
+            value = value.decode()
+        return self.inner.decode(value)
+
+    def compress(self, data):
+        raise NotImplementedError
+
+    def decompress(self, data):
+        raise NotImplementedError
+
+
+class ZlibCodec(CompressedCodec):
+
+    def __init__(self, inner=None, level=6):
+        super().__init__(inner)
+        self.level = level
+
+    def compress(self, data):
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data):
+        return zlib.decompress(data)
+
+
+class Lz4Codec(CompressedCodec):
+
+    def __init__(self, inner=None):
+        if lz4_frame is None:
+            raise ImportError("Lz4Codec requires the `lz4` package")
+        super().__init__(inner)
+
+    def compress(self, data):
+        return lz4_frame.compress(data)
+
+    def decompress(self, data):
+        return lz4_frame.decompress(data)
+
+
+__all__ = ['Codec', 'JsonCodec', 'MsgpackCodec', 'StructCodec', 'IntCodec',
+           'FloatCodec', 'CompressedCodec', 'ZlibCodec', 'Lz4Codec']
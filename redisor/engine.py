@@ -0,0 +1,293 @@
+"""Server-side save/delete/update of models with Lua scripts.
+
+With an engine, each write of an instance is one EVALSHA: the script writes
+the hash, replaces the ext fields and maintains `all`, the index sets and
+range indexes atomically. Ids of new instances are allocated before, like
+`save` does without an engine.
+
+    class Person(Model):
+        __engine__ = LuaEngine()
+
+Every key a script touches is passed in KEYS, index sets of old values
+included: the client sends the indexed values it expects in the hash, and
+the script refuses the write when another writer changed them. The values
+are then read again and the write retried, so concurrent writers can't leave
+stale index entries.
+
+Engine models are single node only: the keys of an instance and of its
+indexes aren't in one hash slot, models on a cluster can't have an engine.
+"""
+import json
+
+from .field import ListField, HashField
+
+# KEYS: the instance key, `all`, the index version, then the keys the data
+# refers to by position. Indices are [name, expected old value or false, new
+# value, position of the old index set or 0, position of the new index set].
+SAVE_SCRIPT = """
+local data = cjson.decode(ARGV[1])
+local key, id = KEYS[1], data.id
+for _, index in ipairs(data.indices) do
+    if redis.call('HGET', key, index[1]) ~= index[2] then
+        return false
+    end
+end
+local changed = false
+for _, index in ipairs(data.indices) do
+    if index[2] ~= index[3] then
+        if index[4] > 0 then
+            redis.call('SREM', KEYS[index[4]], id)
+        end
+        redis.call('SADD', KEYS[index[5]], id)
+        changed = true
+    end
+end
+for _, range in ipairs(data.ranges) do
+    redis.call('ZADD', KEYS[range[2]], range[1], id)
+end
+local h = {'id', id}
+for name, value in pairs(data.fields) do
+    h[#h + 1] = name
+    h[#h + 1] = value
+end
+redis.call('HSET', key, unpack(h))
+for _, ext in ipairs(data.ext) do
+    local ext_key = KEYS[ext[1]]
+    redis.call('DEL', ext_key)
+    if ext[2] == 'list' then
+        if #ext[3] > 0 then
+            redis.call('RPUSH', ext_key, unpack(ext[3]))
+        end
+    else
+        local pairs_ = {}
+        for field, value in pairs(ext[3]) do
+            pairs_[#pairs_ + 1] = field
+            pairs_[#pairs_ + 1] = value
+        end
+        if #pairs_ > 0 then
+            redis.call('HSET', ext_key, unpack(pairs_))
+        end
+    end
+end
+redis.call('SADD', KEYS[2], id)
+if changed then
+    redis.call('INCR', KEYS[3])
+end
+return 1
+"""
+
+# KEYS: the instance key, `all`, the index version, then the keys the data
+# refers to by position. Indices are [name, expected value or false, position
+# of its index set or 0].
+DELETE_SCRIPT = """
+local data = cjson.decode(ARGV[1])
+local key, id = KEYS[1], data.id
+for _, index in ipairs(data.indices) do
+    if redis.call('HGET', key, index[1]) ~= index[2] then
+        return false
+    end
+end
+for _, index in ipairs(data.indices) do
+    if index[3] > 0 then
+        redis.call('SREM', KEYS[index[3]], id)
+    end
+end
+for _, position in ipairs(data.ranges) do
+    redis.call('ZREM', KEYS[position], id)
+end
+for _, position in ipairs(data.ext) do
+    redis.call('DEL', KEYS[position])
+end
+redis.call('SREM', KEYS[2], id)
+if #data.indices > 0 then
+    redis.call('INCR', KEYS[3])
+end
+redis.call('DEL', key)
+return 1
+"""
+
+
+class LuaEngine:
+    """Write models with one script call each, see the module doc."""
+
+    def __init__(self):
+        # Script objects, by name and by sync/async client
+        self._scripts = {}
+
+    def _script(self, db, name, source, is_async=False):
+        script = self._scripts.get((name, is_async))
+        if script is None:
+            script = self._scripts[(name, is_async)] = db.register_script(source)
+        return script
+
+    @staticmethod
+    def check(instance):
+        if instance._binary_fields:
+            raise TypeError("fields with a binary codec can't be saved by LuaEngine")
+        if instance.__storage__.packed:
+            raise TypeError("LuaEngine only writes models stored in hashes")
+        if instance.__ttl__ is not None:
+            raise TypeError("LuaEngine doesn't write expiring models")
+
+    @staticmethod
+    def _keys(instance):
+        keys = [instance.key(), instance._key['all'], instance._key['_indices']['_version']]
+
+        def position(key):
+            keys.append(key)
+            return len(keys)
+        return keys, position
+
+    @staticmethod
+    def stored_indexed(instance):
+        """Return the indexed values the instance was loaded or saved with"""
+        stored = instance._stored_values or {}
+        return {name: stored.get(name) for name in instance._indices}
+
+    @staticmethod
+    def _read_indexed(instance, replies):
+        return dict(zip(instance._indices, replies))
+
+    def save_args(self, instance, old, fields=None, ext_fields=None):
+        """Return the script keys and arguments writing `fields` and `ext_fields`
+        of the instance, all of them by default, expecting the `old` indexed
+        values in the hash."""
+        values = instance._redis_values()
+        if fields is not None:
+            values = {name: values[name] for name in fields}
+        ext_fields = instance._ext_fields if ext_fields is None else ext_fields
+        keys, position = self._keys(instance)
+        indices = []
+        for name in instance._indices:
+            if name not in values:
+                continue
+            expected, new = old.get(name), str(values[name])
+            indices.append([name, False if expected is None else expected, new,
+                            0 if expected is None else position(instance._index_key_for(name, expected)),
+                            position(instance._index_key_for(name, new))])
+        ranges = [[str(values[name]), position(instance._range_index_key_for(name))]
+                  for name in instance._range_indices if name in values]
+        ext = []
+        for name in ext_fields:
+            field, value = instance._ext_fields[name], getattr(instance, name)
+            if isinstance(field, ListField):
+                ext.append([position(instance.key()[name]), 'list', [str(v) for v in value]])
+            elif isinstance(field, HashField):
+                ext.append([position(instance.key()[name]), 'hash', {k: str(v) for k, v in value.items()}])
+            else:
+                raise TypeError("%s can't be saved by LuaEngine" % field.__class__.__name__)
+        data = {
+            'id': instance.id,
+            'fields': {name: str(value) for name, value in values.items()},
+            'indices': indices,
+            'ranges': ranges,
+            'ext': ext,
+        }
+        return keys, [json.dumps(data)], values
+
+    def delete_args(self, instance, old):
+        keys, position = self._keys(instance)
+        indices = []
+        for name in instance._indices:
+            expected = old.get(name)
+            indices.append([name, False if expected is None else expected,
+                            0 if expected is None else position(instance._index_key_for(name, expected))])
+        data = {
+            'id': instance.id,
+            'indices': indices,
+            'ranges': [position(instance._range_index_key_for(name)) for name in instance._range_indices],
+            'ext': [position(instance.key()[name]) for name in instance._ext_fields],
+        }
+        return keys, [json.dumps(data)]
+
+    def save(self, instance, fields=None, ext_fields=None):
+        self.check(instance)
+        if instance.is_new():
+            instance._init_id()
+        script = self._script(instance.db, 'save', SAVE_SCRIPT)
+        old = self.stored_indexed(instance)
+        while True:
+            keys, args, values = self.save_args(instance, old, fields, ext_fields)
+            if script(keys=keys, args=args, client=instance.db):
+                break
+            # another writer changed an indexed value, retry with the one in redis
+            old = self._read_indexed(instance, instance.db.hmget(instance.key(), list(instance._indices)))
+        self._saved(instance, values, ext_fields)
+
+    def save_many(self, db, instances):
+        """Save instances whose ids are set with one pipeline of script calls,
+        writing the changes of loaded instances only"""
+        script = self._script(db, 'save', SAVE_SCRIPT)
+        pipe = db.pipeline(transaction=False)
+        queued = []
+        for instance in instances:
+            self.check(instance)
+            changes = instance._changes(instance._redis_values())
+            if changes is not None and not any(changes):
+                continue
+            fields, ext_fields = changes or (None, None)
+            keys, args, values = self.save_args(instance, self.stored_indexed(instance), fields, ext_fields)
+            script(keys=keys, args=args, client=pipe)
+            queued.append((instance, fields, ext_fields, values))
+        for (instance, fields, ext_fields, values), done in zip(queued, pipe.execute()):
+            if done:
+                self._saved(instance, values, ext_fields)
+            else:
+                self.save(instance, fields, ext_fields)
+
+    def delete(self, instance):
+        script = self._script(instance.db, 'delete', DELETE_SCRIPT)
+        old = self.stored_indexed(instance)
+        while True:
+            keys, args = self.delete_args(instance, old)
+            if script(keys=keys, args=args, client=instance.db):
+                break
+            old = self._read_indexed(instance, instance.db.hmget(instance.key(), list(instance._indices)))
+
+    async def async_save(self, instance, fields=None, ext_fields=None):
+        self.check(instance)
+        if instance.is_new():
+            await instance._init_id()
+        script = self._script(instance.db, 'save', SAVE_SCRIPT, is_async=True)
+        old = self.stored_indexed(instance)
+        while True:
+            keys, args, values = self.save_args(instance, old, fields, ext_fields)
+            if await script(keys=keys, args=args, client=instance.db):
+                break
+            old = self._read_indexed(instance, await instance.db.hmget(instance.key(), list(instance._indices)))
+        self._saved(instance, values, ext_fields)
+
+    async def async_save_many(self, db, instances):
+        script = self._script(db, 'save', SAVE_SCRIPT, is_async=True)
+        pipe = db.pipeline(transaction=False)
+        queued = []
+        for instance in instances:
+            self.check(instance)
+            changes = instance._changes(instance._redis_values())
+            if changes is not None and not any(changes):
+                continue
+            fields, ext_fields = changes or (None, None)
+            keys, args, values = self.save_args(instance, self.stored_indexed(instance), fields, ext_fields)
+            await script(keys=keys, args=args, client=pipe)
+            queued.append((instance, fields, ext_fields, values))
+        for (instance, fields, ext_fields, values), done in zip(queued, await pipe.execute()):
+            if done:
+                self._saved(instance, values, ext_fields)
+            else:
+                await self.async_save(instance, fields, ext_fields)
+
+    async def async_delete(self, instance):
+        script = self._script(instance.db, 'delete', DELETE_SCRIPT, is_async=True)
+        old = self.stored_indexed(instance)
+        while True:
+            keys, args = self.delete_args(instance, old)
+            if await script(keys=keys, args=args, client=instance.db):
+                break
+            old = self._read_indexed(instance, await instance.db.hmget(instance.key(), list(instance._indices)))
+
+    @staticmethod
+    def _saved(instance, values, ext_fields=None):
+        instance._mark_stored(values, instance._ext_fields if ext_fields is None else ext_fields)
+
+
+__all__ = ['LuaEngine']
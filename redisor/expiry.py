@@ -0,0 +1,69 @@
+"""Expiring models, declared with `__ttl__` seconds:
+
+    class Session(Model):
+        __ttl__ = 3600
+        user = StringField(name='user', index=True)
+
+    session.save()            # lives an hour from now
+    session.save(ttl=60)      # this instance lives a minute after each save
+
+Each save expires the instance key and its ext field keys in the same pipeline,
+and scores its id in the `all` zset by the time it expires. Querysets only read
+ids scored after now, so expired instances are skipped right away.
+
+Index sets and range indexes don't expire: the ids of expired instances are
+removed from them, and from `all`, by `Model.objects.reap()`, or by a `Reaper`
+in the background:
+
+    reaper = Reaper(Session, interval=60)
+    reaper.start()
+
+Expiry is scored with the clock of the client, keep the clocks of the clients
+and of the server in sync.
+"""
+import threading
+
+from .logcenter import logger
+
+
+class Reaper:
+    """Reap the expired instances of models every `interval` seconds, in a daemon thread"""
+
+    def __init__(self, *model_classes, interval=60, batch_size=None):
+        for model_class in model_classes:
+            if model_class.__ttl__ is None:
+                raise ValueError("%s doesn't expire, set its __ttl__" % model_class.__name__)
+        self.model_classes = model_classes
+        self.interval = interval
+        self.batch_size = batch_size
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def reap(self):
+        """Reap every model once, return the number of ids removed by model name"""
+        return {model_class.__name__: model_class.objects.reap(self.batch_size)
+                for model_class in self.model_classes}
+
+    def start(self):
+        if self._thread is not None:
+            raise RuntimeError("the reaper is already running")
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='redisor-reaper', daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self, timeout=None):
+        if self._thread is not None:
+            self._stopped.set()
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.reap()
+            except Exception:
+                logger.exception('reaping expired instances failed')
+
+
+__all__ = ['Reaper']
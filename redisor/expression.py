@@ -0,0 +1,21 @@
+class F:
+    """The stored value of a field plus an amount, applied atomically by
+    `Model.update`, e.g. `person.update(score=F('score') + 10)`."""
+
+    def __init__(self, name, amount=0):
+        self.name = name
+        self.amount = amount
+
+    def __add__(self, amount):
+        return F(self.name, self.amount + amount)
+
+    __radd__ = __add__
+
+    def __sub__(self, amount):
+        return F(self.name, self.amount - amount)
+
+    def __repr__(self):
+        return "F(%r) + %r" % (self.name, self.amount)
+
+
+__all__ = ['F']
@@ -1,27 +1,59 @@
-import json
+import random
 
+from redis.client import NEVER_DECODE
+
+from .codec import JsonCodec
 from .structure import List
 
 
 class Field:
 
-    def __init__(self, name, column_type, default, required=False):
+    def __init__(self, name, column_type, default, required=False, index=False,
+                 range_index=False, codec=None):
+        if codec is not None and codec.binary and (index or range_index):
+            raise ValueError("fields with a binary codec can't be indexed")
         self.name = name
         self.column_type = column_type
         self.default = default
         self.required = required
+        self.index = index
+        self.range_index = range_index
+        self.codec = codec
         self.model_class = None
 
+    @property
+    def binary(self):
+        return self.codec is not None and self.codec.binary
+
     def add_to_class(self, model_class, name):
         self.model_class = model_class
         self.name = name
 
+    def __get__(self, instance, owner):
+        # only reached when the instance has no value: load a deferred field
+        if instance is None:
+            return self
+        if self.name not in instance._deferred:
+            return None
+        if instance.__async__:
+            raise AttributeError("%s was deferred, async models can't load it lazily" % self.name)
+        options = {NEVER_DECODE: []} if self.binary else {}
+        raw = instance.db.execute_command('HGET', instance.key(), self.name, **options)
+        value = self.python_value(raw) if raw is not None else None
+        instance.__dict__[self.name] = value
+        instance._stored_values[self.name] = raw
+        return value
+
     def redis_value(self, value):
         if self.column_type and callable(self.column_type):
-            return self.column_type(value)
+            value = self.column_type(value)
+        if self.codec is not None:
+            return self.codec.encode(value)
         return value
 
     def python_value(self, value):
+        if self.codec is not None:
+            return self.codec.decode(value)
         if self.column_type and callable(self.column_type):
             return self.column_type(value)
         return value
@@ -46,16 +78,44 @@ class ExtField:
         self.model_class = model_class
         self.name = name
 
+    def __get__(self, instance, owner):
+        # only reached when the instance has no value: load it on first access
+        if instance is None:
+            return self
+        if instance.is_new():
+            return None
+        if instance.__async__:
+            raise AttributeError("%s is not loaded, prefetch it on async models" % self.name)
+        value = self.python_value(self.load(instance.key()[self.name]))
+        instance.__dict__[self.name] = value
+        instance._stored_ext[self.name] = self.snapshot(value)
+        return value
+
     def save(self, pipe, key, value):
-        """save ext_field
+        """save ext_field, replacing what is stored
         """
         raise NotImplementedError
 
-    def load(self, key):
-        """load ext_field
+    def save_changes(self, pipe, key, old, value):
+        """save the changes of ext_field since `old`, the snapshot of what is stored
+        """
+        self.save(pipe, key, value)
+
+    def snapshot(self, value):
+        """return a copy of the value as it is stored, to compare it later
         """
         raise NotImplementedError
 
+    def load(self, key, pipe=None):
+        """load ext_field, queue the command into `pipe` if given
+        """
+        raise NotImplementedError
+
+    def python_value(self, reply):
+        """return the value of ext_field from the reply of `load`
+        """
+        return reply
+
     # def __repr__(self):
     #     return '<%s:%s> ' % (
     #         self.__class__.__name__,
@@ -66,28 +126,28 @@ class ExtField:
 
 class StringField(Field):
 
-    def __init__(self, name=None, default=None):
-        super().__init__(name, str, default)
+    def __init__(self, name=None, default=None, index=False, codec=None):
+        super().__init__(name, str, default, index=index, codec=codec)
 
 
 class JsonField(Field):
 
-    def __init__(self, name=None, default=None):
+    def __init__(self, name=None, default=None, index=False, codec=None):
         if default is None:
             default = {}
-        super().__init__(name, 'json', default)
+        super().__init__(name, 'json', default, index=index, codec=codec or JsonCodec())
 
-    def python_value(self, value):
-        return json.loads(value)
 
-    def redis_value(self, value):
-        return json.dumps(value)
+class IntegerField(Field):
 
+    def __init__(self, name=None,  default=None, index=False, range_index=False, codec=None):
+        super().__init__(name, int, default, index=index, range_index=range_index, codec=codec)
 
-class IntegerField(Field):
 
-    def __init__(self, name=None,  default=None):
-        super().__init__(name, int, default)
+class FloatField(Field):
+
+    def __init__(self, name=None, default=None, index=False, range_index=False, codec=None):
+        super().__init__(name, float, default, index=index, range_index=range_index, codec=codec)
 
 
 class AutoIncrementField(IntegerField):
@@ -117,30 +177,96 @@ class AutoIncrementField(IntegerField):
 class ListField(ExtField):
 
     def __init__(self, name, default=None):
-        self.name = name
-        self.default = default if default is not None else []
-        super(ListField, self).__init__(self, name, default)
+        default = default if default is not None else []
+        super(ListField, self).__init__(name, default)
 
     def save(self, pipe, key, value):
-        pipe.rpush(key, *value)
+        pipe.delete(key)
+        if value:
+            pipe.rpush(key, *value)
+
+    def save_changes(self, pipe, key, old, value):
+        new = self.snapshot(value)
+        if old is not None and new[:len(old)] == old:
+            if len(new) > len(old):
+                pipe.rpush(key, *new[len(old):])
+            return
+        self.save(pipe, key, value)
 
-    def load(self, key):
-        return self.model_class.__database__.lrange(key, 0, -1)
+    def snapshot(self, value):
+        return [str(v) for v in value]
+
+    def load(self, key, pipe=None):
+        db = pipe if pipe is not None else self.model_class.__database__
+        return db.lrange(key, 0, -1)
 
 
 class HashField(ExtField):
 
     def __init__(self, name, default=None):
-        self.name = name
-        self.default = default if default is not None else {}
-        super(HashField, self).__init__(self, name, default)
+        default = default if default is not None else {}
+        super(HashField, self).__init__(name, default)
+
+    def save(self, pipe, key, value):
+        pipe.delete(key)
+        if value:
+            pipe.hmset(key, value)
+
+    def save_changes(self, pipe, key, old, value):
+        if old is None:
+            return self.save(pipe, key, value)
+        new = self.snapshot(value)
+        changed = {k: v for k, v in new.items() if old.get(k) != v}
+        removed = [k for k in old if k not in new]
+        if changed:
+            pipe.hmset(key, changed)
+        if removed:
+            pipe.hdel(key, *removed)
+
+    def snapshot(self, value):
+        return {str(k): str(v) for k, v in value.items()}
+
+    def load(self, key, pipe=None):
+        db = pipe if pipe is not None else self.model_class.__database__
+        return db.hgetall(key)
+
+
+class CounterField(ExtField):
+    """A counter summed over `shards` fields of its own hash, each increment
+    goes to a random shard so hot counters don't contend on one field.
+    Changes of the value are saved as increments.
+    """
+
+    def __init__(self, name=None, default=0, shards=8):
+        super().__init__(name, default)
+        self.shards = shards
+
+    def incr(self, pipe, key, amount):
+        """queue the increment, and the read of the shards"""
+        pipe.hincrby(key, random.randrange(self.shards), amount)
+        pipe.hvals(key)
 
     def save(self, pipe, key, value):
-        pipe.hmset(key, value)
+        pipe.delete(key)
+        if value:
+            pipe.hset(key, 0, int(value))
+
+    def save_changes(self, pipe, key, old, value):
+        if old is None:
+            return self.save(pipe, key, value)
+        if int(value) != old:
+            pipe.hincrby(key, random.randrange(self.shards), int(value) - old)
+
+    def snapshot(self, value):
+        return int(value)
+
+    def load(self, key, pipe=None):
+        db = pipe if pipe is not None else self.model_class.__database__
+        return db.hvals(key)
 
-    def load(self, key):
-        return self.model_class.__database__.hgetall(key)
+    def python_value(self, reply):
+        return sum(int(v) for v in reply)
 
 
 __all__ = ['Field', 'ExtField', 'StringField', 'AutoIncrementField',
-           'IntegerField', 'ListField', 'HashField', 'JsonField']
+           'IntegerField', 'FloatField', 'ListField', 'HashField', 'CounterField', 'JsonField']
@@ -0,0 +1,246 @@
+"""Instrumentation of redisor, disabled by default.
+
+Only the clients made by `Client.db()`/`async_db()`, or given to `attach`, are
+instrumented: their class is swapped for a subclass reporting round trips.
+While disabled, ORM operations and those round trips only check a flag. Once
+enabled:
+
+- pre hooks are called with `(command, args)` before each redis round trip,
+  post hooks with `(command, args, duration)` after it. A pipeline is one
+  round trip named `PIPELINE`, its args are the queued commands.
+- `counters` counts ORM operations per `(model, operation)`.
+- operations slower than `slow_threshold` seconds are logged as warnings.
+
+    from redisor import instrument
+    instrument.add_hook(post=lambda command, args, duration: ...)
+    instrument.enable(slow_threshold=0.05)
+"""
+import contextvars
+import inspect
+import time
+from collections import Counter
+from functools import wraps
+
+import redis.client
+import redis.cluster
+try:
+    import redis.asyncio.client as async_client
+    import redis.asyncio.cluster as async_cluster
+except ImportError:
+    async_client = async_cluster = None
+
+from .logcenter import logger
+
+
+class Instrumentation:
+
+    def __init__(self):
+        self.enabled = False
+        self.pre_hooks = []
+        self.post_hooks = []
+        self.counters = Counter()
+        self.slow_threshold = None
+
+
+instrumentation = Instrumentation()
+# the (model, operation) being executed, seen by command hooks
+_operation = contextvars.ContextVar('redisor_operation', default=None)
+# instrumented subclasses of redis clients and pipelines, by class
+_subclasses = {}
+
+
+def enable(slow_threshold=None):
+    instrumentation.slow_threshold = slow_threshold
+    instrumentation.enabled = True
+
+
+def disable():
+    instrumentation.enabled = False
+
+
+def attach(client):
+    """Report the round trips of `client` and of its pipelines, return the client"""
+    client.__class__ = _subclass(type(client), _client_methods(client))
+    return client
+
+
+def add_hook(pre=None, post=None):
+    if pre is not None:
+        instrumentation.pre_hooks.append(pre)
+    if post is not None:
+        instrumentation.post_hooks.append(post)
+
+
+def remove_hook(pre=None, post=None):
+    if pre in instrumentation.pre_hooks:
+        instrumentation.pre_hooks.remove(pre)
+    if post in instrumentation.post_hooks:
+        instrumentation.post_hooks.remove(post)
+
+
+def reset():
+    instrumentation.counters.clear()
+
+
+def current_operation():
+    """Return the (model, operation) running in this context, or None"""
+    return _operation.get()
+
+
+def operation(name):
+    """Decorate an ORM method as an operation named `name` of its model."""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(self, *args, **kwargs):
+                if not instrumentation.enabled:
+                    return await func(self, *args, **kwargs)
+                op, token, start = _enter(self, name)
+                try:
+                    return await func(self, *args, **kwargs)
+                finally:
+                    _exit(op, token, start)
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(self, *args, **kwargs):
+            if not instrumentation.enabled:
+                return func(self, *args, **kwargs)
+            op, token, start = _enter(self, name)
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                _exit(op, token, start)
+        return wrapper
+    return decorator
+
+
+def _enter(obj, name):
+    model_class = getattr(obj, 'model_class', None) or type(obj)
+    op = (model_class.__name__, name)
+    instrumentation.counters[op] += 1
+    # nested operations are accounted to the outermost one
+    token = _operation.set(op) if _operation.get() is None else None
+    return op, token, time.perf_counter()
+
+
+def _exit(op, token, start):
+    duration = time.perf_counter() - start
+    if token is not None:
+        _operation.reset(token)
+    threshold = instrumentation.slow_threshold
+    if threshold is not None and duration >= threshold:
+        logger.warning("slow operation %s.%s took %.2fms", op[0], op[1], duration * 1000)
+
+
+def _before(command, args):
+    for hook in instrumentation.pre_hooks:
+        hook(command, args)
+    return time.perf_counter()
+
+
+def _after(command, args, start):
+    duration = time.perf_counter() - start
+    for hook in instrumentation.post_hooks:
+        hook(command, args, duration)
+
+
+def _pipeline_commands(pipe):
+    if isinstance(pipe, redis.cluster.ClusterPipeline):
+        return [command.args for command in pipe._execution_strategy.command_queue]
+    if async_cluster is not None and isinstance(pipe, async_cluster.ClusterPipeline):
+        return [command.args for command in pipe._execution_strategy._command_queue]
+    return [args for args, _ in pipe.command_stack]
+
+
+def _is_async(client):
+    return async_client is not None and isinstance(client, (async_client.Redis, async_cluster.RedisCluster))
+
+
+def _client_methods(client):
+    if _is_async(client):
+        return {'execute_command': _wrap_async_execute_command, 'pipeline': _wrap_pipeline}
+    return {'execute_command': _wrap_execute_command, 'pipeline': _wrap_pipeline}
+
+
+def _subclass(cls, methods):
+    """Return the subclass of `cls` whose `methods` are wrapped. It adds no
+    slot, so instances of `cls` can take it as their class. Wrappers look the
+    methods of `cls` up on each call, methods patched on it later still run."""
+    if cls in _subclasses.values():
+        # already instrumented
+        return cls
+    if cls not in _subclasses:
+        attrs = {'__slots__': (), '__module__': __name__}
+        for name, wrap in methods.items():
+            attrs[name] = wrap(cls, name)
+        _subclasses[cls] = type(cls.__name__, (cls,), attrs)
+    return _subclasses[cls]
+
+
+def _wrap_pipeline(cls, name):
+    def wrapped(self, *args, **kwargs):
+        pipe = getattr(cls, name)(self, *args, **kwargs)
+        wrap = _wrap_async_pipeline_execute if _is_async(self) else _wrap_pipeline_execute
+        pipe.__class__ = _subclass(type(pipe), {'execute': wrap})
+        return pipe
+    return wrapped
+
+
+def _wrap_execute_command(cls, name):
+    def wrapped(self, *args, **options):
+        execute_command = getattr(cls, name)
+        if not instrumentation.enabled:
+            return execute_command(self, *args, **options)
+        start = _before(args[0], args[1:])
+        try:
+            return execute_command(self, *args, **options)
+        finally:
+            _after(args[0], args[1:], start)
+    return wrapped
+
+
+def _wrap_pipeline_execute(cls, name):
+    def wrapped(self, *args, **kwargs):
+        execute = getattr(cls, name)
+        commands = _pipeline_commands(self) if instrumentation.enabled else None
+        if not commands:
+            # disabled, or nothing is sent
+            return execute(self, *args, **kwargs)
+        start = _before('PIPELINE', commands)
+        try:
+            return execute(self, *args, **kwargs)
+        finally:
+            _after('PIPELINE', commands, start)
+    return wrapped
+
+
+def _wrap_async_execute_command(cls, name):
+    async def wrapped(self, *args, **options):
+        execute_command = getattr(cls, name)
+        if not instrumentation.enabled:
+            return await execute_command(self, *args, **options)
+        start = _before(args[0], args[1:])
+        try:
+            return await execute_command(self, *args, **options)
+        finally:
+            _after(args[0], args[1:], start)
+    return wrapped
+
+
+def _wrap_async_pipeline_execute(cls, name):
+    async def wrapped(self, *args, **kwargs):
+        execute = getattr(cls, name)
+        commands = _pipeline_commands(self) if instrumentation.enabled else None
+        if not commands:
+            return await execute(self, *args, **kwargs)
+        start = _before('PIPELINE', commands)
+        try:
+            return await execute(self, *args, **kwargs)
+        finally:
+            _after('PIPELINE', commands, start)
+    return wrapped
+
+
+__all__ = ['enable', 'disable', 'attach', 'add_hook', 'remove_hook', 'reset',
+           'current_operation', 'operation', 'instrumentation']
@@ -1,10 +1,8 @@
 import logging
 
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(filename)s[line:%(lineno)d] - %(levelname)s: %(message)s')
-
+# the host application configures logging, redisor only emits records
 logger = logging.getLogger('redisor')
+logger.addHandler(logging.NullHandler())
 
 
 __all__ = ["logger"]
@@ -1,9 +1,24 @@
+import copy
+import time
+import zlib
+from functools import partial
+from types import MappingProxyType
+
 from redis import Redis
-from . import get_client
+from redis.asyncio.cluster import RedisCluster as AsyncRedisCluster
+from redis.cluster import RedisCluster
+from . import get_router
 from .logcenter import logger
+from .instrument import operation
+from .codec import *
 from .field import *
 from .structure import *
 from .query import *
+from .cache import *
+from .engine import *
+from .expression import *
+from .storage import *
+from .expiry import *
 
 
 class Database(Redis):
@@ -29,21 +44,97 @@ class Database(Redis):
         return SortedSet(self, key)
 
 
+def _stored_form(value):
+    """Return a redis value as it is read back, binary values are read as bytes"""
+    return value if isinstance(value, bytes) else str(value)
+
+
+def _is_plain(field):
+    """Whether a field converts values with its str/int/float column type only,
+    its redis value is then already a python value"""
+    return (field.codec is None and field.column_type in (str, int, float)
+            and type(field).redis_value is Field.redis_value
+            and type(field).python_value is Field.python_value)
+
+
+def _codec_plans(fields):
+    """Return the (name, python_value) decoders of fields read from redis and
+    the (name, redis_value, python_value) encoders of fields written to redis.
+    Plain fields convert with their column type directly, and python_value is
+    None when there is nothing to convert."""
+    decoders, encoders = [], []
+    for name, field in fields.items():
+        if _is_plain(field):
+            column_type = field.column_type
+            decoders.append((name, None if column_type is str else column_type))
+            encoders.append((name, column_type, None))
+        else:
+            decoders.append((name, field.python_value))
+            encoders.append((name, field.redis_value, field.python_value))
+    return tuple(decoders), tuple(encoders)
+
+
+def _default_plans(defaults):
+    """Split defaults into the values shared by instances, and the factories
+    of the others: callables, and copies of mutable values"""
+    static, factories = {}, []
+    for name, default in defaults.items():
+        if callable(default):
+            factories.append((name, default))
+        elif isinstance(default, (list, dict, set)):
+            factories.append((name, partial(copy.deepcopy, default)))
+        else:
+            static[name] = default
+    return static, tuple(factories)
+
+
+def _shard_keys(model_class, database):
+    """Return the namespaces of the shards of a model on `database`, None to keep
+    all its keys in one namespace"""
+    shards = model_class.__shards__
+    if shards is None and isinstance(database, (RedisCluster, AsyncRedisCluster)):
+        shards = model_class.cluster_shards
+    if not shards:
+        return None
+    name = model_class._key
+    return tuple(Key('{%s:%d}' % (name, shard)) for shard in range(shards))
+
+
+def _set_database(model_class, database):
+    """Set the database of a model along with the key layout it needs there.
+    Keys already written with another layout aren't moved."""
+    shard_keys = _shard_keys(model_class, database)
+    if shard_keys is not None and model_class.__engine__ is not None:
+        raise TypeError("LuaEngine is single node only, it can't write the sharded keys of %s"
+                        % model_class.__name__)
+    model_class.__database__ = database
+    model_class._shard_keys = shard_keys
+
+
 class BaseModelMeta(type):
+    # every declared model, routed again when `setup` gets a new router
+    models = []
+
     def __new__(mcs, name, bases, attrs):
-        if name == "Model":
+        if name == "Model" or attrs.get('__abstract__'):
             return type.__new__(mcs, name, bases, attrs)
 
         ext_fields = dict()
         fields = dict()
+        indices = dict()
+        range_indices = dict()
         defaults = dict()
 
         for k, v in attrs.items():
             if not isinstance(v, (Field, ExtField)):
                 continue
-            logger.info(' found mapping: %s ==> %s' % (k, v))
+            logger.debug('found mapping: %s ==> %s', k, v)
             if isinstance(v, Field):
                 fields[k] = v
+                if v.index:
+                    indices[k] = v
+                if v.range_index:
+                    range_indices[k] = v
             else:
                 ext_fields[k] = v
             if v.default is not None:
@@ -52,14 +143,28 @@ class BaseModelMeta(type):
         model_class = super(BaseModelMeta, mcs).__new__(mcs, name, bases, attrs)
         model_class._fields = fields
         model_class._ext_fields = ext_fields
+        model_class._indices = indices
+        model_class._range_indices = range_indices
         model_class._defaults = defaults
+        model_class._fields_view = MappingProxyType(fields)
+        model_class._decoders, model_class._encoders = _codec_plans(fields)
+        model_class._static_defaults, model_class._default_factories = _default_plans(defaults)
+        model_class._binary_fields = frozenset(k for k, v in fields.items() if v.binary)
         model_class._key = Key(name)
+        if model_class.__ttl__ is not None and isinstance(model_class.__storage__, BucketStorage):
+            raise TypeError("%s expires its instances, it can't use BucketStorage" % name)
         # Add Queryset for model_class
-        model_class.objects = Query(model_class)
+        model_class.objects = model_class.__query_class__(model_class)
 
         for key, value in attrs.items():
             if isinstance(value, (Field, ExtField)):
                 value.add_to_class(model_class, key)
+
+        mcs.models.append(model_class)
+        if get_router() is not None:
+            get_router().route(model_class)
+        # the key layout follows the database, routing the model again recomputes it
+        _set_database(model_class, model_class.__database__)
         return model_class
 
 
@@ -67,22 +172,74 @@ class Model(object, metaclass=BaseModelMeta):
 
     __database__ = None
     __namespace__ = None
+    # an optional ModelCache of instances read by querysets
+    __cache__ = None
+    __query_class__ = Query
+    # an optional LuaEngine writing instances with one server-side script each,
+    # on a single redis node
+    __engine__ = None
+    # async models need a `redis.asyncio` client
+    __async__ = False
+    # how instances are laid out in redis, see `redisor.storage`
+    __storage__ = HashStorage()
+    # seconds instances live after each save, None keeps them forever. The
+    # `all` set of expiring models is a zset scored by expiry, see `save(ttl=)`
+    __ttl__ = None
+    # Number of shards of the keys of instances, `all` and the index sets. Each
+    # shard is a namespace hash tagged into one slot, `{Model:3}:42`, so the
+    # multi-key commands of a shard run on one node of a redis cluster and
+    # querysets merge the replies of the shards. Models declared on a cluster
+    # client get `cluster_shards` shards, others keep one namespace: `Model:42`.
+    __shards__ = None
+    cluster_shards = 16
+    _shard_keys = None
+    # fields left out by `Queryset.only()`/`defer()`, loaded on first access
+    _deferred = frozenset()
 
     def __init__(self, **kwargs):
+        d = self.__dict__
+        # values of fields as they are stored in redis, None until loaded or saved
+        d['_stored_values'] = None
+        d['_stored_ext'] = {}
         self._load_default_dict()
         for k, v in kwargs.items():
-            setattr(self, k, v)
+            if k in self._fields or k in self._ext_fields:
+                d[k] = v
+            else:
+                setattr(self, k, v)
 
     def _load_default_dict(self):
         """获取字段的默认值
         假如默认值是可调用的函数，例如，default=time.now,则获取当前时间
         获取默认值应该仅在初始化字段的值之前调用
         """
-        for field_name, default in self._defaults.items():
-            if callable(default):
-                default = default()
-            logger.info("Set default %s ==> %s" % (field_name, default))
-            setattr(self, field_name, default)
+        d = self.__dict__
+        d.update(self._static_defaults)
+        for field_name, factory in self._default_factories:
+            d[field_name] = factory()
+
+    @classmethod
+    def from_redis(cls, id, raw_data, ext_data=None, deferred=frozenset()):
+        """Build an instance from the redis values of its fields and the values
+        of its loaded ext fields, without running `__init__`."""
+        instance = cls.__new__(cls)
+        d = instance.__dict__
+        stored = {}
+        for name, decode in cls._decoders:
+            if name in deferred:
+                continue
+            value = stored[name] = raw_data.get(name)
+            d[name] = value if value is None or decode is None else decode(value)
+        d['_id'] = str(id)
+        d['_stored_values'] = stored
+        d['_stored_ext'] = {}
+        if ext_data:
+            d.update(ext_data)
+            d['_stored_ext'] = {name: cls._ext_fields[name].snapshot(value)
+                                for name, value in ext_data.items()}
+        if deferred:
+            d['_deferred'] = deferred
+        return instance
 
     @property
     def db(cls):
@@ -90,10 +247,22 @@ class Model(object, metaclass=BaseModelMeta):
 
     @property
     def fields(self):
-        return dict(self._fields)
+        return self._fields_view
 
     def key(self):
-        return self._key[self.id]
+        return self._namespace(self.id)[self.id]
+
+    @classmethod
+    def _namespace(cls, id):
+        """Return the namespace of the keys of an instance, of the `all` set and
+        of the index sets holding its id"""
+        if cls._shard_keys is None:
+            return cls._key
+        return cls._shard_keys[zlib.crc32(str(id).encode()) % len(cls._shard_keys)]
+
+    @classmethod
+    def _namespaces(cls):
+        return cls._shard_keys or (cls._key,)
 
     @property
     def id(self):
@@ -103,49 +272,253 @@ class Model(object, metaclass=BaseModelMeta):
     def id(self, val):
         setattr(self, '_id', str(val))
 
-    def save(self):
-        """Use pipeline to ensure atomicity
-
+    @operation('save')
+    def save(self, update_fields=None, ttl=None):
+        """Written with one MULTI/EXEC, the keys of an instance are in one hash
+        slot of clusters.
+        Once loaded or saved, only the fields changed since are written,
+        `update_fields` writes the given fields instead. New instances are
+        written whole, whatever `update_fields`.
+        Instances of expiring models live `ttl` seconds after each save,
+        `__ttl__` by default. The given `ttl` is kept by the instance.
         """
+        self._set_ttl(ttl)
+        if self.__engine__ is not None:
+            self._engine_save(update_fields)
+            self._invalidate_cache()
+            return True
         if self.is_new():
             self._init_id()
-        pipe = self.db.pipeline()
-        self._create_membership(pipe)
-        h = self._save_ext_fields(pipe)
-        h[id] = self.id
-        for k, v in self.fields.items():
-            logger.info("%s ==> %s" % (k, v))
-            print("%s == > %s" % (k, getattr(self, k)))
-            h[k] = v.redis_value(getattr(self, k))
-            setattr(self, k, v.python_value(h[k]))
-        pipe.hmset(self.key(), h)
+        pipe = self.db.pipeline(transaction=True)
+        stored = self._save(pipe, update_fields)
         pipe.execute()
+        self._mark_stored(*stored)
+        self._invalidate_cache()
         return True
 
+    @classmethod
+    def save_many(cls, instances, batch_size=None):
+        return cls.objects.bulk_create(instances, batch_size)
+
+    def _save(self, pipe, update_fields=None):
+        """Queue the writes of the instance into `pipe`, the id must be set.
+        Return the arguments of `_mark_stored`, called once `pipe` is executed.
+        """
+        values = self._redis_values()
+        changes = self._changes(values, update_fields)
+        if changes is None:
+            self._create_membership(pipe)
+            h = self._save_ext_fields(pipe)
+            h['id'] = self.id
+            h.update(values)
+            ext_fields = list(self._ext_fields)
+        else:
+            fields, ext_fields = changes
+            h = {name: values[name] for name in fields}
+            for name in ext_fields:
+                field, value = self._ext_fields[name], getattr(self, name)
+                if update_fields is None:
+                    field.save_changes(pipe, self.key()[name], self._stored_ext.get(name), value)
+                else:
+                    field.save(pipe, self.key()[name], value)
+        if h:
+            self.__storage__.write(pipe, self, h, values)
+            self._save_indices(pipe, h)
+        if self.__ttl__ is not None:
+            self._save_expiry(pipe)
+        return values if changes is None else h, ext_fields
+
+    def _set_ttl(self, ttl):
+        if ttl is None:
+            return
+        if self.__ttl__ is None:
+            raise ValueError("%s doesn't expire, set its __ttl__ first" % self.__class__.__name__)
+        self.__dict__['_ttl'] = ttl
+
+    def _save_expiry(self, pipe):
+        """Queue the expiry of the instance and of its ext fields, and score its
+        id in `all` by the time it expires"""
+        ttl = self.__dict__.get('_ttl', self.__ttl__)
+        self.__storage__.expire(pipe, self, ttl)
+        for name in self._ext_fields:
+            pipe.expire(self.key()[name], ttl)
+        pipe.zadd(self._namespace(self.id)['all'], {self.id: time.time() + ttl})
+
+    def _engine_save(self, update_fields=None):
+        changes = self._changes(self._redis_values(), update_fields)
+        if changes is None:
+            self.__engine__.save(self)
+        elif any(changes):
+            self.__engine__.save(self, *changes)
+
+    def _changes(self, values, update_fields=None):
+        """Return the names of the fields and ext fields to write, or None to write
+        the whole instance."""
+        if self._stored_values is None:
+            # nothing stored yet, writing some fields only would leave a partial hash
+            return None
+        if update_fields is not None:
+            return ([name for name in update_fields if name in self._fields],
+                    [name for name in update_fields if name in self._ext_fields])
+        fields = [name for name, value in values.items()
+                  if _stored_form(value) != self._stored_values.get(name)]
+        # ext fields never accessed aren't loaded, so they can't have changed
+        ext_fields = [name for name, field in self._ext_fields.items()
+                      if name in self.__dict__
+                      and field.snapshot(self.__dict__[name]) != self._stored_ext.get(name)]
+        return fields, ext_fields
+
+    def _mark_stored(self, values, ext_fields=()):
+        """Remember the values written to redis, `values` are redis values of fields"""
+        if self._stored_values is None:
+            self._stored_values = {}
+        self._stored_values.update((name, _stored_form(value)) for name, value in values.items()
+                                   if name in self._fields)
+        for name in ext_fields:
+            self._stored_ext[name] = self._ext_fields[name].snapshot(getattr(self, name))
+
+    def to_redis(self):
+        """Return the redis values of the fields, and normalize the attributes to them"""
+        h = {}
+        d = self.__dict__
+        deferred = self._deferred
+        for name, encode, decode in self._encoders:
+            if name in d:
+                value = encode(d[name])
+            elif name in deferred:
+                continue
+            else:
+                value = encode(getattr(self, name))
+            h[name] = value
+            d[name] = value if decode is None else decode(value)
+        return h
+
+    _redis_values = to_redis
+
+    @operation('delete')
     def delete(self):
         if self.is_new():
             raise RuntimeError("No such data")
-        pipe = self.db.pipeline()
-        self._delete_membership(pipe)
-        ext_keys = [self.key()[e] for e in self._ext_fields.keys()]
-        pipe.delete(*ext_keys)
-        print(self.key())
-        pipe.delete(self.key())
+        if self.__engine__ is not None:
+            self.__engine__.delete(self)
+            self._invalidate_cache()
+            return True
+        pipe = self.db.pipeline(transaction=True)
+        self._delete(pipe)
         pipe.execute()
+        self._invalidate_cache()
         return True
 
+    def _delete(self, pipe):
+        self._delete_membership(pipe)
+        self._delete_indices(pipe)
+        ext_keys = [self.key()[e] for e in self._ext_fields.keys()]
+        self.__storage__.delete(pipe, self, ext_keys)
+
+    @operation('update')
     def update(self, *args, **kwargs):
+        """Write the given fields, `F(name) + n` values are added atomically"""
         kwargs.update(*args)
-        _kw = dict()
+        amounts = self._amounts(kwargs)
+        self._check_incr(amounts)
+        fields = self._set_fields(kwargs)
+        if not fields and not amounts:
+            return
+        if self.__engine__ is not None and fields:
+            self.__engine__.save(self, fields=fields, ext_fields=())
+            fields = []
+        pipe = self.db.pipeline(transaction=True)
+        stored = self._save(pipe, update_fields=fields) if fields else None
+        positions = self._queue_incr(pipe, amounts)
+        replies = pipe.execute()
+        if stored is not None:
+            self._mark_stored(*stored)
+        self._incremented(replies, positions)
+        self._invalidate_cache()
+
+    @operation('incr')
+    def incr(self, field, amount=1):
+        """Add `amount` to a numeric or counter field on the server, without
+        reading it first, and return the new value."""
+        self._check_incr({field: amount})
+        pipe = self.db.pipeline(transaction=True)
+        positions = self._queue_incr(pipe, {field: amount})
+        self._incremented(pipe.execute(), positions)
+        self._invalidate_cache()
+        return getattr(self, field)
+
+    def _amounts(self, kwargs):
+        """Pop the `F` values of kwargs, return their amounts by field name"""
+        amounts = {}
+        for name, value in list(kwargs.items()):
+            if isinstance(value, F):
+                if value.name != name:
+                    raise ValueError("%s can only be updated with F(%r)" % (name, name))
+                amounts[name] = kwargs.pop(name).amount
+        return amounts
+
+    def _check_incr(self, amounts):
+        """Raise if a field of `amounts` can't be incremented, before anything is queued"""
+        if amounts and self.is_new():
+            raise RuntimeError("No such data")
+        for name in amounts:
+            if isinstance(self._ext_fields.get(name), CounterField):
+                continue
+            field = self._fields.get(name)
+            if field is None or field.column_type not in (int, float) or field.binary:
+                raise TypeError("%s is not a numeric field of %s" % (name, self.__class__.__name__))
+            if field.index or self.__storage__.packed:
+                raise TypeError("%s can't be incremented in place, save it instead" % name)
+
+    def _queue_incr(self, pipe, amounts):
+        """Queue the increments of fields checked by `_check_incr`, return the
+        positions of their replies"""
+        positions = {}
+        ttl = self.__dict__.get('_ttl', self.__ttl__)
+        for name, amount in amounts.items():
+            positions[name] = len(pipe)
+            if isinstance(self._ext_fields.get(name), CounterField):
+                self._ext_fields[name].incr(pipe, self.key()[name], amount)
+                if ttl is not None:
+                    # a counter created by the increment expires with the instance
+                    pipe.expire(self.key()[name], ttl, nx=True)
+                continue
+            field = self._fields[name]
+            if field.column_type is float:
+                pipe.hincrbyfloat(self.key(), name, amount)
+            else:
+                pipe.hincrby(self.key(), name, int(amount))
+            if ttl is not None:
+                # the hash of an expired instance is created again, it expires too
+                pipe.expire(self.key(), ttl, nx=True)
+            if field.range_index:
+                pipe.zincrby(self._range_index_key_for(name), amount, self.id)
+        return positions
+
+    def _incremented(self, replies, positions):
+        """Refresh the incremented fields from the replies of `_queue_incr`"""
+        for name, position in positions.items():
+            if name in self._ext_fields:
+                value = self._ext_fields[name].python_value(replies[position + 1])
+                self.__dict__[name] = value
+                self._stored_ext[name] = value
+                continue
+            value = self._fields[name].python_value(replies[position])
+            self.__dict__[name] = value
+            if self._stored_values is not None:
+                self._stored_values[name] = _stored_form(replies[position])
+
+    def _set_fields(self, kwargs):
+        """Set the given field values, and return the names of the fields"""
+        names = []
         for k, v in kwargs.items():
             if k in self._fields:
                 setattr(self, k, v)
-                _kw[k] = v
-        _self = Hash(key=self.key, db=get_client())
-        _self.update(**_kw)
+                names.append(k)
+        return names
 
     def is_new(self):
-        return not hasattr(self, '_id')
+        return '_id' not in self.__dict__
 
     def _init_id(self):
         setattr(self, 'id', str(self.db.incr(self._key['id']['_sequence'])))
@@ -157,18 +530,78 @@ class Model(object, metaclass=BaseModelMeta):
                 value = value.python_value(getattr(self, field))
             if callable(value):
                 value = str(value())
-        return self._key[field][value]
+        return self._namespace(self.id)[field][value]
 
     def _create_membership(self, pipe=None):
-        pipe.sadd(self._key['all'], self.key())
+        # ids of expiring models are added with their expiry by `_save_expiry`
+        if self.__ttl__ is None:
+            pipe.sadd(self._namespace(self.id)['all'], self.id)
 
     def _delete_membership(self, pipe=None):
-        pipe.srem(self._key['all'], self.key())
+        if self.__ttl__ is None:
+            pipe.srem(self._namespace(self.id)['all'], self.id)
+        else:
+            pipe.zrem(self._namespace(self.id)['all'], self.id)
+
+    @staticmethod
+    def _expiring_field(id, name):
+        """The field of `Model:_expiring` holding the indexed value of an expiring instance"""
+        return '%s:%s' % (id, name)
+
+    def _range_index_key_for(self, field):
+        return self._namespace(self.id)[field]['_zindex']
+
+    def _save_indices(self, pipe, values):
+        """Move the id from the index set of the old value to the one of the new value,
+        and update its score in range indexes. `values` maps field names to their redis value.
+        """
+        for name in self._range_indices:
+            if name in values:
+                pipe.zadd(self._range_index_key_for(name), {self.id: values[name]})
+        changed = False
+        for name in self._indices:
+            if name not in values:
+                continue
+            old, new = (self._stored_values or {}).get(name), str(values[name])
+            if old == new:
+                continue
+            if old is not None:
+                pipe.srem(self._index_key_for(name, old), self.id)
+            pipe.sadd(self._index_key_for(name, new), self.id)
+            if self.__ttl__ is not None:
+                # index sets don't expire, the reaper removes the id with this record
+                pipe.hset(self._namespace(self.id)['_expiring'], self._expiring_field(self.id, name), new)
+            changed = True
+        if changed:
+            self._invalidate_filters(pipe)
+
+    def _delete_indices(self, pipe):
+        for name in self._range_indices:
+            pipe.zrem(self._range_index_key_for(name), self.id)
+        for name, field in self._indices.items():
+            value = (self._stored_values or {}).get(name)
+            if value is None:
+                value = field.redis_value(getattr(self, name))
+            pipe.srem(self._index_key_for(name, value), self.id)
+        if self._indices:
+            if self.__ttl__ is not None:
+                pipe.hdel(self._namespace(self.id)['_expiring'], *[self._expiring_field(self.id, name)
+                                                    for name in self._indices])
+            self._invalidate_filters(pipe)
+
+    def _invalidate_cache(self):
+        if self.__cache__ is not None:
+            self.__cache__.invalidate(self.id)
+
+    def _invalidate_filters(self, pipe):
+        """Bump the version of index sets, cached filter results of older versions are not reused.
+        Each shard has its version, in the slot of the keys of its instances.
+        """
+        pipe.incr(self._namespace(self.id)['_indices']['_version'])
 
     def _save_ext_fields(self, pipe=None):
         ext_h = {}
         for name, field in self._ext_fields.items():
-            logger.info("%s ==> %s" % (name, field))
             key = self.key()[name]
             val = getattr(self, name)
             field.save(pipe, key, val)
@@ -1,5 +1,13 @@
-from .logcenter import logger
+import copy
+import heapq
+import time
+import uuid
+from itertools import islice
+
+from .instrument import operation
 from .structure import *
+from .repair import rebuild_model_indexes, verify_model
+from .transfer import export_model, import_model
 
 
 class Key(str):
@@ -9,12 +17,18 @@ class Key(str):
 
 class Query:
 
+    # how many instances are written with one pipeline by `bulk_create`
+    batch_size = 500
+
     def __init__(self, model_class):
         self.model_class = model_class
         self._filters = {}
+        # (index version, key, deadline) of the stored intersections of filters,
+        # by the name of the intersection, shared by the querysets of the model
+        self._filter_keys = {}
 
     def get_model_queryset(self):
-        return Queryset(self.model_class, filters=self._filters)
+        return Queryset(self.model_class, filters=dict(self._filters))
 
     def all(self):
         return self.get_model_queryset()
@@ -22,88 +36,690 @@ class Query:
     def __getitem__(self, index):
         return self.get_model_queryset()[index]
 
+    @operation('get')
     def get(self, id):
         return self.get_model_queryset()._get_item_with_id(id)
 
+    @operation('get_many')
+    def get_many(self, ids, batch_size=None):
+        return self.get_model_queryset()._get_items_with_ids(ids, batch_size)
+
+    @operation('create')
     def create(self, **kwargs):
         instance = self.model_class(**kwargs)
         instance.save()
         return instance
 
+    @operation('bulk_create')
+    def bulk_create(self, instances, batch_size=None):
+        """Save many instances, ids of new instances are reserved with one `INCRBY`
+        and the writes are sent in pipelines of `batch_size` instances, of script
+        calls for models with an engine. The pipelines of sharded models aren't
+        transactions, their instances span shards.
+        """
+        batch_size = batch_size or self.batch_size
+        instances = list(instances)
+        db = self.model_class.__database__
+        new_instances = [instance for instance in instances if instance.is_new()]
+        if new_instances:
+            last_id = db.incrby(self.model_class._key['id']['_sequence'], len(new_instances))
+            self._assign_ids(new_instances, last_id)
+        engine = self.model_class.__engine__
+        for start in range(0, len(instances), batch_size):
+            if engine is not None:
+                engine.save_many(db, instances[start:start + batch_size])
+            else:
+                # instances of sharded models span slots, a MULTI can't hold them
+                pipe = db.pipeline(transaction=self.model_class._shard_keys is None)
+                stored = []
+                for instance in instances[start:start + batch_size]:
+                    stored.append((instance, instance._save(pipe)))
+                pipe.execute()
+                for instance, args in stored:
+                    instance._mark_stored(*args)
+            for instance in instances[start:start + batch_size]:
+                instance._invalidate_cache()
+        return instances
+
+    @staticmethod
+    def _assign_ids(instances, last_id):
+        """Give instances the ids of a block ending with `last_id`"""
+        first_id = last_id - len(instances) + 1
+        for offset, instance in enumerate(instances):
+            instance.id = first_id + offset
+
     def filter(self, **kwargs):
-        self._filters.update(kwargs)
-        return self.get_model_queryset()
+        return self.get_model_queryset().filter(**kwargs)
+
+    def order_by(self, field):
+        return self.get_model_queryset().order_by(field)
+
+    def only(self, *fields):
+        return self.get_model_queryset().only(*fields)
+
+    def defer(self, *fields):
+        return self.get_model_queryset().defer(*fields)
+
+    def prefetch(self, *ext_fields):
+        return self.get_model_queryset().prefetch(*ext_fields)
+
+    @operation('export')
+    def export(self, path, workers=4, batch_size=None, codec=None, progress=None):
+        """Write every instance to `path` with a pool of `workers` threads, and
+        return how many were written, see `redisor.transfer`"""
+        return export_model(self.model_class, path, workers, batch_size or self.batch_size, codec, progress)
+
+    @operation('import')
+    def import_(self, path, workers=4, batch_size=None, codec=None, progress=None):
+        """Save the instances exported to `path`, return how many were saved"""
+        return import_model(self.model_class, path, workers, batch_size or self.batch_size, codec, progress)
+
+    @operation('verify')
+    def verify(self, batch_size=None):
+        """Compare `all` and the indexes with the instances found by SCAN, and
+        return an `IndexReport`, see `redisor.repair`"""
+        return verify_model(self.model_class, batch_size or self.batch_size)
+
+    @operation('rebuild_indexes')
+    def rebuild_indexes(self, batch_size=None):
+        """Rebuild `all` and the indexes from the instances found by SCAN, and
+        return the `IndexReport` of what was wrong"""
+        return rebuild_model_indexes(self.model_class, batch_size or self.batch_size)
+
+    @operation('reap')
+    def reap(self, batch_size=None):
+        """Remove the ids of expired instances from `all` and the indexes, in
+        batches of `batch_size` ids, and return how many were removed. Their keys
+        are already expired by redis. See `redisor.expiry.Reaper` to run it in
+        the background.
+        """
+        batch_size = batch_size or self.batch_size
+        db = self.model_class.__database__
+        removed = 0
+        for ns in self.model_class._namespaces():
+            skipped = 0
+            while True:
+                ids = db.zrangebyscore(ns['all'], '-inf', time.time(), start=skipped, num=batch_size)
+                if not ids:
+                    break
+                pipe = db.pipeline(transaction=False)
+                self._queue_reap_check(pipe, ns, ids)
+                replies = pipe.execute()
+                pipe = db.pipeline(transaction=True)
+                expired = self._queue_reap(pipe, ns, ids, replies)
+                pipe.execute()
+                removed += len(expired)
+                # ids saved again in the meantime are still scored by their old expiry
+                skipped += len(ids) - len(expired)
+        return removed
+
+    def _queue_reap_check(self, pipe, ns, ids):
+        """Queue the reads telling the expired ids of a namespace, and their indexed values"""
+        model_class = self.model_class
+        for id in ids:
+            pipe.exists(ns[id])
+        if model_class._indices:
+            pipe.hmget(ns['_expiring'], [
+                model_class._expiring_field(id, name) for id in ids for name in model_class._indices])
+
+    def _queue_reap(self, pipe, ns, ids, replies):
+        """Queue the removal of the expired ids from the replies of `_queue_reap_check`,
+        and return them"""
+        model_class = self.model_class
+        expired = [id for id, exists in zip(ids, replies) if not exists]
+        if not expired:
+            return expired
+        pipe.zrem(ns['all'], *expired)
+        for name in model_class._range_indices:
+            pipe.zrem(ns[name]['_zindex'], *expired)
+        if model_class._indices:
+            values = dict(zip([model_class._expiring_field(id, name)
+                               for id in ids for name in model_class._indices], replies[len(ids)]))
+            fields = [model_class._expiring_field(id, name) for id in expired for name in model_class._indices]
+            for id in expired:
+                for name in model_class._indices:
+                    value = values[model_class._expiring_field(id, name)]
+                    if value is not None:
+                        pipe.srem(ns[name][value], id)
+            pipe.hdel(ns['_expiring'], *fields)
+            pipe.incr(ns['_indices']['_version'])
+        return expired
 
 
 class Queryset:
 
+    # how many instances are loaded with one pipeline
+    batch_size = 500
+
+    # lookups of `filter` served by range indexes, e.g. `filter(score__gte=10)`
+    range_lookups = ('gt', 'gte', 'lt', 'lte')
+    # seconds the intersection of several filters is kept in redis and reused
+    cache_ttl = 60
+    # the implicit range of expiring models, over the expiry scores of `all`
+    expiry_range = '_expires'
+
     def __init__(self, model_class, filters=None):
         self.model_class = model_class
         self.db = model_class.__database__
-        self.key = model_class._key['all']
-        self._filters = filters
+        # namespace of `all`, the index sets and the range indexes read
+        self._ns = model_class._key
+        self.key = self._ns['all']
+        # namespaces of sharded models, each read by a copy of the queryset
+        self._shards = model_class._shard_keys
+        self._filters = filters or {}
+        self._ranges = {}
+        if model_class.__ttl__ is not None:
+            # ids of expiring models are read through `all` to skip expired ones
+            self._ranges[self.expiry_range] = {}
+        self._order_by = None
+        self._limit = None
+        # fields read with HMGET, None reads all of them with HGETALL
+        self._only = None
+        # ext fields read along with the instances, others load on first access.
+        # Async models can't load lazily, they read all of them by default.
+        self._prefetch = tuple(model_class._ext_fields) if model_class.__async__ else ()
 
+    @operation('getitem')
     def __getitem__(self, index):
-        l = sorted(list(self.set))
-        try:
-            return self._get_item_with_id(l[int(index)])
-        except IndexError:
+        """Index or slice the queryset, only the ids of the requested page are
+        read from redis, e.g. `qs[offset:offset + limit]`.
+        """
+        if isinstance(index, slice):
+            if index.step not in (None, 1):
+                raise ValueError("Queryset slicing doesn't support step")
+            start, stop = index.start or 0, index.stop
+            if start < 0 or (stop is not None and stop < 0):
+                start, stop, _ = index.indices(self.count())
+            return self._get_items_with_ids(self._ids(self._window(start, stop)))
+        index = int(index)
+        if index < 0:
+            index += self.count()
+        ids = self._ids(self._window(index, index + 1)) if index >= 0 else []
+        if not ids:
             return None
+        return self._get_item_with_id(ids[0])
+
+    def _window(self, start, stop):
+        """Return the (offset, count) limit of a page relative to the queryset limit"""
+        offset, count = self._limit if self._limit is not None else (0, None)
+        if stop is not None:
+            stop = max(stop, start)
+            count = stop - start if count is None else max(min(count, stop) - start, 0)
+        elif count is not None:
+            count = max(count - start, 0)
+        return offset + start, count
 
     def _get_item_with_id(self, id):
         """Query data from redis by id, and return a Model instance.
         """
-        raw_data = self.db.hgetall(Key(self.model_class.__name__)[id])
-        if not raw_data:
+        instances = self._get_items_with_ids([id])
+        if not instances:
             raise Exception('%s `id` %s  doest`t exist.' % (self.model_class.__name__, id))
-        data = {}
-        for name, field in self.model_class._fields.items():
-            if name not in raw_data:
-                data[name] = None
-            else:
-                data[name] = field.python_value(raw_data[name])
-        for name, field in self.model_class._ext_fields.items():
-            data[name] = field.load(Key(self.model_class.__name__)[id][name])
-        instance = self.model_class(**data)
-        instance._id = str(id)
-        return instance
+        return instances[0]
+
+    def _get_items_with_ids(self, ids, batch_size=None):
+        """Query data of many ids from redis, and return a list of Model instances.
+        The order of ids is kept, ids which don't exist are skipped.
+        """
+        return list(self._iter_items_with_ids(ids, batch_size))
+
+    def _iter_items_with_ids(self, ids, batch_size=None):
+        """Load instances in chunks, each chunk costs one pipeline round trip.
+        Ids found in the model cache are not read from redis.
+        """
+        for chunk in self._chunks(ids, batch_size):
+            found, missing = self._get_cached(chunk)
+            if missing:
+                pipe = self.db.pipeline(transaction=False)
+                self._queue_load(pipe, missing)
+                self._found_from_replies(found, missing, pipe.execute())
+            yield from self._build_instances(chunk, found)
+
+    def _chunks(self, ids, batch_size=None):
+        batch_size = batch_size or self.batch_size
+        ids = list(ids)
+        for start in range(0, len(ids), batch_size):
+            yield ids[start:start + batch_size]
+
+    def _get_cached(self, ids):
+        """Return the cached (raw_data, ext_data) of ids, and the ids not cached"""
+        cache = self.model_class.__cache__
+        found = {}
+        if cache is not None:
+            for id in ids:
+                entry = cache.get(id)
+                if entry is not None and all(name in entry[1] for name in self._prefetch):
+                    found[id] = copy.deepcopy(entry)
+        return found, [id for id in ids if id not in found]
+
+    def _queue_load(self, pipe, ids):
+        storage = self.model_class.__storage__
+        for id in ids:
+            storage.queue_load(pipe, self.model_class, id, self._only)
+            key = self.model_class._namespace(id)[id]
+            for name in self._prefetch:
+                self.model_class._ext_fields[name].load(key[name], pipe)
+
+    def _found_from_replies(self, found, ids, replies):
+        """Collect the replies of `_queue_load` into `found`, and cache them"""
+        cache = self.model_class.__cache__
+        storage = self.model_class.__storage__
+        replies = iter(replies)
+        for id in ids:
+            raw_data = storage.raw_data(self.model_class, next(replies), self._only)
+            ext_fields = self.model_class._ext_fields
+            ext_data = {name: ext_fields[name].python_value(next(replies)) for name in self._prefetch}
+            if raw_data:
+                found[id] = (raw_data, ext_data)
+                # partial reads would be served as whole instances later
+                if cache is not None and self._only is None:
+                    cache.set(id, copy.deepcopy(found[id]))
+
+    def _build_instances(self, ids, found):
+        from_redis = self.model_class.from_redis
+        deferred = self._deferred_fields()
+        for id in ids:
+            if id in found:
+                raw_data, ext_data = found[id]
+                yield from_redis(id, raw_data, ext_data, deferred)
+
+    def _deferred_fields(self):
+        if self._only is None:
+            return frozenset()
+        return frozenset(self.model_class._fields).difference(self._only)
 
     @property
     def set(self):
-        s = Set(self.db, self.key)
-        print("filter s %s" % s)
-        if self._filters:
-            indices = []
-            for k, v in self._filters.items():
-                index = self._build_key_from_filter_item(k, v)
-                if k not in self.model_class._indices:
-                    raise AttributeError("%s is not indexed in %s clas." % (k, self.model_class.__name__))
-                indices.append(index)
-            new_set_key = "~%s" % ("+".join([self.key] + indices), )
-            logger.info("Add new set key `%s`" % new_set_key)
-            s.intersection(new_set_key, *[Set(self.db, n) for n in indices])
-            s = Set(self.db, new_set_key)
-        return s
+        if self._shards is not None:
+            raise TypeError("%s is sharded, it has a set per shard" % self.model_class.__name__)
+        indices = self._filter_indices()
+        if len(indices) < 2:
+            # an index set only holds saved ids, no need to intersect it with `all`
+            return Set(self.db, indices[0] if indices else self.key)
+        return Set(self.db, self._filter_key(indices))
+
+    def _filter_indices(self):
+        indices = []
+        for k, v in self._filters.items():
+            if k not in self.model_class._indices:
+                raise AttributeError("%s is not indexed in %s clas." % (k, self.model_class.__name__))
+            indices.append(self._build_key_from_filter_item(k, v))
+        return indices
+
+    def _filter_key(self, indices):
+        """Return the key holding the intersection of the index sets.
+        The intersection is stored once with a ttl of `cache_ttl` seconds, and is
+        reused by the querysets of the model until it expires or an index is written.
+        """
+        pipe = self.db.pipeline(transaction=False)
+        cached = self._queue_filter_lookup(pipe, indices)
+        version, key = self._looked_up_filter_key(cached, pipe.execute())
+        if key is None:
+            pipe = self.db.pipeline()
+            key = self._queue_filter_store(pipe, indices, version)
+            pipe.execute()
+        return key
+
+    def _filter_name(self, indices):
+        return "~%s" % "+".join([self.key] + sorted(indices))
+
+    def _queue_filter_lookup(self, pipe, indices):
+        """Queue the read of the index version, and whether the last stored
+        intersection of `indices` still exists. Return that intersection."""
+        cached = self.model_class.objects._filter_keys.get(self._filter_name(indices))
+        if cached is not None and time.time() >= cached[2]:
+            cached = None
+        pipe.get(self._ns['_indices']['_version'])
+        if cached is not None:
+            pipe.exists(cached[1])
+        return cached
+
+    def _looked_up_filter_key(self, cached, replies):
+        """Return the index version and the stored intersection still current,
+        None if it has to be stored again"""
+        version = replies[0] or 0
+        if cached is not None and cached[0] == version and replies[1]:
+            return version, cached[1]
+        return version, None
+
+    def _queue_filter_store(self, pipe, indices, version=None):
+        """Queue the intersection of the index sets, reused while `version` is current"""
+        name = key = self._filter_name(indices)
+        if version is not None:
+            key = "%s@%s" % (name, version)
+        # `all` of expiring models is a zset, intersected by `_queue_range_ids` instead
+        pipe.sinterstore(key, indices if self._expiring else [self.key] + indices)
+        pipe.expire(key, self.cache_ttl)
+        if version is not None:
+            self.model_class.objects._filter_keys[name] = (version, key, time.time() + self.cache_ttl)
+        return key
+
+    def cache(self, ttl):
+        """Set how many seconds the intersection of filters is reused"""
+        self.cache_ttl = ttl
+        return self
 
     def filter(self, **kwargs):
-        if not self._filters:
-            self._filters = {}
-        self._filters.update(kwargs)
+        for k, v in kwargs.items():
+            name, _, lookup = k.partition('__')
+            if not lookup:
+                self._filters[k] = v
+                continue
+            if lookup not in self.range_lookups:
+                raise AttributeError("Unsupported lookup `%s` in %s class." % (k, self.model_class.__name__))
+            self._check_range_index(name)
+            self._ranges.setdefault(name, {})[lookup] = v
+        return self
+
+    def order_by(self, field):
+        """Order by a range indexed field, prefix it with `-` for descending order.
+        """
+        desc = field.startswith('-')
+        name = field.lstrip('-')
+        self._check_range_index(name)
+        self._order_by = (name, desc)
+        return self
+
+    def limit(self, count, offset=0):
+        self._limit = (offset, count)
+        return self
+
+    def only(self, *fields):
+        """Read only the given fields, the others are loaded on first access.
+        Ext fields among them are read along with the instances.
+        """
+        self._check_fields(fields)
+        # packed storages read instances whole
+        if not self.model_class.__storage__.packed:
+            self._only = tuple(name for name in fields if name in self.model_class._fields)
+        self._prefetch = tuple(name for name in fields if name in self.model_class._ext_fields)
         return self
 
+    def defer(self, *fields):
+        """Don't read the given fields, they are loaded on first access"""
+        self._check_fields(fields)
+        if not self.model_class.__storage__.packed:
+            only = self.model_class._fields if self._only is None else self._only
+            self._only = tuple(name for name in only if name not in fields)
+        self._prefetch = tuple(name for name in self._prefetch if name not in fields)
+        return self
+
+    def prefetch(self, *ext_fields):
+        """Read the given ext fields along with the instances, in the same pipeline"""
+        for name in ext_fields:
+            if name not in self.model_class._ext_fields:
+                raise AttributeError("%s is not an ext field of %s clas." % (name, self.model_class.__name__))
+        self._prefetch += tuple(name for name in ext_fields if name not in self._prefetch)
+        return self
+
+    def _check_fields(self, names):
+        for name in names:
+            if name not in self.model_class._fields and name not in self.model_class._ext_fields:
+                raise AttributeError("%s is not a field of %s clas." % (name, self.model_class.__name__))
+
+    def _check_range_index(self, name):
+        if name not in self.model_class._range_indices:
+            raise AttributeError("%s is not range indexed in %s clas." % (name, self.model_class.__name__))
+
+    @property
+    def _expiring(self):
+        return self.model_class.__ttl__ is not None
+
+    def _range_index_key(self, name):
+        if name == self.expiry_range:
+            return self.key
+        return self._ns[name]['_zindex']
+
+    def _score_range(self, name):
+        """Return the (min, max) score arguments for the lookups of the field"""
+        if name == self.expiry_range:
+            return '(%r' % time.time(), '+inf'
+        lookups = self._ranges.get(name, {})
+        low, high = '-inf', '+inf'
+        if 'gte' in lookups:
+            low = lookups['gte']
+        if 'gt' in lookups:
+            low = '(%s' % lookups['gt']
+        if 'lte' in lookups:
+            high = lookups['lte']
+        if 'lt' in lookups:
+            high = '(%s' % lookups['lt']
+        return low, high
+
+    def _ids(self, limit=None):
+        """Return the ids matched by the queryset, ordered and limited.
+        Ids of a plain set are paginated by redis with `SORT ... LIMIT`.
+        """
+        if self._shards is not None:
+            window = self._shard_window(limit)
+            if window is None:
+                return []
+            pipe = self.db.pipeline(transaction=False)
+            positions = self._queue_shard_ids(pipe, window[1])
+            return self._merge_shard_ids(pipe.execute(), positions, *window)
+        start, num = self._redis_limit(limit)
+        if num == 0:
+            return []
+        if not self._ranges and self._order_by is None:
+            return self.db.sort(self.set.key, start=start, num=num)
+        pipe = self.db.pipeline()
+        index = self._queue_range_ids(pipe, self.set.key, start, num)
+        return pipe.execute()[index]
+
+    def _redis_limit(self, limit=None):
+        """Return the (start, num) arguments of a LIMIT clause"""
+        limit = limit if limit is not None else self._limit
+        if limit is None:
+            return None, None
+        offset, count = limit
+        return offset, -1 if count is None else count
+
+    def _shard_querysets(self):
+        """Return a copy of the queryset reading each shard of the model"""
+        querysets = []
+        for ns in self._shards:
+            queryset = copy.copy(self)
+            queryset._ns, queryset.key, queryset._shards = ns, ns['all'], None
+            querysets.append(queryset)
+        return querysets
+
+    def _shard_window(self, limit=None):
+        """Return the (start, stop) of the ids read from the merge of the shards,
+        None if there is nothing to read"""
+        start, num = self._redis_limit(limit)
+        if num == 0:
+            return None
+        start = start or 0
+        return start, None if num is None or num < 0 else start + num
+
+    def _queue_shard_ids(self, pipe, stop=None):
+        """Queue the read of the first `stop` ids of each shard, return the positions
+        of the replies"""
+        ordered = bool(self._ranges) or self._order_by is not None
+        return [queryset._queue_ids(pipe, None if stop is None else 0, stop, withscores=ordered)
+                for queryset in self._shard_querysets()]
+
+    def _merge_shard_ids(self, replies, positions, start, stop):
+        """Merge the ids of the shards in the order of a single namespace: by score
+        with ranges or ordering, by id otherwise, and cut the page"""
+        pages = [replies[position] for position in positions]
+        if self._ranges or self._order_by is not None:
+            desc = self._order_by is not None and self._order_by[1]
+            # zsets order members of equal scores lexicographically
+            merged = heapq.merge(*pages, key=lambda item: (item[1], item[0]), reverse=desc)
+            merged = (id for id, _ in merged)
+        else:
+            merged = heapq.merge(*pages, key=int)
+        return list(islice(merged, start, stop))
+
+    def _queue_ids(self, pipe, start=None, num=None, withscores=False):
+        """Queue the read of the ids of a shard, return the position of the reply"""
+        indices = self._filter_indices()
+        if len(indices) < 2:
+            set_key = indices[0] if indices else self.key
+        else:
+            set_key = self._queue_filter_store(pipe, indices)
+        if not self._ranges and self._order_by is None:
+            pipe.sort(set_key, start=start, num=num)
+            return len(pipe) - 1
+        index = self._queue_range_ids(pipe, set_key, start, num, withscores)
+        return len(pipe) + index
+
+    def _queue_count(self, pipe):
+        """Queue the count of the ids of a shard, return the position of the reply"""
+        indices = self._filter_indices()
+        if self._counts_live_ids():
+            low, high = self._score_range(self.expiry_range)
+            if not indices:
+                pipe.zcount(self.key, low, high)
+                return len(pipe) - 1
+            # the filtered ids, scored by their expiry in `all`
+            tmp_key = "~%s:%s" % ("+".join([self.key] + sorted(indices)), uuid.uuid4().hex)
+            pipe.zinterstore(tmp_key, dict([(self.key, 1)] + [(index, 0) for index in indices]))
+            pipe.zcount(tmp_key, low, high)
+            pipe.delete(tmp_key)
+            return len(pipe) - 2
+        if len(indices) < 2:
+            pipe.scard(indices[0] if indices else self.key)
+        else:
+            pipe.scard(self._queue_filter_store(pipe, indices))
+        return len(pipe) - 1
+
+    def _counts_shards(self):
+        """Whether the shards count their ids without reading them"""
+        return self._limit is None and (not self._ranges or self._counts_live_ids())
+
+    def _queue_range_ids(self, pipe, set_key, start=None, num=None, withscores=False):
+        """Serve range lookups and ordering with range indexes, and return the index
+        of the reply holding the ids.
+        A single range index is read with ZRANGEBYSCORE directly, otherwise the
+        sets are combined with ZINTERSTORE into a temporary key. A zset keeps the
+        scores of the keys with weight 1, the others only narrow the members.
+        Temporary keys are unique to the call: shards are read in pipelines
+        without MULTI, where queries of other clients can interleave.
+        """
+        name, desc = self._order_by or (next(iter(self._ranges)), False)
+        key = self._range_index_key(name)
+        tmp_keys = []
+        if self._filters or set(self._ranges) - {name}:
+            # after the key of the namespace, so the hash tag of a shard is kept
+            tmp_key = "~%s:%s" % ("+".join([self.key, key] + sorted(self._ranges)), uuid.uuid4().hex)
+            pipe.zinterstore(tmp_key, {key: 1, set_key: 0})
+            for other in self._ranges:
+                if other == name:
+                    continue
+                other_key = "%s+%s" % (tmp_key, other)
+                pipe.zinterstore(other_key, {self._range_index_key(other): 1, tmp_key: 0})
+                low, high = self._score_range(other)
+                pipe.zremrangebyscore(other_key, '-inf', self._exclusive_bound(low))
+                pipe.zremrangebyscore(other_key, self._exclusive_bound(high), '+inf')
+                pipe.zinterstore(tmp_key, {tmp_key: 1, other_key: 0})
+                tmp_keys.append(other_key)
+            tmp_keys.append(tmp_key)
+            key = tmp_key
+        low, high = self._score_range(name)
+        if desc:
+            pipe.zrevrangebyscore(key, high, low, start=start, num=num, withscores=withscores)
+        else:
+            pipe.zrangebyscore(key, low, high, start=start, num=num, withscores=withscores)
+        if tmp_keys:
+            pipe.delete(*tmp_keys)
+            return -2
+        return -1
+
+    @staticmethod
+    def _exclusive_bound(bound):
+        """Return the complement bound, used to remove what is out of a range"""
+        bound = str(bound)
+        if bound.startswith('('):
+            return bound[1:]
+        return '(%s' % bound
+
     def _build_key_from_filter_item(self, index, value):
-        return self.model_class._key[index][value]
+        field = self.model_class._indices[index]
+        return self._ns[index][field.redis_value(value)]
 
     @property
+    @operation('members')
     def members(self):
-        return set(map(lambda _id: self._get_item_with_id(_id), self.set.all()))
+        return self._get_items_with_ids(self._ids())
 
+    @operation('count')
     def count(self):
-        return len(self.set)
+        if self._shards is not None and self._counts_shards():
+            pipe = self.db.pipeline(transaction=False)
+            positions = [queryset._queue_count(pipe) for queryset in self._shard_querysets()]
+            replies = pipe.execute()
+            return sum(replies[position] for position in positions)
+        if not self._ranges and self._limit is None:
+            return len(self.set)
+        if self._counts_live_ids():
+            pipe = self.db.pipeline(transaction=False)
+            position = self._queue_count(pipe)
+            return pipe.execute()[position]
+        return len(self._ids())
+
+    def _counts_live_ids(self):
+        """Whether the queryset holds the filtered live ids of an expiring model,
+        counted by their expiry"""
+        return list(self._ranges) == [self.expiry_range] and self._limit is None
+
+    def _reads_pages(self):
+        """Whether `iter_scan` reads ordered pages of ids rather than scanning a set"""
+        return (self._order_by is not None or self._limit is not None
+                or any(name != self.expiry_range for name in self._ranges))
+
+    def _scan_live_ids(self, count):
+        """Yield the live ids of an expiring model, in no particular order. Ids are
+        scanned from `all`, or from the filtered set and checked in `all`."""
+        if not self._filters:
+            for id, expiry in self.db.zscan_iter(self.key, count=count):
+                if expiry > time.time():
+                    yield id
+            return
+        ids = self.set.iter_scan(count=count)
+        while True:
+            chunk = list(islice(ids, count))
+            if not chunk:
+                return
+            yield from self._live(chunk, self.db.zmscore(self.key, chunk))
+
+    @staticmethod
+    def _live(ids, expiries):
+        now = time.time()
+        return [id for id, expiry in zip(ids, expiries) if expiry is not None and expiry > now]
+
+    def iter_scan(self, count=None, batch_size=None):
+        """Stream instances, each batch of ids is loaded with one pipeline so memory
+        stays bounded. Ids of a plain set are read with SSCAN and those of expiring
+        models with ZSCAN, in no particular order; ordered or range filtered
+        querysets are read page by page.
+        """
+        batch_size = batch_size or self.batch_size
+        if self._reads_pages():
+            start = 0
+            while True:
+                ids = self._ids(self._window(start, start + batch_size))
+                yield from self._iter_items_with_ids(ids, batch_size)
+                if len(ids) < batch_size:
+                    return
+                start += batch_size
+        if self._shards is not None:
+            for queryset in self._shard_querysets():
+                yield from queryset.iter_scan(count, batch_size)
+            return
+        if self._expiring:
+            ids = self._scan_live_ids(count or batch_size)
+        else:
+            ids = self.set.iter_scan(count=count or batch_size)
+        while True:
+            chunk = list(islice(ids, batch_size))
+            if not chunk:
+                return
+            yield from self._iter_items_with_ids(chunk, batch_size)
 
     def __iter__(self):
-        print("do search in redis")
-        yield from self.set
+        yield from self.iter_scan()
 
 
 __all__ = ['Queryset', 'Query', 'Key']
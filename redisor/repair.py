@@ -0,0 +1,357 @@
+"""Consistency check and repair of the `all` set and the indexes of a model:
+
+    report = Person.objects.verify()
+    if not report.ok:
+        Person.objects.rebuild_indexes()
+
+Both walk the keys of the model namespace, or of each shard of sharded
+models, with SCAN MATCH, and work in batches of `batch_size`:
+
+- instances have their indexed fields read with one pipeline, then their ids
+  are looked up in `all`, the index sets, the range indexes and the index
+  records of expiring models with SMISMEMBER, ZMSCORE and HMGET. Ids that
+  aren't where the values of their instance say are `missing`.
+- index keys have their members read with SSCAN, ZSCAN or HSCAN, and checked
+  against the values of their instances. Ids of instances that don't exist,
+  or that have another value, are `orphans`.
+- ext field keys of instances that don't exist are orphans too.
+
+No command reads a whole key, and only the batch and the report are held in
+memory. `rebuild_indexes` fixes each batch with SADD/SREM deltas in one MULTI,
+rather than replacing keys. The instance keys of the batch are watched while
+it is read, and the batch is checked again if one of them is written
+meanwhile, so writes made while it runs are kept.
+
+Expiring instances without ttl are reported as `persistent`. The rebuild
+expires them in `__ttl__` seconds.
+"""
+import time
+from collections import namedtuple
+from functools import partial
+from itertools import islice
+
+from redis.exceptions import WatchError
+
+from .storage import BucketStorage
+
+
+class IndexReport(namedtuple('IndexReport', 'instances missing orphans orphan_ext_keys persistent')):
+    """`missing` and `orphans` map keys to the ids they should have and don't, and
+    to the ids they shouldn't have: ids without instance, or of instances with
+    another value. Range indexes are compared with their scores, `all` of
+    expiring models by member only. `persistent` are the ids of expiring
+    instances without ttl. `instances` counts the instances scanned, SCAN can
+    return one twice while the keyspace is resized."""
+
+    @property
+    def ok(self):
+        return not (self.missing or self.orphans or self.orphan_ext_keys or self.persistent)
+
+
+class _Batch:
+    """What the check of a batch found, and the writes fixing it"""
+
+    def __init__(self):
+        self.instances = 0
+        # (key, id)
+        self.missing = []
+        self.orphans = []
+        self.orphan_ext_keys = []
+        self.persistent = []
+        # (command, args)
+        self.writes = []
+        self.indexes_changed = False
+
+
+def _batches(iterable, size):
+    iterable = iter(iterable)
+    while True:
+        batch = list(islice(iterable, size))
+        if not batch:
+            return
+        yield batch
+
+
+class IndexRebuild:
+    """Check the keys of one namespace of a model, and fix them with `repair`"""
+
+    def __init__(self, model_class, ns, batch_size=500, repair=False):
+        self.model_class = model_class
+        self.ns = ns
+        self.batch_size = batch_size
+        self.repair = repair
+        self.db = model_class.__database__
+        self.storage = model_class.__storage__
+        self.expiring = model_class.__ttl__ is not None
+        self.bucketed = isinstance(model_class.__storage__, BucketStorage)
+        self.names = list(dict.fromkeys(list(model_class._indices) + list(model_class._range_indices)))
+        self.instances = 0
+        # key -> ids
+        self.missing = {}
+        self.orphans = {}
+        self.orphan_ext_keys = set()
+        self.persistent = set()
+
+    def run(self):
+        ids, ext_keys, buckets = [], [], []
+        for key in self.db.scan_iter(match='%s:*' % self.ns, count=self.batch_size):
+            kind, value = self._classify(key)
+            if kind == 'instance':
+                ids.append(value)
+            elif kind == 'live':
+                self._check_members(key)
+            elif kind == 'ext':
+                ext_keys.append((value, key))
+            elif kind == 'bucket':
+                buckets.append(key)
+            if len(buckets) >= self.batch_size:
+                ids.extend(self._bucket_ids(buckets))
+                buckets = []
+            while len(ids) >= self.batch_size:
+                self._run_batch(ids[:self.batch_size], self._check_instances)
+                ids = ids[self.batch_size:]
+            if len(ext_keys) >= self.batch_size:
+                self._run_batch([id for id, _ in ext_keys], partial(self._check_ext_keys, ext_keys))
+                ext_keys = []
+        ids.extend(self._bucket_ids(buckets))
+        for batch in _batches(ids, self.batch_size):
+            self._run_batch(batch, self._check_instances)
+        if ext_keys:
+            self._run_batch([id for id, _ in ext_keys], partial(self._check_ext_keys, ext_keys))
+        return self
+
+    def _classify(self, key):
+        """Return the kind of a key of the namespace, and the id of instance keys"""
+        model_class = self.model_class
+        rest = key[len(self.ns) + 1:]
+        parts = rest.split(':')
+        if len(parts) == 1:
+            if rest in ('all', '_expiring'):
+                return 'live', None
+            if rest in model_class._fields or self.bucketed:
+                return None, None
+            return 'instance', rest
+        if parts[0] in model_class._range_indices and parts[1:] == ['_zindex']:
+            return 'live', None
+        if parts[0] in model_class._indices:
+            return 'live', None
+        if len(parts) == 2 and parts[1] in model_class._ext_fields:
+            return 'ext', parts[0]
+        if parts[0] == 'b' and self.bucketed:
+            return 'bucket', None
+        return None, None
+
+    def _bucket_ids(self, buckets):
+        if not buckets:
+            return []
+        pipe = self.db.pipeline(transaction=False)
+        for bucket in buckets:
+            pipe.hkeys(bucket)
+        return [id for ids in pipe.execute() for id in ids]
+
+    def _instance_key(self, id):
+        if self.bucketed:
+            return self.storage.bucket_key(self.model_class, id)
+        return self.ns[id]
+
+    def _run_batch(self, ids, check):
+        """Run `check(ids)`, which reads the batch and returns a _Batch. With
+        `repair`, the instance keys are watched while the batch is read and its
+        writes are sent in one MULTI, the batch is checked again if one of them
+        was written meanwhile."""
+        if not self.repair:
+            self._record(check(ids))
+            return
+        keys = list(dict.fromkeys(self._instance_key(id) for id in ids))
+        with self.db.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    pipe.watch(*keys)
+                    batch = check(ids)
+                    if not batch.writes:
+                        break
+                    pipe.multi()
+                    for command, args in batch.writes:
+                        getattr(pipe, command)(*args)
+                    # cached intersections of filters are stale
+                    if batch.indexes_changed:
+                        pipe.incr(self.ns['_indices']['_version'])
+                    pipe.execute()
+                    break
+                except WatchError:
+                    continue
+        self._record(batch)
+
+    def _record(self, batch):
+        self.instances += batch.instances
+        for found, pairs in ((self.missing, batch.missing), (self.orphans, batch.orphans)):
+            for key, id in pairs:
+                found.setdefault(key, set()).add(id)
+        self.orphan_ext_keys.update(batch.orphan_ext_keys)
+        self.persistent.update(batch.persistent)
+
+    def _load(self, ids):
+        """Return the indexed redis values of the existing instances by id, and
+        their ttl in milliseconds for expiring models"""
+        model_class, storage = self.model_class, self.storage
+        ids = list(dict.fromkeys(ids))
+        pipe = self.db.pipeline(transaction=False)
+        for id in ids:
+            storage.queue_load(pipe, model_class, id, self.names)
+            if self.expiring:
+                pipe.pttl(self.ns[id])
+        replies = iter(pipe.execute())
+        found = {}
+        for id in ids:
+            raw_data = storage.raw_data(model_class, next(replies), self.names)
+            ttl = next(replies) if self.expiring else None
+            # -2: expired since it was read
+            if raw_data and ttl != -2:
+                found[id] = (raw_data, ttl)
+        return found
+
+    def _check_instances(self, ids):
+        """Look up the ids of a batch of instances where their values say they are"""
+        model_class, ns, batch = self.model_class, self.ns, _Batch()
+        found = self._load(ids)
+        batch.instances = len(found)
+        now = time.time()
+        # (command, key) -> {member: (id, expected value or score)}
+        lookups = {}
+        for id, (raw_data, ttl) in found.items():
+            if self.expiring:
+                # the score of `all` moves with the ttl, only the member is compared
+                score = now + (ttl / 1000.0 if ttl > 0 else model_class.__ttl__)
+                lookups.setdefault(('zmscore', ns['all']), {})[id] = (id, None, score)
+                if ttl == -1:
+                    batch.persistent.append(id)
+                    batch.writes.append(('zadd', (ns['all'], {id: score})))
+                    batch.writes.append(('expire', (ns[id], model_class.__ttl__)))
+                    batch.writes.extend(('expire', (ns[id][name], model_class.__ttl__))
+                                        for name in model_class._ext_fields)
+            else:
+                lookups.setdefault(('smismember', ns['all']), {})[id] = (id, None, None)
+            for name in model_class._indices:
+                value = raw_data.get(name)
+                if value is None:
+                    continue
+                lookups.setdefault(('smismember', ns[name][value]), {})[id] = (id, None, None)
+                if self.expiring:
+                    lookups.setdefault(('hmget', ns['_expiring']), {})[
+                        model_class._expiring_field(id, name)] = (id, value, None)
+            for name in model_class._range_indices:
+                if raw_data.get(name) is not None:
+                    score = float(raw_data[name])
+                    lookups.setdefault(('zmscore', ns[name]['_zindex']), {})[id] = (id, score, score)
+        pipe = self.db.pipeline(transaction=False)
+        for (command, key), members in lookups.items():
+            getattr(pipe, command)(key, list(members))
+        for ((command, key), members), reply in zip(lookups.items(), pipe.execute()):
+            for (member, (id, expected, score)), current in zip(members.items(), reply):
+                if command == 'smismember':
+                    if current:
+                        continue
+                    batch.writes.append(('sadd', (key, id)))
+                elif command == 'zmscore':
+                    if current is not None and (expected is None or float(current) == expected):
+                        continue
+                    batch.writes.append(('zadd', (key, {id: score})))
+                else:
+                    if current == expected:
+                        continue
+                    batch.writes.append(('hset', (key, member, expected)))
+                batch.missing.append((key, id))
+                batch.indexes_changed = batch.indexes_changed or key != ns['all']
+        return batch
+
+    def _check_members(self, key):
+        """Check the members of an index key against their instances, by batches"""
+        ns, rest = self.ns, key[len(self.ns) + 1:]
+        count = self.batch_size
+        if rest == '_expiring':
+            members = self._expiring_members(key)
+            command = 'hdel'
+        elif rest == 'all' and self.expiring:
+            members = ((id, id, None) for id, _ in self.db.zscan_iter(key, count=count))
+            command = 'zrem'
+        elif rest == 'all':
+            members = ((id, id, None) for id in self.db.sscan_iter(key, count=count))
+            command = 'srem'
+        elif rest.endswith(':_zindex') and rest[:-len(':_zindex')] in self.model_class._range_indices:
+            name = rest[:-len(':_zindex')]
+            members = ((id, id, (name, None)) for id, _ in self.db.zscan_iter(key, count=count))
+            command = 'zrem'
+        else:
+            name = rest.split(':', 1)[0]
+            value = key[len(ns[name]) + 1:]
+            members = ((id, id, (name, value)) for id in self.db.sscan_iter(key, count=count))
+            command = 'srem'
+        for batch in _batches(members, self.batch_size):
+            self._run_batch([id for _, id, _ in batch], partial(self._check_orphans, key, command, batch))
+
+    def _expiring_members(self, key):
+        # fields are `id:name`, values are the indexed values
+        for field, value in self.db.hscan_iter(key, count=self.batch_size):
+            id, name = field.rsplit(':', 1)
+            yield field, id, (name, value)
+
+    def _check_orphans(self, key, command, members, ids):
+        """Find the members of `key` without instance, or whose instance has
+        another value than the (name, value) they are indexed with"""
+        batch = _Batch()
+        found = self._load(ids)
+        for member, id, indexed in members:
+            if id in found:
+                if indexed is None:
+                    continue
+                name, value = indexed
+                current = found[id][0].get(name)
+                # range indexes only need a value, its score is checked with the instance
+                if current is not None and (value is None or current == value):
+                    continue
+            batch.orphans.append((key, id))
+            batch.writes.append((command, (key, member)))
+            batch.indexes_changed = batch.indexes_changed or key != self.ns['all']
+        return batch
+
+    def _check_ext_keys(self, ext_keys, ids):
+        """Find the ext field keys whose instance doesn't exist"""
+        batch = _Batch()
+        found = self._load(ids)
+        for id, key in ext_keys:
+            if id not in found:
+                batch.orphan_ext_keys.append(key)
+                batch.writes.append(('unlink', (key,)))
+        return batch
+
+
+def _check(model_class):
+    if model_class.__async__:
+        raise TypeError("%s is async, check it with a model on a sync client" % model_class.__name__)
+
+
+def _run(model_class, batch_size, repair):
+    _check(model_class)
+    missing, orphans, ext_keys, persistent, instances = {}, {}, set(), set(), 0
+    for ns in model_class._namespaces():
+        rebuild = IndexRebuild(model_class, ns, batch_size, repair).run()
+        instances += rebuild.instances
+        missing.update((key, sorted(ids)) for key, ids in rebuild.missing.items())
+        orphans.update((key, sorted(ids)) for key, ids in rebuild.orphans.items())
+        ext_keys.update(rebuild.orphan_ext_keys)
+        persistent.update(rebuild.persistent)
+    return IndexReport(instances, missing, orphans, sorted(ext_keys), sorted(persistent))
+
+
+def verify_model(model_class, batch_size=500):
+    """Compare `all` and the indexes of the model with its instances"""
+    return _run(model_class, batch_size, repair=False)
+
+
+def rebuild_model_indexes(model_class, batch_size=500):
+    """Fix `all` and the indexes of the model from its instances, return the
+    report of what was wrong"""
+    return _run(model_class, batch_size, repair=True)
+
+
+__all__ = ['IndexReport', 'IndexRebuild', 'verify_model', 'rebuild_model_indexes']
@@ -0,0 +1,46 @@
+from redis.crc import key_slot
+
+
+class Router:
+    """Map models to redis instances, each described by a `Client`.
+
+    A model is routed by its name in `models` first, then by the slot of its
+    key namespace in `slots`, a list of `(first_slot, last_slot, client)` ranges
+    over the 16384 slots used by redis cluster, and finally to `default`.
+    All the keys of a model share its namespace, so they live on one instance:
+
+        router = Router(default=Client(db=0), models={'Event': Client(host='events')})
+        setup(router=router)
+    """
+
+    def __init__(self, default=None, models=None, slots=None):
+        self.default = default
+        self.models = models or {}
+        self.slots = slots or []
+
+    def client_for(self, model_class):
+        name = model_class.__name__
+        if name in self.models:
+            return self.models[name]
+        slot = key_slot(str(model_class._key).encode())
+        for first, last, client in self.slots:
+            if first <= slot <= last:
+                return client
+        return self.default
+
+    def route(self, model_class):
+        """Set the `__database__` of the model, models without a route are kept as is.
+        Models routed to a cluster client are sharded, see `Model.__shards__`."""
+        from .model import _set_database
+        client = self.client_for(model_class)
+        if client is None:
+            return
+        _set_database(model_class, client.async_db() if model_class.__async__ else client.db())
+
+    def route_all(self):
+        from .model import BaseModelMeta
+        for model_class in BaseModelMeta.models:
+            self.route(model_class)
+
+
+__all__ = ['Router']
@@ -0,0 +1,155 @@
+"""How the fields of instances are laid out in redis, set per model with `__storage__`.
+
+- `HashStorage`, the default: one hash per instance at `Model:id`.
+- `BucketStorage(size=100)`: each instance is one serialized field of a bucket
+  hash `Model:b:{id // size}`. Small hashes are encoded as listpacks, which
+  saves the per key overhead of millions of small instances. Keep `size` under
+  `hash-max-listpack-entries` and instances under `hash-max-listpack-value` or
+  raise those settings, otherwise buckets are converted to real hash tables.
+- `BlobStorage`: each instance is one serialized string at `Model:id`.
+
+    class Point(Model):
+        __storage__ = BucketStorage(size=100)
+
+Packed storages (the latter two) write the whole instance on every save, and
+read it whole: `only()`/`defer()` have no effect on them. Ext fields, indexes
+and the `all` set are kept as usual. Instances are serialized with `codec`,
+JSON by default, which can't hold binary fields: use a `MsgpackCodec` for them.
+Instances of a bucket can't expire one by one, expiring models (`__ttl__`)
+can't use `BucketStorage`. Buckets of sharded models are kept per shard, and only
+hold the ids of their shard.
+"""
+from redis.client import NEVER_DECODE
+
+from .codec import JsonCodec
+
+
+class HashStorage:
+
+    # packed storages serialize the whole instance into one value
+    packed = False
+
+    def write(self, pipe, instance, changed, values):
+        """Queue the write of the `changed` redis values, `values` has all of them"""
+        pipe.hmset(instance.key(), changed)
+
+    def delete(self, pipe, instance, keys=()):
+        """Queue the delete of the instance, and of the other `keys`"""
+        pipe.delete(instance.key(), *keys)
+
+    def expire(self, pipe, instance, ttl):
+        """Queue the expiry of the instance in `ttl` seconds"""
+        pipe.expire(instance.key(), ttl)
+
+    def queue_load(self, pipe, model_class, id, names=None):
+        """Queue the read of the fields `names` of an instance, all fields by default"""
+        key = model_class._namespace(id)[id]
+        # binary fields are read as bytes, text is decoded by `raw_data`
+        options = {NEVER_DECODE: []} if model_class._binary_fields else {}
+        if names is None:
+            pipe.execute_command('HGETALL', key, **options)
+        else:
+            # `id` is always stored, it tells a missing instance from empty fields
+            pipe.execute_command('HMGET', key, 'id', *names, **options)
+
+    def raw_data(self, model_class, reply, names=None):
+        """Return the redis values by field name from the reply of `queue_load`"""
+        if names is not None:
+            reply = {name: value for name, value in zip(('id',) + tuple(names), reply)
+                     if value is not None}
+        if model_class._binary_fields:
+            reply = _decode_text(model_class, reply)
+        return reply
+
+
+class PackedStorage:
+
+    packed = True
+
+    def __init__(self, codec=None):
+        self.codec = codec or JsonCodec()
+
+    def write(self, pipe, instance, changed, values):
+        data = {name: value if isinstance(value, bytes) else str(value)
+                for name, value in values.items()}
+        self._queue_set(pipe, type(instance), instance.id, self.codec.encode(data))
+
+    def delete(self, pipe, instance, keys=()):
+        self._queue_delete(pipe, type(instance), instance.id)
+        if keys:
+            pipe.delete(*keys)
+
+    def queue_load(self, pipe, model_class, id, names=None):
+        options = {NEVER_DECODE: []} if self.codec.binary else {}
+        self._queue_get(pipe, model_class, id, options)
+
+    def raw_data(self, model_class, reply, names=None):
+        return self.codec.decode(reply) if reply is not None else {}
+
+    def expire(self, pipe, instance, ttl):
+        self._queue_expire(pipe, instance.__class__, instance.id, ttl)
+
+    def _queue_set(self, pipe, model_class, id, blob):
+        raise NotImplementedError
+
+    def _queue_get(self, pipe, model_class, id, options):
+        raise NotImplementedError
+
+    def _queue_delete(self, pipe, model_class, id):
+        raise NotImplementedError
+
+    def _queue_expire(self, pipe, model_class, id, ttl):
+        raise NotImplementedError
+
+
+class BucketStorage(PackedStorage):
+
+    def __init__(self, size=100, codec=None):
+        super().__init__(codec)
+        self.size = size
+
+    def bucket_key(self, model_class, id):
+        return model_class._namespace(id)['b'][int(id) // self.size]
+
+    def _queue_set(self, pipe, model_class, id, blob):
+        pipe.hset(self.bucket_key(model_class, id), id, blob)
+
+    def _queue_get(self, pipe, model_class, id, options):
+        pipe.execute_command('HGET', self.bucket_key(model_class, id), id, **options)
+
+    def _queue_delete(self, pipe, model_class, id):
+        pipe.hdel(self.bucket_key(model_class, id), id)
+
+    def _queue_expire(self, pipe, model_class, id, ttl):
+        raise TypeError("instances in buckets can't expire, use BlobStorage or HashStorage")
+
+
+class BlobStorage(PackedStorage):
+
+    def _queue_set(self, pipe, model_class, id, blob):
+        pipe.set(model_class._namespace(id)[id], blob)
+
+    def _queue_get(self, pipe, model_class, id, options):
+        pipe.execute_command('GET', model_class._namespace(id)[id], **options)
+
+    def _queue_delete(self, pipe, model_class, id):
+        pipe.delete(model_class._namespace(id)[id])
+
+    def _queue_expire(self, pipe, model_class, id, ttl):
+        pipe.expire(model_class._namespace(id)[id], ttl)
+
+
+def _decode_text(model_class, raw_data):
+    """Decode the names and the text values of a hash read without decoding"""
+    binary = model_class._binary_fields
+    decoded = {}
+    for name, value in raw_data.items():
+        if isinstance(name, bytes):
+            name = name.decode()
+        if name not in binary and isinstance(value, bytes):
+            value = value.decode()
+        decoded[name] = value
+    return decoded
+
+
+__all__ = ['HashStorage', 'PackedStorage', 'BucketStorage', 'BlobStorage']
@@ -1,26 +1,105 @@
-class List:
+import contextvars
+from contextlib import contextmanager
+from itertools import islice
+
+# pipelines of the `batch` contexts entered, by id of their client
+_batches = contextvars.ContextVar('redisor_batches', default={})
+
+
+@contextmanager
+def batch(db, transaction=True):
+    """Queue the mutations of every structure on `db` into one pipeline, sent
+    when the context exits without error. Reads are still sent right away.
+
+        with batch(db):
+            List(db, 'a').extend(items)
+            Hash(db, 'b')['count'] = len(items)
+    """
+    pipe = db.pipeline(transaction=transaction)
+    token = _batches.set({**_batches.get(), id(db): pipe})
+    try:
+        yield pipe
+    finally:
+        _batches.reset(token)
+    pipe.execute()
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class Structure:
+
+    # how many elements are sent with one variadic command by bulk methods
+    chunk_size = 1000
 
     def __init__(self, db, key):
         self.db = db
         self.key = key
 
+    @property
+    def writer(self):
+        """The pipeline of the current `batch` of the client, or the client"""
+        return _batches.get().get(id(self.db), self.db)
+
+    def _batched(self):
+        return id(self.db) in _batches.get()
+
+    def _bulk(self, command, *args):
+        """Send `command` with `chunk_size` of the items in `args[-1]` at a time,
+        return the sum of the replies, or None within a batch"""
+        *args, items = args
+        writer, total = self.writer, 0
+        for chunk in _chunks(items, self.chunk_size):
+            reply = getattr(writer, command)(self.key, *args, *chunk)
+            if writer is self.db:
+                total += reply
+        return total if writer is self.db else None
+
+
+class List(Structure):
+
     def all(self):
         return self.db.lrange(self.key, 0, -1)
 
     def append(self, value):
-        return self.db.rpush(self.key, value)
+        return self.writer.rpush(self.key, value)
+
+    def extend(self, values):
+        """Append the values, `chunk_size` of them per RPUSH, return the new length"""
+        writer, length = self.writer, None
+        for chunk in _chunks(values, self.chunk_size):
+            length = writer.rpush(self.key, *chunk)
+        return length if writer is self.db else None
 
     def pop(self):
-        return self.db.rpop(self.key)
+        return self.writer.rpop(self.key)
 
     def shift(self):
-        return self.db.lpop(self.key)
+        return self.writer.lpop(self.key)
 
     def unshift(self, value):
-        return self.db.lpush(self.key, value)
+        return self.writer.lpush(self.key, value)
 
     def remove(self, item):
-        return self.db.lrem(self.key, 1, item)
+        return self.writer.lrem(self.key, 1, item)
+
+    def remove_many(self, items):
+        """Remove the first occurrence of each item with one pipeline, LREM
+        isn't variadic. Return how many were removed, or None within a batch."""
+        if self._batched():
+            for item in items:
+                self.writer.lrem(self.key, 1, item)
+            return None
+        pipe = self.db.pipeline(transaction=False)
+        for item in items:
+            pipe.lrem(self.key, 1, item)
+        return sum(pipe.execute())
 
     def __len__(self):
         return self.db.llen(self.key)
@@ -33,48 +112,61 @@ class List:
         return self.db.lindex(self.key, index)
 
     def __setitem__(self, index, value):
-        return self.db.lset(self.key, index, value)
+        return self.writer.lset(self.key, index, value)
 
     def __contains__(self, item):
-        return str(item) in self.all()
+        return self.db.lpos(self.key, item) is not None
 
     def __iter__(self):
         yield from self.all()
 
     def __repr__(self):
-        length = len(self)
-        show_items = min(length, 5)
+        pipe = self.db.pipeline(transaction=False)
+        pipe.llen(self.key)
+        pipe.lrange(self.key, 0, 4)
+        length, items = pipe.execute()
         return '<List(key=%s, value=[%s%s])>' % (
             self.key,
-            ", ".join(self[:show_items]),
-            '...' if show_items < length else ''
+            ", ".join(items),
+            '...' if len(items) < length else ''
         )
 
 
-class Set:
-
-    def __init__(self, db, key):
-        self.db = db
-        self.key = key
-        print("new Set: key: %s" % key)
+class Set(Structure):
 
     def all(self):
         return self.db.smembers(self.key)
 
     def add(self, item):
-        return self.db.sadd(self.key, item)
+        return self.writer.sadd(self.key, item)
+
+    def add_many(self, items):
+        """Add the items, `chunk_size` of them per SADD, return how many were added"""
+        return self._bulk('sadd', items)
+
+    update = add_many
 
     def remove(self, item):
-        if not self.db.srem(self.key, item):
+        # within a batch the result isn't known yet, missing items are ignored
+        if not self.writer.srem(self.key, item) and not self._batched():
             raise KeyError(item)
 
+    def remove_many(self, items):
+        """Remove the items, `chunk_size` of them per SREM, return how many were removed"""
+        return self._bulk('srem', items)
+
     def discard(self, item):
-        self.db.srem(self.key, item)
+        self.writer.srem(self.key, item)
+
+    def iter_scan(self, count=None):
+        """Iterate members with SSCAN, a member may be returned more than once
+        if the set is modified meanwhile."""
+        yield from self.db.sscan_iter(self.key, count=count)
 
     def intersection(self, key, *others):
         """Return a new set with elements common to the set and all others."""
         self.db.sinterstore(key, [self.key] + [o.key for o in others])
-        return Set(self.db, self.key)
+        return Set(self.db, key)
 
     def __delitem__(self, item):
         return self.remove(item)
@@ -83,10 +175,10 @@ class Set:
         return self.db.scard(self.key)
 
     def __iter__(self):
-        yield from self.all()
+        yield from self.iter_scan()
 
     def __contains__(self, item):
-        return self.db.sismembers(self.key, item)
+        return bool(self.db.sismember(self.key, item))
 
     def __and__(self, other):
         """intersection"""
@@ -110,29 +202,47 @@ class Set:
             raise SyntaxError("`Sub` operation expect a Set type, but get %s" % type(other))
 
     def __repr__(self):
-        length = len(self)
-        show_items = min(length, 5)
+        pipe = self.db.pipeline(transaction=False)
+        pipe.scard(self.key)
+        pipe.srandmember(self.key, 5)
+        length, items = pipe.execute()
         return '<Set(key=%s, value={%s%s}>' % (
             self.key,
-            ", ".join(list(self.all())),
-            '...' if length > show_items else ''
+            ", ".join(items),
+            '...' if length > len(items) else ''
         )
 
 
-class SortedSet:
+class SortedSet(Structure):
 
-    def __init__(self, db, key):
-        self.db = db
-        self.key = key
+    # how many members are read with one ZRANGE while iterating
+    page_size = 1000
 
     def all(self):
         return self.db.zrange(self.key, 0, -1)
 
     def add(self, member, score):
-        self.db.zadd(self.key, member, score)
+        self.writer.zadd(self.key, {member: score})
+
+    def zadd(self, mapping):
+        """Add the members of a {member: score} mapping or an iterable of
+        (member, score) pairs, `chunk_size` of them per ZADD"""
+        pairs = mapping.items() if isinstance(mapping, dict) else mapping
+        writer, added = self.writer, 0
+        for chunk in _chunks(pairs, self.chunk_size):
+            reply = writer.zadd(self.key, dict(chunk))
+            if writer is self.db:
+                added += reply
+        return added if writer is self.db else None
+
+    add_many = zadd
 
     def remove(self, member: str):
-        self.db.zrem(self.key, member)
+        self.writer.zrem(self.key, member)
+
+    def remove_many(self, members):
+        """Remove the members, `chunk_size` of them per ZREM, return how many were removed"""
+        return self._bulk('zrem', members)
 
     def rank(self, member, desc=False):
         """Return the rank of the given member"""
@@ -147,27 +257,34 @@ class SortedSet:
         return self.db.zcount(self.key, low, high)
 
     def incr_by(self, member, increment):
-        return self.db.zincrby(self.key, member, increment)
+        return self.writer.zincrby(self.key, increment, member)
+
+    def iter_scan(self, count=None):
+        """Iterate (member, score) pairs with ZSCAN, in no particular order."""
+        yield from self.db.zscan_iter(self.key, count=count)
 
     def __getitem__(self, index):
         if isinstance(index, slice):
-            start = slice.start or 0
-            stop = (slice.stop or 0) - 1
+            start = index.start or 0
+            stop = index.stop - 1 if index.stop is not None else -1
             return self.db.zrange(self.key, start, stop)
         return self.db.zrange(self.key, index, index)
 
     def __iter__(self):
-        yield from self.all()
+        """Iterate members by rank, one page of ZRANGE at a time."""
+        start = 0
+        while True:
+            members = self.db.zrange(self.key, start, start + self.page_size - 1)
+            yield from members
+            if len(members) < self.page_size:
+                break
+            start += self.page_size
 
     def __len__(self):
         return self.db.zcard(self.key)
 
 
-class Hash:
-
-    def __init__(self, db, key):
-        self.db = db
-        self.key = key
+class Hash(Structure):
 
     def all(self):
         return self.db.hgetall(self.key)
@@ -187,9 +304,29 @@ class Hash:
             value = default
         return value
 
+    def get_many(self, fields):
+        """Return the values of the fields with one HMGET, None for missing fields"""
+        fields = list(fields)
+        return self.db.hmget(self.key, fields) if fields else []
+
     def update(self, *args, **kwargs):
+        """Set the fields of a mapping or an iterable of pairs, and keyword
+        arguments, `chunk_size` of them per HSET. Return how many were added."""
         kwargs.update(*args)
-        return self.db.hmset(self.key, kwargs)
+        writer, added = self.writer, 0
+        for chunk in _chunks(kwargs.items(), self.chunk_size):
+            reply = writer.hset(self.key, mapping=dict(chunk))
+            if writer is self.db:
+                added += reply
+        return added if writer is self.db else None
+
+    def remove_many(self, fields):
+        """Delete the fields, `chunk_size` of them per HDEL, return how many were deleted"""
+        return self._bulk('hdel', fields)
+
+    def iter_scan(self, count=None):
+        """Iterate (field, value) pairs with HSCAN."""
+        yield from self.db.hscan_iter(self.key, count=count)
 
     def __len__(self):
         return self.db.hlen(self.key)
@@ -201,25 +338,25 @@ class Hash:
         return value
 
     def __setitem__(self, field, value):
-        return self.db.hset(self.key, field, value)
+        return self.writer.hset(self.key, field, value)
 
     def __delitem__(self, field):
-        effect = self.db.hdel(self.key, field)
-        if effect == 0:
+        # within a batch the result isn't known yet, missing fields are ignored
+        effect = self.writer.hdel(self.key, field)
+        if effect == 0 and not self._batched():
             raise KeyError(field)
 
     def __iter__(self):
-        yield from self.all()
+        for field, _ in self.iter_scan():
+            yield field
 
     __contains__ = has_key
 
     def __repr__(self):
-        length = len(self)
-        show_items = min(length, 5)
         return '<Hash(key=%s, value=%s)' % (
             self.key,
-            self.db.hscan(self.key, count=5)
+            self.db.hscan(self.key, count=5)[1]
         )
 
 
-__all__ = ['List', 'Set', 'SortedSet', 'Hash']
+__all__ = ['Structure', 'List', 'Set', 'SortedSet', 'Hash', 'batch']
@@ -0,0 +1,136 @@
+"""Tracing of the redis commands sent by redisor calls.
+
+    with redisor.trace() as t:
+        Person.objects.filter(name='Liming').members
+    print(t.report())
+
+Every round trip is recorded with the ORM operation running, the call site
+(the first frame outside of redisor and redis-py), the number of commands,
+the bytes sent and its latency. Only the commands of the context entering the
+trace are recorded, not those of other threads or tasks. Instrumentation is
+enabled while any trace is open, if it wasn't already.
+"""
+import contextvars
+import os
+import sys
+import threading
+from collections import Counter, namedtuple
+
+import redis
+
+from . import instrument
+
+TracedCommand = namedtuple('TracedCommand', 'call_site operation command size bytes duration')
+
+# traces recording the commands of the current context
+_traces = contextvars.ContextVar('redisor_traces', default=())
+_skipped_dirs = (os.path.dirname(os.path.abspath(__file__)) + os.sep,
+                 os.path.dirname(os.path.abspath(redis.__file__)) + os.sep)
+# open traces of every thread and task, the last one to exit disables the
+# instrumentation the first one enabled
+_lock = threading.Lock()
+_open_traces = 0
+_enabled_instrumentation = False
+
+
+def resp_size(args):
+    """Return the size of a command encoded in RESP"""
+    size = len(b'*%d\r\n' % len(args))
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = (arg if isinstance(arg, str) else repr(arg)).encode()
+        size += len(b'$%d\r\n' % len(arg)) + len(arg) + 2
+    return size
+
+
+def _call_site():
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if not filename.startswith(_skipped_dirs):
+            return '%s:%d in %s' % (filename, frame.f_lineno, frame.f_code.co_name)
+        frame = frame.f_back
+    return None
+
+
+class Trace:
+
+    def __init__(self):
+        self.commands = []
+        self._token = None
+
+    def _record(self, command, args, duration):
+        if self not in _traces.get():
+            return
+        if command == 'PIPELINE':
+            size, sent = len(args), sum(resp_size(c) for c in args)
+        else:
+            size, sent = 1, resp_size((command,) + tuple(args))
+        self.commands.append(TracedCommand(
+            _call_site(), instrument.current_operation(), command, size, sent, duration))
+
+    @property
+    def round_trips(self):
+        return len(self.commands)
+
+    @property
+    def command_count(self):
+        return sum(c.size for c in self.commands)
+
+    @property
+    def bytes_sent(self):
+        return sum(c.bytes for c in self.commands)
+
+    def summary(self):
+        """Return the totals of each (call site, operation), in order of first use"""
+        totals = {}
+        for c in self.commands:
+            entry = totals.get((c.call_site, c.operation))
+            if entry is None:
+                entry = totals[(c.call_site, c.operation)] = {
+                    'call_site': c.call_site, 'operation': c.operation, 'round_trips': 0,
+                    'commands': 0, 'bytes': 0, 'seconds': 0.0, 'by_command': Counter()}
+            entry['round_trips'] += 1
+            entry['commands'] += c.size
+            entry['bytes'] += c.bytes
+            entry['seconds'] += c.duration
+            entry['by_command'][c.command] += 1
+        return list(totals.values())
+
+    def report(self):
+        lines = []
+        for entry in self.summary():
+            operation = '.'.join(entry['operation']) if entry['operation'] else '-'
+            lines.append('%s %s: %d round trips, %d commands, %d bytes, %.2fms (%s)' % (
+                entry['call_site'], operation, entry['round_trips'], entry['commands'],
+                entry['bytes'], entry['seconds'] * 1000,
+                ', '.join('%s x%d' % item for item in entry['by_command'].items())))
+        return '\n'.join(lines)
+
+    def __enter__(self):
+        global _open_traces, _enabled_instrumentation
+        with _lock:
+            if _open_traces == 0 and not instrument.instrumentation.enabled:
+                instrument.enable()
+                _enabled_instrumentation = True
+            _open_traces += 1
+        instrument.add_hook(post=self._record)
+        self._token = _traces.set(_traces.get() + (self,))
+        return self
+
+    def __exit__(self, *exc):
+        _traces.reset(self._token)
+        global _open_traces, _enabled_instrumentation
+        instrument.remove_hook(post=self._record)
+        with _lock:
+            _open_traces -= 1
+            if _open_traces == 0 and _enabled_instrumentation:
+                instrument.disable()
+                _enabled_instrumentation = False
+
+
+def trace():
+    return Trace()
+
+
+__all__ = ['trace', 'Trace', 'TracedCommand']
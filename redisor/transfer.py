@@ -0,0 +1,211 @@
+"""Export and import of the instances of a model, to move or rebuild a data set:
+
+    Person.objects.export('people.jsonl', workers=8, progress=print)
+    Person.objects.import_('people.jsonl', workers=8)
+
+Ids are scanned from `all`, shard by shard for sharded models, and each batch
+of `batch_size` ids is read with one pipeline by a pool of `workers` threads
+sharing the connections of the model. Imports write each batch of instances
+with one pipeline the same way. At most `2 * workers` batches are in flight,
+so memory stays bounded whatever the size of the data set.
+
+A record holds the id, the redis values of the fields and the values of the
+ext fields, plus the seconds left to live of expiring instances. Instances
+scored without expiry in `all` are imported with the `__ttl__` of the model. Records are
+encoded with `codec`: JSON lines by default. Models with binary fields need a
+`MsgpackCodec`, whose records are length prefixed.
+
+Imports write whole instances and raise the id sequence to the largest
+imported id. Import into a model without the same ids: index entries of the
+old values of overwritten instances aren't removed.
+
+`progress` is called with `(done, total)` after each batch, `total` is None
+when it isn't known.
+"""
+import math
+import struct
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+
+from .codec import JsonCodec
+
+_length = struct.Struct('>I')
+# ids of the last batches scanned, whose repeats are skipped
+_unique_batches = 16
+
+
+def write_record(f, codec, record):
+    data = codec.encode(record)
+    if codec.binary:
+        f.write(_length.pack(len(data)))
+        f.write(data)
+    else:
+        f.write(data.encode())
+        f.write(b'\n')
+
+
+def read_records(f, codec):
+    if not codec.binary:
+        for line in f:
+            if line.strip():
+                yield codec.decode(line)
+        return
+    while True:
+        header = f.read(_length.size)
+        if not header:
+            return
+        yield codec.decode(f.read(_length.unpack(header)[0]))
+
+
+def _batches(iterable, size):
+    iterable = iter(iterable)
+    while True:
+        batch = list(islice(iterable, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _run(executor, tasks, func, workers, on_done):
+    """Run `func` on the tasks in the pool, and give the results to `on_done`
+    in the order of the tasks"""
+    pending = deque()
+    for task in tasks:
+        pending.append(executor.submit(func, task))
+        if len(pending) >= 2 * workers:
+            on_done(pending.popleft().result())
+    while pending:
+        on_done(pending.popleft().result())
+
+
+def _check(model_class):
+    if model_class.__async__:
+        raise TypeError("%s is async, transfer it with a model on a sync client" % model_class.__name__)
+
+
+def _unique(items, window):
+    """Skip the ids seen among the last `window` ones, SSCAN/ZSCAN can return an
+    element twice. An id repeated further apart is exported twice, and imported
+    twice over the same instance."""
+    recent, seen = deque(), set()
+    for item in items:
+        if item[0] in seen:
+            continue
+        if len(recent) == window:
+            seen.discard(recent.popleft())
+        recent.append(item[0])
+        seen.add(item[0])
+        yield item
+
+
+def _scan_ids(model_class, batch_size):
+    """Yield batches of (id, expiry) of the live instances, the expiry is None
+    for models that don't expire"""
+    db = model_class.__database__
+    for ns in model_class._namespaces():
+        if model_class.__ttl__ is None:
+            ids = ((id, None) for id in db.sscan_iter(ns['all'], count=batch_size))
+        else:
+            ids = (item for item in db.zscan_iter(ns['all'], count=batch_size) if item[1] > time.time())
+        yield from _batches(_unique(ids, _unique_batches * batch_size), batch_size)
+
+
+def _load(model_class, batch):
+    """Read the records of a batch of (id, expiry) with one pipeline"""
+    queryset = model_class.objects.get_model_queryset().prefetch(*model_class._ext_fields)
+    ids = [id for id, _ in batch]
+    pipe = model_class.__database__.pipeline(transaction=False)
+    queryset._queue_load(pipe, ids)
+    found = {}
+    queryset._found_from_replies(found, ids, pipe.execute())
+    records = []
+    now = time.time()
+    for id, expiry in batch:
+        # deleted since the scan
+        if id not in found:
+            continue
+        raw_data, ext_data = found[id]
+        record = {'id': id, 'fields': {k: v for k, v in raw_data.items() if k != 'id'}, 'ext': ext_data}
+        # an infinite score has no ttl to keep, the import gives the default one
+        if expiry is not None and math.isfinite(expiry):
+            record['ttl'] = max(1, math.ceil(expiry - now))
+        records.append(record)
+    return records
+
+
+def _save(model_class, records):
+    """Write a batch of records with one pipeline, return their number and the
+    largest numeric id"""
+    pipe = model_class.__database__.pipeline()
+    stored = []
+    for record in records:
+        instance = model_class.from_redis(record['id'], record['fields'], record['ext'])
+        # written whole, like a new instance
+        instance._stored_values, instance._stored_ext = None, {}
+        if 'ttl' in record and model_class.__ttl__ is not None:
+            instance._set_ttl(record['ttl'])
+        stored.append((instance, instance._save(pipe)))
+    pipe.execute()
+    for instance, args in stored:
+        instance._mark_stored(*args)
+        instance._invalidate_cache()
+    return len(records), max((int(r['id']) for r in records if str(r['id']).isdigit()), default=0)
+
+
+def _raise_sequence(model_class, last_id):
+    db = model_class.__database__
+    key = model_class._key['id']['_sequence']
+
+    def raise_to(pipe):
+        if int(pipe.get(key) or 0) < last_id:
+            pipe.multi()
+            pipe.set(key, last_id)
+    db.transaction(raise_to, key)
+
+
+def export_model(model_class, path, workers=4, batch_size=500, codec=None, progress=None):
+    """Write the instances of the model to `path`, return how many were written"""
+    _check(model_class)
+    codec = codec or JsonCodec()
+    total = model_class.objects.all().count() if progress is not None else None
+    done = 0
+
+    def write(records):
+        nonlocal done
+        for record in records:
+            write_record(f, codec, record)
+        done += len(records)
+        if progress is not None:
+            progress(done, total)
+
+    with open(path, 'wb') as f, ThreadPoolExecutor(workers) as executor:
+        _run(executor, _scan_ids(model_class, batch_size), partial(_load, model_class), workers, write)
+    return done
+
+
+def import_model(model_class, path, workers=4, batch_size=500, codec=None, progress=None):
+    """Write the instances of `path` into the model, return how many were written"""
+    _check(model_class)
+    codec = codec or JsonCodec()
+    done = last_id = 0
+
+    def saved(result):
+        nonlocal done, last_id
+        count, batch_last_id = result
+        done += count
+        last_id = max(last_id, batch_last_id)
+        if progress is not None:
+            progress(done, None)
+
+    with open(path, 'rb') as f, ThreadPoolExecutor(workers) as executor:
+        batches = _batches(read_records(f, codec), batch_size)
+        _run(executor, batches, partial(_save, model_class), workers, saved)
+    if last_id:
+        _raise_sequence(model_class, last_id)
+    return done
+
+
+__all__ = ['export_model', 'import_model']
@@ -0,0 +1,81 @@
+import unittest
+
+from redisor import get_async_client, setup
+from redisor import model
+from redisor.aio import AsyncModel, AsyncSet, AsyncHash
+
+setup(db=12)
+
+
+class AsyncPerson(AsyncModel):
+
+    name = model.StringField(name='name', index=True)
+    score = model.IntegerField(name='score', default=0, range_index=True)
+    friend = model.ListField(name='friend')
+
+
+class AsyncSession(AsyncModel):
+
+    __ttl__ = 60
+
+    user = model.StringField(name='user', index=True)
+
+
+class AsyncModelTestCase(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.db = get_async_client()
+        AsyncPerson.__database__ = self.db
+        AsyncSession.__database__ = self.db
+        await self.db.flushdb()
+
+    async def asyncTearDown(self):
+        await self.db.flushdb()
+        await self.db.aclose()
+
+    async def test_save_and_get(self):
+        liming = AsyncPerson(name="Liming", friend=["HanMeimei"])
+        await liming.save()
+        self.assertEqual("1", liming.id)
+        p = await AsyncPerson.objects.get(1)
+        self.assertEqual("Liming", p.name)
+        self.assertEqual(["HanMeimei"], p.friend)
+        await p.update(name="Lilei")
+        self.assertEqual(1, await AsyncPerson.objects.filter(name="Lilei").count())
+        await p.delete()
+        self.assertEqual(0, await AsyncPerson.objects.all().count())
+
+    async def test_queryset(self):
+        await AsyncPerson.objects.bulk_create([AsyncPerson(name="p%d" % i, score=i) for i in range(5)])
+        await AsyncPerson.objects.create(name="p0", score=10)
+        self.assertEqual(["1", "6"], [p.id async for p in AsyncPerson.objects.filter(name="p0")])
+        self.assertEqual(["6", "5"], [p.id for p in await AsyncPerson.objects.order_by('-score')[0:2]])
+        self.assertEqual("3", (await AsyncPerson.objects.all()[2]).id)
+        members = await AsyncPerson.objects.filter(score__gte=3).members
+        self.assertEqual(["4", "5", "6"], [p.id for p in members])
+        ids = [p.id async for p in AsyncPerson.objects.all().iter_scan(batch_size=4)]
+        self.assertEqual(sorted(ids, key=int), ["1", "2", "3", "4", "5", "6"])
+
+    async def test_expiry(self):
+        sessions = await AsyncSession.objects.bulk_create([AsyncSession(user="u") for _ in range(3)])
+        await sessions[2].save(ttl=10)
+        self.assertTrue(0 < await self.db.ttl("AsyncSession:3") <= 10)
+        await self.db.zadd("AsyncSession:all", {"1": 1})
+        await self.db.delete("AsyncSession:1")
+        self.assertEqual(2, await AsyncSession.objects.all().count())
+        self.assertEqual(["2", "3"], sorted([s.id async for s in AsyncSession.objects.filter(user="u")]))
+        self.assertEqual(1, await AsyncSession.objects.reap())
+        self.assertEqual({"2", "3"}, await self.db.smembers("AsyncSession:user:u"))
+
+    async def test_structure(self):
+        s = AsyncSet(self.db, "test_set_a")
+        await s.add("one")
+        self.assertTrue(await s.contains("one"))
+        self.assertEqual(["one"], [m async for m in s])
+        h = AsyncHash(self.db, "test_hash_a")
+        await h.update({"a": 3}, b=4)
+        self.assertEqual({"a": "3", "b": "4"}, await h.all())
+
+
+if __name__ == "__main__":
+    unittest.main()
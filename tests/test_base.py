@@ -1,5 +1,11 @@
 import unittest
-from redisor import get_client, setup
+from unittest import mock
+
+import redis
+
+from redisor import Client, get_client, setup
+from redisor import model
+from redisor.router import Router
 
 
 class BasicsTestCase(unittest.TestCase):
@@ -15,6 +21,61 @@ class BasicsTestCase(unittest.TestCase):
         self.db.set("ping", "pong")
         self.assertEqual(self.db.get("ping"), "pong")
 
+    def test_connection_pool(self):
+        client = Client(db=12, decode_responses=True, max_connections=4, health_check_interval=30)
+        self.assertIs(client.db().connection_pool, client.pool)
+        self.assertEqual(4, client.pool.max_connections)
+        client.db().set("ping", "pong")
+        self.assertEqual(self.db.get("ping"), "pong")
+        self.assertEqual(4, client.async_db().connection_pool.max_connections)
+
+    def test_client_options(self):
+        self.assertIs(redis.SSLConnection, Client(ssl=True).pool.connection_class)
+        client = Client(unix_socket_path='/tmp/redis.sock', db=12)
+        self.assertIs(redis.UnixDomainSocketConnection, client.pool.connection_class)
+
+    def test_router(self):
+        other = Client(db=13, decode_responses=True)
+        router = Router(default=Client(db=12, decode_responses=True), models={'Event': other})
+
+        class Event(model.Model):
+            name = model.StringField(name='name')
+
+        class Tag(model.Model):
+            name = model.StringField(name='name')
+
+        try:
+            setup(router=router)
+            Event(name="launch").save()
+            Tag(name="red").save()
+            self.assertEqual(other.db().hget("Event:1", "name"), "launch")
+            self.assertEqual(self.db.hget("Tag:1", "name"), "red")
+            self.assertFalse(self.db.exists("Event:1"))
+        finally:
+            other.db().flushdb()
+            setup(router=Router())
+
+    def test_route_to_cluster(self):
+        cluster = mock.Mock(spec=Client)
+        cluster.db.return_value = mock.Mock(spec=redis.cluster.RedisCluster)
+
+        class Track(model.Model):
+            name = model.StringField(name='name')
+
+        class Script(model.Model):
+            __engine__ = model.LuaEngine()
+            name = model.StringField(name='name')
+
+        router = Router(models={'Track': cluster, 'Script': cluster})
+        router.route(Track)
+        self.assertIs(cluster.db.return_value, Track.__database__)
+        self.assertEqual(Track.cluster_shards, len(Track._shard_keys))
+        with self.assertRaises(TypeError):
+            router.route(Script)
+        self.assertIsNone(Script._shard_keys)
+        Router(default=Client(db=12)).route(Track)
+        self.assertIsNone(Track._shard_keys)
+
 
 if __name__ == "__main__":
     unittest.main()
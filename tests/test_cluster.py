@@ -0,0 +1,152 @@
+import unittest
+from unittest import mock
+
+import redis.client
+from redis.crc import key_slot
+
+from redisor import get_client, instrument, setup
+from redisor import model
+
+setup(db=12)
+
+
+class Order(model.Model):
+
+    __database__ = get_client()
+    __shards__ = 4
+
+    user = model.StringField(name='user', index=True)
+    state = model.StringField(name='state', index=True)
+    total = model.IntegerField(name='total', default=0, range_index=True)
+    items = model.ListField(name='items')
+
+
+class Visit(model.Model):
+
+    __database__ = get_client()
+    __shards__ = 3
+    __ttl__ = 60
+
+    page = model.StringField(name='page', index=True)
+
+
+class ClusterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.db = get_client()
+        self.db.flushdb()
+        self.commands = []
+        self.transactions = []
+        execute = redis.client.Pipeline.execute
+
+        def record_transaction(pipe, *args, **kwargs):
+            if pipe.transaction:
+                self.transactions.append([command for command, _ in pipe.command_stack])
+            return execute(pipe, *args, **kwargs)
+        self.patcher = mock.patch.object(redis.client.Pipeline, 'execute', record_transaction)
+        self.patcher.start()
+        instrument.add_hook(pre=self.record)
+        instrument.enable()
+
+    def tearDown(self):
+        instrument.disable()
+        instrument.remove_hook(pre=self.record)
+        self.patcher.stop()
+        self.db.flushdb()
+
+    def record(self, command, args):
+        if command == 'PIPELINE':
+            self.commands.extend(args)
+        else:
+            self.commands.append((command,) + tuple(args))
+
+    @staticmethod
+    def keys(command):
+        return [arg for arg in command[1:] if isinstance(arg, str)
+                and arg.lstrip('~').startswith(('{Order:', '{Visit:', 'Order:', 'Visit:'))]
+
+    def assertSingleSlot(self):
+        """Every command, and every MULTI, only uses the keys of one slot, as a
+        cluster requires"""
+        for command in self.commands:
+            self.assertLessEqual(len({key_slot(key.encode()) for key in self.keys(command)}), 1, command)
+        for commands in self.transactions:
+            keys = [key for command in commands for key in self.keys(command)]
+            self.assertLessEqual(len({key_slot(key.encode()) for key in keys}), 1, commands)
+
+    def test_key_layout(self):
+        orders = Order.objects.bulk_create(Order(user="u%d" % (i % 3), total=i, items=["a"]) for i in range(20))
+        o = orders[0]
+        shard = Order._namespace(o.id)
+        self.assertEqual("%s:%s" % (shard, o.id), o.key())
+        self.assertEqual(key_slot(o.key().encode()), key_slot(o.key()["items"].encode()))
+        self.assertTrue(self.db.sismember(shard["all"], o.id))
+        self.assertTrue(self.db.sismember(shard["user"]["u0"], o.id))
+        self.assertEqual(4, len([key for key in self.db.keys("{Order:*}:all")]))
+        self.assertEqual(["a"], Order.objects.get(o.id).items)
+        with self.assertRaises(TypeError):
+            Order.objects.all().set
+        self.assertSingleSlot()
+
+    def test_queryset_merges_shards(self):
+        Order.objects.bulk_create(
+            Order(user="u%d" % (i % 3), state="s%d" % (i % 2), total=i % 7, items=["a"]) for i in range(30))
+        ids = [str(i) for i in range(1, 31)]
+        self.assertEqual(30, Order.objects.all().count())
+        self.assertEqual(ids, [o.id for o in Order.objects.all().members])
+        self.assertEqual(ids[5:15], [o.id for o in Order.objects.all()[5:15]])
+        self.assertEqual(ids[::3], [o.id for o in Order.objects.filter(user="u0").members])
+        self.assertEqual(ids[::6], [o.id for o in Order.objects.filter(user="u0", state="s0").members])
+        self.assertEqual(5, Order.objects.filter(user="u0", state="s0").count())
+        by_total = sorted(ids, key=lambda id: ((int(id) - 1) % 7, id))
+        self.assertEqual(by_total, [o.id for o in Order.objects.order_by("total").members])
+        self.assertEqual(list(reversed(by_total))[:7], [o.id for o in Order.objects.order_by("-total")[0:7]])
+        high = [id for id in by_total if (int(id) - 1) % 7 >= 5]
+        self.assertEqual(high, [o.id for o in Order.objects.filter(total__gte=5).members])
+        self.assertEqual(len(high), Order.objects.filter(total__gte=5).count())
+        u0 = [id for id in reversed(by_total) if int(id) % 3 == 1 and (int(id) - 1) % 7 >= 3]
+        self.assertEqual(u0, [o.id for o in Order.objects.filter(user="u0", total__gte=3).order_by("-total")])
+        self.assertEqual(sorted(ids, key=int), sorted((o.id for o in Order.objects.all()), key=int))
+        self.assertEqual(ids[1::2][:4], [o.id for o in Order.objects.filter(state="s1").limit(4).members])
+        o = Order.objects.get(2)
+        o.update(state="s2", total=3)
+        Order.objects.get(1).delete()
+        self.assertEqual(2, len(self.transactions))
+        self.assertEqual(["2"], [o.id for o in Order.objects.filter(state="s2")])
+        self.assertEqual(29, Order.objects.all().count())
+        self.assertEqual(9, Order.objects.filter(user="u0").count())
+        self.assertSingleSlot()
+
+    def test_range_temp_keys_are_unique(self):
+        Order.objects.bulk_create(Order(user="u%d" % (i % 2), total=i) for i in range(12))
+        low = Order.objects.filter(user="u0", total__lt=6)
+        high = Order.objects.filter(user="u0", total__gte=6)
+        self.assertEqual(["1", "3", "5"], [o.id for o in low.order_by("total").members])
+        self.assertEqual(["7", "9", "11"], [o.id for o in high.order_by("total").members])
+        stored = [command[1] for command in self.commands if command[0] == 'ZINTERSTORE']
+        self.assertEqual(8, len(set(stored)))
+        self.assertEqual([], self.db.keys("~*"))
+        self.assertSingleSlot()
+
+    def test_expiring_shards(self):
+        visits = Visit.objects.bulk_create(Visit(page="p%d" % (i % 2)) for i in range(9))
+        self.assertEqual(9, Visit.objects.all().count())
+        for v in visits[:3]:
+            self.db.zadd(Visit._namespace(v.id)["all"], {v.id: 1})
+            self.db.delete(v.key())
+        self.assertEqual(6, Visit.objects.all().count())
+        self.assertEqual(["5", "7", "9"], sorted(v.id for v in Visit.objects.filter(page="p0")))
+        self.assertEqual(3, Visit.objects.reap())
+        self.assertEqual(3, len(Visit.objects.filter(page="p1").members))
+        self.assertSingleSlot()
+
+    def test_engine_refused(self):
+        with self.assertRaises(TypeError):
+            class Sharded(model.Model):
+                __shards__ = 2
+                __engine__ = model.LuaEngine()
+                name = model.StringField(name='name')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+
+from redisor import get_client, setup
+from redisor import codec
+from redisor import model
+
+setup(db=12)
+
+
+class Reading(model.Model):
+
+    __database__ = get_client()
+
+    sensor = model.StringField(name='sensor', index=True)
+    count = model.IntegerField(name='count', default=0, codec=model.IntCodec())
+    value = model.FloatField(name='value', default=0.0, codec=model.FloatCodec())
+    samples = model.JsonField(name='samples', codec=model.ZlibCodec(model.JsonCodec()))
+
+
+class CodecTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.db = Reading.__database__
+        self.db.flushdb()
+
+    def tearDown(self):
+        self.db.flushdb()
+
+    def test_binary_fields(self):
+        Reading(sensor="t1", count=-3, value=1.5, samples={"a": [1, 2, 3]}).save()
+        self.assertEqual(8, self.db.hstrlen("Reading:1", "count"))
+        r = Reading.objects.get(1)
+        self.assertEqual(("t1", -3, 1.5, {"a": [1, 2, 3]}), (r.sensor, r.count, r.value, r.samples))
+        self.assertEqual(([], []), r._changes(r._redis_values()))
+        r.count += 1
+        self.assertEqual((["count"], []), r._changes(r._redis_values()))
+        r.save()
+        r = Reading.objects.filter(sensor="t1").only("sensor")[0]
+        self.assertNotIn("count", r.__dict__)
+        self.assertEqual(-2, r.count)
+        r = Reading.objects.only("value")[0]
+        self.assertEqual(1.5, r.value)
+
+    def test_codecs(self):
+        self.assertEqual(b"x", codec.ZlibCodec().decode(codec.ZlibCodec().encode("x")))
+        self.assertEqual(7, codec.StructCodec('<i').decode(codec.StructCodec('<i').encode(7)))
+        with self.assertRaises(ValueError):
+            model.IntegerField(name='n', index=True, codec=model.IntCodec())
+
+    @unittest.skipIf(codec.msgpack is None, "msgpack is not installed")
+    def test_msgpack(self):
+        c = codec.ZlibCodec(codec.MsgpackCodec())
+        self.assertEqual({"a": [1, b"\x00"]}, c.decode(c.encode({"a": [1, b"\x00"]})))
+
+
+if __name__ == "__main__":
+    unittest.main()
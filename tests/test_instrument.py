@@ -0,0 +1,91 @@
+import logging
+import unittest
+
+import redis
+
+from redisor import get_client, setup
+from redisor import instrument
+from redisor import model
+
+setup(db=12)
+
+
+class Book(model.Model):
+
+    __database__ = get_client()
+
+    title = model.StringField(name='title', index=True)
+    tags = model.ListField(name='tags')
+
+
+class Novel(model.Model):
+
+    __database__ = get_client()
+
+    title = model.StringField(name='title', index=True)
+    author = model.StringField(name='author', index=True)
+
+
+class InstrumentTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.db = Book.__database__
+        self.db.flushdb()
+        self.commands = []
+        self.hook = lambda command, args, duration: self.commands.append(
+            (instrument.current_operation(), command, len(args)))
+        instrument.add_hook(post=self.hook)
+        instrument.reset()
+
+    def tearDown(self):
+        instrument.disable()
+        instrument.remove_hook(post=self.hook)
+        self.db.flushdb()
+
+    def test_disabled(self):
+        Book(title="Dune").save()
+        self.assertEqual([], self.commands)
+        self.assertEqual({}, dict(instrument.instrumentation.counters))
+
+    def test_hooks_and_counters(self):
+        instrument.enable()
+        Book(title="Dune", tags=["sf"]).save()
+        Book.objects.get(1)
+        self.assertEqual([
+            (("Book", "save"), "INCRBY", 2),
+            (("Book", "save"), "PIPELINE", 6),
+            (("Book", "get"), "PIPELINE", 1),
+        ], self.commands)
+        self.assertEqual(1, instrument.instrumentation.counters[("Book", "save")])
+        self.assertEqual(1, instrument.instrumentation.counters[("Book", "get")])
+
+    def test_other_clients(self):
+        instrument.enable()
+        # only the clients made by redisor are reported
+        redis.StrictRedis(db=12).set("ping", "pong")
+        self.assertEqual([], self.commands)
+        instrument.attach(redis.StrictRedis(db=12)).set("ping", "pong")
+        self.assertEqual([(None, "SET", 2)], self.commands)
+        instrument.disable()
+        instrument.attach(redis.StrictRedis(db=12)).set("ping", "pong")
+        self.assertEqual(1, len(self.commands))
+
+    def test_filter_key_reused(self):
+        Novel(title="Dune", author="Herbert").save()
+        instrument.enable()
+        self.assertEqual(1, Novel.objects.filter(title="Dune", author="Herbert").count())
+        self.assertEqual(3, len(self.commands))
+        del self.commands[:]
+        # a new queryset reuses the stored intersection
+        self.assertEqual(1, Novel.objects.filter(author="Herbert", title="Dune").count())
+        self.assertEqual(["PIPELINE", "SCARD"], [command for _, command, _ in self.commands])
+
+    def test_slow_log(self):
+        instrument.enable(slow_threshold=0)
+        with self.assertLogs('redisor', level=logging.WARNING) as logs:
+            Book.objects.filter(title="Dune").count()
+        self.assertIn("slow operation Book.count", logs.output[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,18 +1,22 @@
 import time
 import unittest
-from redisor import get_client
+from redisor import get_client, instrument, setup
 
 from redisor import model
 
+setup(db=12)
+
 
 class Person(model.Model):
 
     __database__ = get_client()
 
     rank = model.AutoIncrementField(name='rank')
-    name = model.StringField(name='name')
+    name = model.StringField(name='name', index=True)
     address = model.StringField(name='address', default='1998')
     create_at = model.IntegerField(name='create_at', default=time.time)
+    score = model.IntegerField(name='score', default=0, range_index=True)
+    age = model.IntegerField(name='age', default=0, index=True, range_index=True)
     friend = model.ListField(name='friend')
     more_info = model.HashField(name='more_info')
     others = model.JsonField(name="others")
@@ -30,10 +34,39 @@ class Person(model.Model):
         }
 
 
+class CachedPerson(model.Model):
+
+    __database__ = get_client()
+    __cache__ = model.ModelCache(maxsize=2, ttl=60)
+
+    name = model.StringField(name='name')
+    friend = model.ListField(name='friend')
+
+
+class LuaPerson(model.Model):
+
+    __database__ = get_client()
+    __engine__ = model.LuaEngine()
+
+    name = model.StringField(name='name', index=True)
+    score = model.IntegerField(name='score', default=0, range_index=True)
+    friend = model.ListField(name='friend')
+    more_info = model.HashField(name='more_info')
+
+
+class Page(model.Model):
+
+    __database__ = get_client()
+
+    title = model.StringField(name='title')
+    rating = model.FloatField(name='rating', default=0.0)
+    views = model.CounterField(name='views', shards=4)
+
+
 class ModelTestCase(unittest.TestCase):
 
     def setUp(self):
-        self.client = get_client()
+        self.client = Person.__database__
         self.client.flushdb()
 
     def tearDown(self):
@@ -60,6 +93,331 @@ class ModelTestCase(unittest.TestCase):
         p2 = Person.objects.all()[0]
         # self.assertEqual(p, p2)
 
+    def test_members(self):
+        for name in ("Liming", "HanMeimei", "ZhangTiezhu"):
+            Person(name=name, friend=["Lilei"], more_info={"age": 13}).save()
+        members = Person.objects.all().members
+        self.assertEqual(["1", "2", "3"], [p.id for p in members])
+        self.assertEqual(["Liming", "HanMeimei", "ZhangTiezhu"], [p.name for p in members])
+        self.assertEqual(["Lilei"], members[0].friend)
+        self.assertEqual({"age": "13"}, members[0].more_info)
+
+    def test_get_many(self):
+        for name in ("Liming", "HanMeimei", "ZhangTiezhu"):
+            Person(name=name).save()
+        persons = Person.objects.get_many(["3", "42", "1"], batch_size=2)
+        self.assertEqual(["3", "1"], [p.id for p in persons])
+        self.assertEqual(["ZhangTiezhu", "Liming"], [p.name for p in persons])
+
+    def test_bulk_create(self):
+        Person(name="Liming").save()
+        persons = [Person(name="p%d" % i, friend=["Lilei"]) for i in range(5)]
+        created = Person.objects.bulk_create(persons, batch_size=2)
+        self.assertEqual(["2", "3", "4", "5", "6"], [p.id for p in created])
+        self.assertEqual(6, Person.objects.all().count())
+        self.assertEqual("p4", Person.objects.get(6).name)
+        self.assertEqual(["Lilei"], Person.objects.get(6).friend)
+        self.assertEqual("7", Person.save_many([Person(name="Lilei")])[0].id)
+
+    def test_filter(self):
+        Person.objects.bulk_create([Person(name="Liming"), Person(name="Lilei"), Person(name="Liming")])
+        self.assertEqual(2, Person.objects.filter(name="Liming").count())
+        self.assertEqual(["1", "3"], [p.id for p in Person.objects.filter(name="Liming").members])
+        self.assertEqual(3, Person.objects.all().count())
+        with self.assertRaises(AttributeError):
+            Person.objects.filter(address="China").count()
+
+    def test_index_update_and_delete(self):
+        p = Person(name="Liming")
+        p.save()
+        p.name = "Lilei"
+        p.save()
+        self.assertEqual(0, Person.objects.filter(name="Liming").count())
+        self.assertEqual(1, Person.objects.filter(name="Lilei").count())
+        p = Person.objects.get(1)
+        p.update(name="HanMeimei")
+        self.assertEqual(0, Person.objects.filter(name="Lilei").count())
+        self.assertEqual("HanMeimei", Person.objects.filter(name="HanMeimei").members[0].name)
+        p.delete()
+        self.assertEqual(0, Person.objects.filter(name="HanMeimei").count())
+
+    def test_range_filter_and_order(self):
+        Person.objects.bulk_create([
+            Person(name="Liming", score=90, age=13),
+            Person(name="Lilei", score=60, age=14),
+            Person(name="Liming", score=75, age=15),
+            Person(name="HanMeimei", score=100, age=13),
+        ])
+        ids = lambda qs: [p.id for p in qs]
+        self.assertEqual(["2", "3", "1"], ids(Person.objects.filter(score__gte=60, score__lt=100)))
+        self.assertEqual(["4", "1", "3", "2"], ids(Person.objects.order_by('-score')))
+        self.assertEqual(["1", "3"], ids(Person.objects.order_by('-score').limit(2, offset=1)))
+        self.assertEqual(["3", "1"], ids(Person.objects.filter(name="Liming").order_by('score')))
+        self.assertEqual(["4", "1"], ids(Person.objects.filter(age__lte=13).order_by('-score')))
+        self.assertEqual(["3"], ids(Person.objects.filter(name="Liming", age__gt=13, score__gt=70)))
+        self.assertEqual(2, Person.objects.filter(score__gt=75).count())
+        p = Person.objects.get(4)
+        p.score = 10
+        p.save()
+        self.assertEqual("4", Person.objects.order_by('score').members[0].id)
+        p.delete()
+        self.assertEqual(3, len(Person.objects.order_by('score').members))
+        with self.assertRaises(AttributeError):
+            Person.objects.order_by('name')
+
+    def test_slice(self):
+        Person.objects.bulk_create([Person(name="p%d" % i, score=i) for i in range(12)])
+        ids = lambda persons: [p.id for p in persons]
+        qs = Person.objects.all()
+        self.assertEqual("10", qs[9].id)
+        self.assertEqual("12", qs[-1].id)
+        self.assertIsNone(qs[12])
+        self.assertEqual(["9", "10", "11"], ids(qs[8:11]))
+        self.assertEqual(["11", "12"], ids(qs[10:]))
+        self.assertEqual(["11"], ids(qs[-2:-1]))
+        self.assertEqual(["10", "9"], ids(Person.objects.order_by('-score')[2:4]))
+        limited = Person.objects.order_by('score').limit(5, offset=2)
+        self.assertEqual(["6", "7"], ids(limited[3:10]))
+        self.assertEqual("7", limited[4].id)
+        self.assertIsNone(limited[5])
+
+    def test_filter_cache(self):
+        Person.objects.bulk_create([Person(name="Liming", age=13), Person(name="Liming", age=14)])
+        qs = Person.objects.filter(name="Liming", age=13).cache(100)
+        self.assertEqual(1, qs.count())
+        keys = self.client.keys("~*")
+        self.assertEqual(1, len(keys))
+        self.assertTrue(0 < self.client.ttl(keys[0]) <= 100)
+        self.assertEqual(["1"], [p.id for p in qs])
+        self.assertEqual(keys, self.client.keys("~*"))
+        Person(name="Liming", age=13).save()
+        self.assertEqual(2, qs.count())
+        self.client.delete(*self.client.keys("~*"))
+        self.assertEqual(3, Person.objects.filter(name="Liming").count())
+        self.assertEqual([], self.client.keys("~*"))
+
+    def test_iter_scan(self):
+        Person.objects.bulk_create([Person(name="p%d" % i, score=i) for i in range(7)])
+        ids = [p.id for p in Person.objects.all().iter_scan(batch_size=3)]
+        self.assertEqual(sorted(ids, key=int), [str(i) for i in range(1, 8)])
+        ids = [p.id for p in Person.objects.order_by('-score').iter_scan(batch_size=3)]
+        self.assertEqual(ids, [str(i) for i in range(7, 0, -1)])
+
+    def test_cache(self):
+        cache = CachedPerson.__cache__
+        cache.clear()
+        CachedPerson.objects.bulk_create([CachedPerson(name="p%d" % i, friend=["Lilei"]) for i in range(3)])
+        p = CachedPerson.objects.get(1)
+        p.friend.append("HanMeimei")
+        self.assertEqual(["Lilei"], CachedPerson.objects.get(1).friend)
+        self.assertEqual({"hits": 1, "misses": 1, "size": 1}, cache.stats())
+        p.update(name="Liming")
+        self.assertEqual("Liming", CachedPerson.objects.get(1).name)
+        self.assertEqual(2, cache.misses)
+        CachedPerson.objects.get_many(["1", "2", "3"])
+        self.assertEqual(2, cache.stats()["size"])
+        p.delete()
+        with self.assertRaises(Exception):
+            CachedPerson.objects.get(1)
+
+    def test_cache_keyspace_events(self):
+        class ShardedPerson(model.Model):
+            __database__ = get_client()
+            __shards__ = 3
+            __cache__ = model.ModelCache()
+            name = model.StringField(name='name')
+
+        class BucketPerson(model.Model):
+            __database__ = get_client()
+            __storage__ = model.BucketStorage(size=2)
+            __cache__ = model.ModelCache()
+            name = model.StringField(name='name')
+
+        def event(model_class, key):
+            model_class.__cache__._on_keyspace_event(model_class, {'channel': '__keyspace@12__:%s' % key})
+        cache = ShardedPerson.__cache__
+        for id in ("1", "2"):
+            cache.set(id, {})
+        event(ShardedPerson, ShardedPerson._namespace("1")["1"]["name"])
+        event(ShardedPerson, "Person:2")
+        self.assertEqual((None, {}), (cache.get("1"), cache.get("2")))
+        cache = BucketPerson.__cache__
+        for id in ("1", "2", "3"):
+            cache.set(id, {})
+        event(BucketPerson, "BucketPerson:b:1")
+        self.assertEqual(({}, None, None), (cache.get("1"), cache.get("2"), cache.get("3")))
+
+    def test_lua_engine(self):
+        p = LuaPerson(name="Liming", score=3, friend=["Lilei"], more_info={"age": 13})
+        p.save()
+        self.assertEqual("1", p.id)
+        p.friend = ["HanMeimei"]
+        p.save()
+        p = LuaPerson.objects.get(1)
+        self.assertEqual(["HanMeimei"], p.friend)
+        self.assertEqual({"age": "13"}, p.more_info)
+        # an index value changed by another writer is diffed on the server
+        self.client.hset("LuaPerson:1", "name", "Lilei")
+        self.client.srem("LuaPerson:name:Liming", "1")
+        self.client.sadd("LuaPerson:name:Lilei", "1")
+        p.update(name="ZhangTiezhu", score=9)
+        self.assertEqual(set(), self.client.smembers("LuaPerson:name:Lilei"))
+        self.assertEqual(["1"], [p.id for p in LuaPerson.objects.filter(name="ZhangTiezhu")])
+        self.assertEqual(["1"], [p.id for p in LuaPerson.objects.filter(score__gt=5)])
+        p.delete()
+        self.assertEqual([], self.client.keys("LuaPerson:1*"))
+        self.assertEqual(0, LuaPerson.objects.filter(name="ZhangTiezhu").count())
+        self.assertEqual(0, self.client.zcard("LuaPerson:score:_zindex"))
+
+    def test_lua_engine_keys(self):
+        calls = []
+
+        def record(command, args):
+            if command == 'PIPELINE':
+                calls.extend(args)
+            else:
+                calls.append((command,) + tuple(args))
+        people = LuaPerson.objects.bulk_create(LuaPerson(name="p%d" % i, friend=["x"]) for i in range(3))
+        self.assertEqual(["2"], [p.id for p in LuaPerson.objects.filter(name="p1")])
+        people[1].name = "Lilei"
+        instrument.add_hook(pre=record)
+        instrument.enable()
+        try:
+            LuaPerson.objects.bulk_create(people)
+            people[2].delete()
+        finally:
+            instrument.disable()
+            instrument.remove_hook(pre=record)
+        # one call for the changed instance, one for the deleted one
+        scripts = [call for call in calls if call[0] == 'EVALSHA']
+        self.assertEqual(2, len(scripts))
+        keys = scripts[0][3:3 + scripts[0][2]]
+        self.assertEqual(("LuaPerson:2", "LuaPerson:all", "LuaPerson:_indices:_version",
+                          "LuaPerson:name:p1", "LuaPerson:name:Lilei"), keys)
+        self.assertIn("LuaPerson:3:friend", scripts[1][3:3 + scripts[1][2]])
+        self.assertEqual(["2"], [p.id for p in LuaPerson.objects.filter(name="Lilei")])
+        self.assertEqual(0, LuaPerson.objects.filter(name="p1").count())
+        self.assertEqual(["1", "2"], sorted(self.client.smembers("LuaPerson:all")))
+
+    def test_dirty_fields(self):
+        Person(name="Liming", address="China", friend=["Lilei"], more_info={"age": 13, "city": "Beijing"}).save()
+        p = Person.objects.get(1)
+        self.assertEqual(([], []), p._changes(p._redis_values()))
+        p.address = "Japan"
+        p.friend.append("HanMeimei")
+        del p.more_info["city"]
+        self.assertEqual((["address"], ["friend", "more_info"]), p._changes(p._redis_values()))
+        pipe = self.client.pipeline()
+        stored = p._save(pipe)
+        self.assertEqual(
+            [("HDEL", "Person:1:more_info"), ("HMSET", "Person:1"), ("RPUSH", "Person:1:friend")],
+            sorted((args[0], args[1]) for args, _ in pipe.command_stack))
+        # the changes are still pending until the pipeline is executed
+        self.assertEqual((["address"], ["friend", "more_info"]), p._changes(p._redis_values()))
+        pipe.execute()
+        p._mark_stored(*stored)
+        p.save()
+        p = Person.objects.get(1)
+        self.assertEqual(["Lilei", "HanMeimei"], p.friend)
+        self.assertEqual({"age": "13"}, p.more_info)
+        self.assertEqual("Japan", p.address)
+
+    def test_update_fields(self):
+        p = Person(name="Liming", address="China")
+        p.save()
+        p.address = "Japan"
+        p.name = "Lilei"
+        p.save(update_fields=["name"])
+        self.assertEqual("China", Person.objects.get(1).address)
+        self.assertEqual(1, Person.objects.filter(name="Lilei").count())
+        p.save()
+        self.assertEqual("Japan", Person.objects.get(1).address)
+        # a new instance is written whole
+        Person(name="Hanmeimei", address="China").save(update_fields=["name"])
+        p = Person.objects.get(2)
+        self.assertEqual(("Hanmeimei", "China", 2), (p.name, p.address, Person.objects.all().count()))
+
+    def test_lazy_ext_fields(self):
+        Person(name="Liming", friend=["Lilei"], more_info={"city": "Beijing"}).save()
+        p = Person.objects.get(1)
+        self.assertNotIn("friend", p.__dict__)
+        self.assertEqual(["Lilei"], p.friend)
+        self.assertEqual({"city": "Beijing"}, p.more_info)
+        p = Person.objects.all().prefetch("friend")[0]
+        self.assertEqual(["Lilei"], p.__dict__["friend"])
+        self.assertNotIn("more_info", p.__dict__)
+        self.assertIs(Person.friend, Person._ext_fields["friend"])
+
+    def test_only_and_defer(self):
+        Person(name="Liming", address="China", age=13, friend=["Lilei"]).save()
+        p = Person.objects.only("name", "friend")[0]
+        self.assertEqual("Liming", p.name)
+        self.assertEqual(["Lilei"], p.__dict__["friend"])
+        self.assertNotIn("address", p.__dict__)
+        self.assertEqual("China", p.address)
+        p = Person.objects.defer("address")[0]
+        self.assertNotIn("address", p.__dict__)
+        self.assertEqual(13, p.age)
+        p.name = "Lilei"
+        p.save()
+        self.assertNotIn("address", p.__dict__)
+        p = Person.objects.get(1)
+        self.assertEqual(("Lilei", "China"), (p.name, p.address))
+        self.assertEqual(1, Person.objects.filter(name="Lilei").count())
+        with self.assertRaises(AttributeError):
+            Person.objects.only("nickname")
+
+    def test_incr(self):
+        p = Person(name="Liming", score=1)
+        p.save()
+        self.assertEqual(6, p.incr("score", 5))
+        self.assertEqual(([], []), p._changes(p._redis_values()))
+        other = Person.objects.get(1)
+        other.update(score=model.F("score") + 10, address="Japan")
+        self.assertEqual(16, other.score)
+        p = Person.objects.get(1)
+        self.assertEqual((16, "Japan"), (p.score, p.address))
+        self.assertEqual(["1"], [p.id for p in Person.objects.filter(score__gte=16)])
+        with self.assertRaises(TypeError):
+            p.incr("age")
+        with self.assertRaises(TypeError):
+            p.incr("name")
+        with self.assertRaises(ValueError):
+            p.update(score=model.F("age") + 1)
+        with self.assertRaises(TypeError):
+            p.update(address="Korea", age=model.F("age") + 1)
+        self.assertEqual("Japan", p.address)
+        self.assertEqual("Japan", Person.objects.get(1).address)
+
+    def test_counter_field(self):
+        page = Page(title="home", views=3)
+        page.save()
+        self.assertEqual(8, page.incr("views", 5))
+        self.assertEqual(2.5, page.incr("rating", 2.5))
+        for _ in range(10):
+            Page.objects.get(1).incr("views")
+        page = Page.objects.get(1)
+        self.assertEqual((18, 2.5), (page.views, page.rating))
+        self.assertLessEqual(self.client.hlen("Page:1:views"), 4)
+        page.views += 2
+        page.save()
+        self.assertEqual(20, Page.objects.all().prefetch("views")[0].views)
+
+    def test_defaults_and_from_redis(self):
+        a, b = Person(name="a"), Person(name="b")
+        a.friend.append("Lilei")
+        a.others["x"] = 1
+        self.assertEqual(([], {}), (b.friend, b.others))
+        with self.assertRaises(TypeError):
+            a.fields["name"] = None
+        p = Person.from_redis(7, {"name": "c", "score": "3", "age": "0", "create_at": "1", "others": '{"y": 2}'})
+        self.assertEqual(("7", "c", 3, {"y": 2}, None), (p.id, p.name, p.score, p.others, p.address))
+        self.assertFalse(p.is_new())
+        p.address = "China"
+        self.assertEqual({"name": "c", "score": 3, "others": '{"y": 2}', "address": "China"},
+                         {k: v for k, v in p.to_redis().items() if k in ("name", "score", "others", "address")})
+        self.assertNotIn("name", p._changes(p.to_redis())[0])
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,134 @@
+import unittest
+from unittest import mock
+
+from redisor import get_client, setup
+from redisor import model
+from redisor.repair import IndexRebuild
+
+setup(db=12)
+
+
+class Author(model.Model):
+
+    __database__ = get_client()
+
+    name = model.StringField(name='name', index=True)
+    age = model.IntegerField(name='age', default=0, range_index=True)
+    books = model.ListField(name='books')
+
+
+class Ticket(model.Model):
+
+    __database__ = get_client()
+    __shards__ = 2
+    __ttl__ = 300
+
+    queue = model.StringField(name='queue', index=True)
+
+
+class Packet(model.Model):
+
+    __database__ = get_client()
+    __storage__ = model.BucketStorage(size=3)
+
+    kind = model.StringField(name='kind', index=True)
+
+
+class RepairTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.db = get_client()
+        self.db.flushdb()
+
+    def tearDown(self):
+        self.db.flushdb()
+
+    def test_verify_and_rebuild(self):
+        Author.objects.bulk_create(Author(name="a%d" % (i % 3), age=i, books=["b"]) for i in range(9))
+        report = Author.objects.verify(batch_size=4)
+        self.assertTrue(report.ok)
+        self.assertEqual(9, report.instances)
+
+        self.db.srem("Author:all", "2")
+        self.db.sadd("Author:all", "99")
+        self.db.sadd("Author:name:gone", "3")
+        self.db.hset("Author:5", "name", "a9")
+        self.db.delete("Author:7")
+        self.db.zrem("Author:age:_zindex", "4")
+        report = Author.objects.verify(batch_size=4)
+        self.assertFalse(report.ok)
+        self.assertEqual(8, report.instances)
+        self.assertEqual({"Author:all": ["2"], "Author:name:a9": ["5"], "Author:age:_zindex": ["4"]},
+                         report.missing)
+        self.assertEqual({"Author:all": ["7", "99"], "Author:name:a0": ["7"], "Author:name:a1": ["5"],
+                          "Author:name:gone": ["3"], "Author:age:_zindex": ["7"]}, report.orphans)
+        self.assertEqual(["Author:7:books"], report.orphan_ext_keys)
+
+        self.assertEqual(report, Author.objects.rebuild_indexes(batch_size=4))
+        self.assertTrue(Author.objects.verify().ok)
+        self.assertEqual(-1, self.db.ttl("Author:all"))
+        self.assertFalse(self.db.exists("Author:name:gone", "Author:7:books"))
+        self.assertEqual(["2", "8"], [a.id for a in Author.objects.filter(name="a1").members])
+        self.assertEqual(["5"], [a.id for a in Author.objects.filter(name="a9").members])
+        self.assertEqual(["9", "8", "6"], [a.id for a in Author.objects.order_by("-age")[0:3]])
+
+    def test_sharded_expiring_model(self):
+        tickets = Ticket.objects.bulk_create(Ticket(queue="q%d" % (i % 2)) for i in range(6))
+        tickets[0].save(ttl=30)
+        self.assertTrue(Ticket.objects.verify().ok)
+        ns = Ticket._namespace("3")
+        self.db.delete(ns["3"])
+        self.db.hdel(ns["_expiring"], "3:queue")
+        report = Ticket.objects.rebuild_indexes()
+        self.assertEqual({ns["all"]: ["3"], ns["queue"]["q0"]: ["3"]}, report.orphans)
+        self.assertEqual(5, report.instances)
+        self.assertTrue(Ticket.objects.verify().ok)
+        self.assertEqual(["1", "5"], sorted(t.id for t in Ticket.objects.filter(queue="q0")))
+        self.assertLessEqual(self.db.zscore(Ticket._namespace("1")["all"], "1"),
+                             self.db.zscore(Ticket._namespace("5")["all"], "5") - 200)
+
+    def test_writes_during_rebuild(self):
+        Author.objects.bulk_create(Author(name="a", age=i) for i in range(4))
+        self.db.srem("Author:all", "1")
+        load = IndexRebuild._load
+        writes = []
+
+        def write_once(rebuild, ids):
+            if not writes:
+                writes.append(Author.objects.create(name="new", age=9))
+                a = Author.objects.get(2)
+                a.name = "b"
+                a.save()
+            return load(rebuild, ids)
+        with mock.patch.object(IndexRebuild, '_load', write_once):
+            report = Author.objects.rebuild_indexes(batch_size=10)
+        self.assertEqual({"Author:all": ["1"]}, report.missing)
+        self.assertTrue(Author.objects.verify().ok)
+        self.assertEqual(["5"], [a.id for a in Author.objects.filter(name="new")])
+        self.assertEqual(["2"], [a.id for a in Author.objects.filter(name="b")])
+        self.assertEqual(5, Author.objects.all().count())
+
+    def test_persistent_instances(self):
+        tickets = Ticket.objects.bulk_create(Ticket(queue="q") for i in range(3))
+        key = tickets[1].key()
+        self.db.persist(key)
+        self.db.zadd(Ticket._namespace(tickets[1].id)["all"], {tickets[1].id: "+inf"})
+        report = Ticket.objects.verify()
+        self.assertEqual(["2"], report.persistent)
+        self.assertFalse(report.ok)
+        self.assertEqual(report, Ticket.objects.rebuild_indexes())
+        self.assertTrue(0 < self.db.ttl(key) <= 300)
+        self.assertTrue(Ticket.objects.verify().ok)
+        self.assertEqual(0, Ticket.objects.reap())
+        self.assertEqual(3, Ticket.objects.all().count())
+
+    def test_bucket_storage(self):
+        Packet.objects.bulk_create(Packet(kind="k%d" % (i % 2)) for i in range(7))
+        self.db.delete("Packet:all")
+        report = Packet.objects.rebuild_indexes(batch_size=2)
+        self.assertEqual({"Packet:all": [str(i) for i in range(1, 8)]}, report.missing)
+        self.assertEqual(7, Packet.objects.all().count())
+
+
+if __name__ == "__main__":
+    unittest.main()
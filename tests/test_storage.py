@@ -0,0 +1,64 @@
+import unittest
+
+from redisor import get_client, setup
+from redisor import model
+
+setup(db=12)
+
+
+class BucketPoint(model.Model):
+
+    __database__ = get_client()
+    __storage__ = model.BucketStorage(size=2)
+
+    name = model.StringField(name='name', index=True)
+    x = model.IntegerField(name='x', default=0, range_index=True)
+    tags = model.ListField(name='tags')
+
+
+class BlobPoint(model.Model):
+
+    __database__ = get_client()
+    __storage__ = model.BlobStorage()
+
+    name = model.StringField(name='name', index=True)
+    x = model.IntegerField(name='x', default=0, range_index=True)
+
+
+class StorageTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.db = get_client()
+        self.db.flushdb()
+
+    def tearDown(self):
+        self.db.flushdb()
+
+    def check_storage(self, model_class):
+        model_class.objects.bulk_create([model_class(name="p%d" % i, x=i) for i in range(5)])
+        p = model_class.objects.get(3)
+        self.assertEqual(("p2", 2), (p.name, p.x))
+        p.update(name="q")
+        p = model_class.objects.filter(name="q").only("x")[0]
+        self.assertEqual(("3", "q", 2), (p.id, p.name, p.x))
+        self.assertEqual(["5", "4"], [p.id for p in model_class.objects.order_by("-x")[0:2]])
+        p.delete()
+        self.assertEqual(4, model_class.objects.all().count())
+        self.assertEqual([], model_class.objects.get_many([3]))
+
+    def test_bucket_storage(self):
+        self.check_storage(BucketPoint)
+        self.assertEqual(["1"], self.db.hkeys("BucketPoint:b:0"))
+        self.assertEqual(["2"], self.db.hkeys("BucketPoint:b:1"))
+        self.assertFalse(self.db.exists("BucketPoint:1"))
+        p = BucketPoint(name="t", tags=["a"])
+        p.save()
+        self.assertEqual(["a"], BucketPoint.objects.get(p.id).tags)
+
+    def test_blob_storage(self):
+        self.check_storage(BlobPoint)
+        self.assertEqual("string", self.db.type("BlobPoint:1"))
+
+
+if __name__ == "__main__":
+    unittest.main()
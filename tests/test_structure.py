@@ -1,7 +1,7 @@
 import unittest
 
-from redisor import get_client, setup
-from redisor.structure import List, Set, Hash
+from redisor import get_client, setup, trace
+from redisor.structure import List, Set, SortedSet, Hash, batch
 
 
 class BaseTestMixin(unittest.TestCase):
@@ -27,6 +27,16 @@ class ListTestCase(BaseTestMixin, unittest.TestCase):
         self.assertFalse("b" in self.lst)
         self.assertEqual(list(self.lst), ["a"])
 
+    def test_bulk_operation(self):
+        lst = List(db=self.db, key="test_list")
+        lst.chunk_size = 4
+        with trace() as t:
+            self.assertEqual(10, lst.extend(range(10)))
+        self.assertEqual(3, t.round_trips)
+        self.assertTrue(3 in lst)
+        self.assertEqual(2, lst.remove_many([3, 4, 42]))
+        self.assertEqual("<List(key=test_list, value=[0, 1, 2, 5, 6...])>", repr(lst))
+
 
 class SetTestCase(BaseTestMixin, unittest.TestCase):
 
@@ -50,6 +60,41 @@ class SetTestCase(BaseTestMixin, unittest.TestCase):
         self.assertEqual(self.set_b - self.set_c, {"one"})
         self.assertEqual(self.set_c - self.set_b, {"three"})
 
+    def test_bulk_operation(self):
+        set_e = Set(db=self.db, key="test_set_e")
+        self.assertEqual(3, set_e.add_many(["a", "b", "c"]))
+        self.assertEqual(1, set_e.update(["c", "d"]))
+        self.assertEqual(2, set_e.remove_many(["a", "b", "z"]))
+        self.assertTrue("c" in set_e)
+        self.assertFalse("a" in set_e)
+        self.assertEqual({"c", "d"}, set(set_e.intersection("test_set_f", set_e).all()))
+
+    def test_iter_scan(self):
+        self.set_d = Set(db=self.db, key="test_set_d")
+        for i in range(50):
+            self.set_d.add(i)
+        self.assertEqual(set(self.set_d.iter_scan(count=10)), {str(i) for i in range(50)})
+
+
+class SortedSetTestCase(BaseTestMixin, unittest.TestCase):
+
+    def test_iter(self):
+        self.zset_a = SortedSet(db=self.db, key="test_zset_a")
+        self.zset_a.page_size = 3
+        self.db.zadd("test_zset_a", {"m%d" % i: i for i in range(10)})
+        self.assertEqual(list(self.zset_a), ["m%d" % i for i in range(10)])
+        self.assertEqual(dict(self.zset_a.iter_scan(count=4)), {"m%d" % i: i for i in range(10)})
+
+    def test_bulk_operation(self):
+        zset = SortedSet(db=self.db, key="test_zset_b")
+        self.assertEqual(2, zset.zadd({"a": 1, "b": 2}))
+        self.assertEqual(1, zset.add_many([("c", 0)]))
+        zset.add("d", 3)
+        zset.incr_by("a", 5)
+        self.assertEqual(["c", "b", "d"], zset[0:3])
+        self.assertEqual(2, zset.remove_many(["b", "c"]))
+        self.assertEqual(["d", "a"], zset.all())
+
 
 class HashTestCase(BaseTestMixin, unittest.TestCase):
 
@@ -61,6 +106,35 @@ class HashTestCase(BaseTestMixin, unittest.TestCase):
         self.assertEqual(self.hash_a.all(), {"b": "4"})
         self.hash_a.update({"1":1,"2":2,"3":3,"4":4,"5":5,"6":6})
         print(self.hash_a)
+        self.assertEqual(set(self.hash_a), {"b", "1", "2", "3", "4", "5", "6"})
+        self.assertEqual(dict(self.hash_a.iter_scan(count=2))["6"], "6")
+        self.assertEqual(["4", None], self.hash_a.get_many(["b", "x"]))
+        self.assertEqual(2, self.hash_a.remove_many(["1", "2", "x"]))
+        self.assertEqual(5, len(self.hash_a))
+
+
+class BatchTestCase(BaseTestMixin, unittest.TestCase):
+
+    def test_batch(self):
+        lst, h, s = List(self.db, "test_list"), Hash(self.db, "test_hash"), Set(self.db, "test_set")
+        with trace() as t:
+            with batch(self.db):
+                lst.extend(["a", "b"])
+                lst.append("c")
+                h["count"] = 3
+                h.update(a=1)
+                del h["missing"]
+                s.add_many(["x"])
+                s.remove("missing")
+                self.assertEqual(0, len(lst))
+        self.assertEqual(["LLEN", "PIPELINE"], [c.command for c in t.commands])
+        self.assertEqual(["a", "b", "c"], lst.all())
+        self.assertEqual({"count": "3", "a": "1"}, h.all())
+        with self.assertRaises(ValueError):
+            with batch(self.db):
+                lst.append("d")
+                raise ValueError
+        self.assertEqual(3, len(lst))
 
 
 if __name__ == "__main__":
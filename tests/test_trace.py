@@ -0,0 +1,75 @@
+import threading
+import unittest
+
+from redisor import get_client, setup, trace
+from redisor import instrument
+from redisor import model
+
+setup(db=12)
+
+
+class Song(model.Model):
+
+    __database__ = get_client()
+
+    title = model.StringField(name='title', index=True)
+    tags = model.ListField(name='tags')
+
+
+class TraceTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.db = Song.__database__
+        self.db.flushdb()
+
+    def tearDown(self):
+        self.db.flushdb()
+
+    def test_trace(self):
+        Song.objects.bulk_create([Song(title="s%d" % i, tags=["a"]) for i in range(3)])
+        with trace() as t:
+            Song.objects.all().members
+            Song.objects.get(1).tags
+            thread = threading.Thread(target=lambda: Song.objects.get(2))
+            thread.start()
+            thread.join()
+        self.assertFalse(instrument.instrumentation.enabled)
+        self.assertEqual(4, t.round_trips)
+        self.assertEqual(6, t.command_count)
+        self.assertEqual(sum(c.bytes for c in t.commands), t.bytes_sent)
+        members, get, lazy = t.summary()
+        self.assertEqual(("Song", "members"), members["operation"])
+        self.assertIn("test_trace.py", members["call_site"])
+        self.assertEqual((2, 4), (members["round_trips"], members["commands"]))
+        self.assertEqual({"SORT": 1, "PIPELINE": 1}, dict(members["by_command"]))
+        self.assertEqual(("Song", "get"), get["operation"])
+        self.assertEqual({"LRANGE": 1}, dict(lazy["by_command"]))
+        self.assertIsNone(lazy["operation"])
+        self.assertEqual(3, len(t.report().splitlines()))
+
+    def test_overlapping_traces(self):
+        Song.objects.bulk_create([Song(title="s%d" % i) for i in range(2)])
+        entered, exited = threading.Event(), threading.Event()
+        traces = []
+
+        def other():
+            with trace() as t:
+                entered.set()
+                exited.wait()
+                Song.objects.get(2)
+            traces.append(t)
+        thread = threading.Thread(target=other)
+        thread.start()
+        entered.wait()
+        with trace() as t:
+            Song.objects.get(1)
+        # the other trace is still open
+        self.assertTrue(instrument.instrumentation.enabled)
+        exited.set()
+        thread.join()
+        self.assertFalse(instrument.instrumentation.enabled)
+        self.assertEqual((1, 1), (t.round_trips, traces[0].round_trips))
+
+
+if __name__ == "__main__":
+    unittest.main()
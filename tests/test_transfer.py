@@ -0,0 +1,109 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from redisor import get_client, setup
+from redisor import model
+from redisor import transfer
+
+setup(db=12)
+
+
+class Book(model.Model):
+
+    __database__ = get_client()
+
+    title = model.StringField(name='title', index=True)
+    pages = model.IntegerField(name='pages', default=0, range_index=True)
+    tags = model.ListField(name='tags')
+    reads = model.CounterField(name='reads', shards=2)
+
+
+class Loan(model.Model):
+
+    __database__ = get_client()
+    __ttl__ = 600
+    __shards__ = 3
+
+    book = model.StringField(name='book', index=True)
+
+
+class TransferTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.db = get_client()
+        self.db.flushdb()
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        self.db.flushdb()
+        os.remove(self.path)
+
+    def test_export_import(self):
+        books = Book.objects.bulk_create(
+            Book(title="t%d" % (i % 5), pages=i, tags=["a", str(i)]) for i in range(23))
+        books[3].incr("reads", 7)
+        books[4].delete()
+        progress = []
+        self.assertEqual(22, Book.objects.export(self.path, workers=3, batch_size=4,
+                                                 progress=lambda done, total: progress.append((done, total))))
+        self.assertEqual((22, 22), progress[-1])
+        self.assertEqual(6, len(progress))
+        self.db.flushdb()
+        self.assertEqual(22, Book.objects.import_(self.path, workers=3, batch_size=5))
+        self.assertEqual(22, Book.objects.all().count())
+        b = Book.objects.get(4)
+        self.assertEqual(("t3", 3, ["a", "3"], 7), (b.title, b.pages, b.tags, b.reads))
+        self.assertEqual(["4", "9", "14", "19"], [b.id for b in Book.objects.filter(title="t3").members])
+        self.assertEqual(["23", "22"], [b.id for b in Book.objects.order_by("-pages")[0:2]])
+        self.assertEqual("24", Book.objects.create(title="new").id)
+
+    def test_binary_records(self):
+        Book.objects.bulk_create(Book(title="t%d" % i, tags=["x"]) for i in range(7))
+        codec = model.ZlibCodec(model.JsonCodec())
+        self.assertEqual(7, Book.objects.export(self.path, batch_size=2, codec=codec))
+        self.db.flushdb()
+        self.assertEqual(7, Book.objects.import_(self.path, codec=codec))
+        self.assertEqual(["x"], Book.objects.get(7).tags)
+
+    def test_expiring_sharded_model(self):
+        loans = Loan.objects.bulk_create(Loan(book="b%d" % (i % 2)) for i in range(6))
+        loans[0].save(ttl=30)
+        self.db.zadd(Loan._namespace("2")["all"], {"2": 1})
+        self.assertEqual(5, Loan.objects.export(self.path, batch_size=2))
+        self.db.flushdb()
+        self.assertEqual(5, Loan.objects.import_(self.path))
+        self.assertEqual(["1", "3", "5"], sorted(loan.id for loan in Loan.objects.filter(book="b0")))
+        self.assertTrue(0 < self.db.ttl(Loan.objects.get(1).key()) <= 30)
+        self.assertTrue(30 < self.db.ttl(Loan.objects.get(3).key()) <= 600)
+
+    def test_infinite_expiry(self):
+        Loan.objects.bulk_create(Loan(book="b") for i in range(3))
+        self.db.zadd(Loan._namespace("2")["all"], {"2": "+inf"})
+        self.db.persist(Loan._namespace("2")["2"])
+        self.assertEqual(3, Loan.objects.export(self.path))
+        self.db.flushdb()
+        self.assertEqual(3, Loan.objects.import_(self.path))
+        self.assertTrue(0 < self.db.ttl(Loan.objects.get(2).key()) <= 600)
+
+    def test_scan_duplicates(self):
+        Book.objects.bulk_create(Book(title="t") for i in range(5))
+        sscan_iter = self.db.sscan_iter
+
+        def repeating(key, **kwargs):
+            ids = list(sscan_iter(key, **kwargs))
+            return iter(ids + ids[:2])
+        with mock.patch.object(self.db, 'sscan_iter', repeating):
+            self.assertEqual(5, Book.objects.export(self.path, batch_size=2))
+        with open(self.path) as f:
+            self.assertEqual(5, len(f.readlines()))
+
+    def test_unique_window(self):
+        items = [("1", None), ("2", None), ("1", None), ("3", None), ("4", None), ("1", None)]
+        self.assertEqual(["1", "2", "3", "4", "1"], [id for id, _ in transfer._unique(items, 3)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+import unittest
+
+from redisor import get_client, setup
+from redisor import model
+
+setup(db=12)
+
+
+class Session(model.Model):
+
+    __database__ = get_client()
+    __ttl__ = 3600
+
+    user = model.StringField(name='user', index=True)
+    hits = model.IntegerField(name='hits', default=0, range_index=True)
+    pages = model.ListField(name='pages')
+    views = model.CounterField(name='views', shards=2)
+
+
+class Token(model.Model):
+
+    __database__ = get_client()
+    __ttl__ = 60
+    __storage__ = model.BlobStorage()
+
+    name = model.StringField(name='name')
+
+
+class Persistent(model.Model):
+
+    __database__ = get_client()
+
+    name = model.StringField(name='name')
+
+
+class ExpiryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.db = get_client()
+        self.db.flushdb()
+
+    def tearDown(self):
+        self.db.flushdb()
+
+    def expire(self, instance):
+        """Expire an instance the way redis does, scores are left as they are"""
+        self.db.zadd("%s:all" % instance.__class__.__name__, {instance.id: 1})
+        self.db.delete(instance.key(), *[instance.key()[name] for name in instance._ext_fields])
+
+    def test_save_expires_all_keys(self):
+        s = Session(user="a", pages=["/"])
+        s.save()
+        self.assertTrue(0 < self.db.ttl("Session:1") <= 3600)
+        self.assertTrue(0 < self.db.ttl("Session:1:pages") <= 3600)
+        self.assertEqual("zset", self.db.type("Session:all"))
+        s.save(ttl=10)
+        self.assertTrue(0 < self.db.ttl("Session:1") <= 10)
+        s.hits = 3
+        s.save()
+        self.assertTrue(0 < self.db.ttl("Session:1") <= 10)
+        self.assertEqual(4, s.incr("views", 4))
+        self.assertTrue(0 < self.db.ttl("Session:1:views") <= 10)
+        self.assertEqual(5, s.incr("hits", 2))
+        self.expire(s)
+        s.incr("hits", 2)
+        self.assertEqual({"hits": "2"}, self.db.hgetall("Session:1"))
+        self.assertTrue(0 < self.db.ttl("Session:1") <= 10)
+        with self.assertRaises(ValueError):
+            Persistent(name="x").save(ttl=5)
+
+    def test_queryset_skips_expired(self):
+        sessions = Session.objects.bulk_create(Session(user="u%d" % (i % 2), hits=i) for i in range(4))
+        self.expire(sessions[2])
+        self.assertEqual(["1", "2", "4"], sorted(s.id for s in Session.objects.all().members))
+        self.assertEqual(3, Session.objects.all().count())
+        self.assertEqual(["1"], [s.id for s in Session.objects.filter(user="u0")])
+        self.assertEqual(["4", "2", "1"], [s.id for s in Session.objects.order_by("-hits")])
+        self.assertEqual(["2", "4"], sorted(s.id for s in Session.objects.filter(user="u1", hits__gte=1)))
+        self.assertEqual(["4", "2"], [s.id for s in Session.objects.order_by("-hits")[0:2]])
+        self.assertEqual([], Session.objects.get_many([3]))
+
+    def test_scan_and_count_live(self):
+        sessions = Session.objects.bulk_create(Session(user="u%d" % (i % 2)) for i in range(7))
+        self.expire(sessions[2])
+        self.expire(sessions[3])
+        self.assertEqual(["1", "2", "5", "6", "7"],
+                         sorted(s.id for s in Session.objects.all().iter_scan(batch_size=2)))
+        self.assertEqual(["1", "5", "7"],
+                         sorted(s.id for s in Session.objects.filter(user="u0").iter_scan(batch_size=2)))
+        self.assertEqual(3, Session.objects.filter(user="u0").count())
+        self.assertEqual(2, Session.objects.filter(user="u1").count())
+        self.assertEqual([], self.db.keys("~*"))
+
+    def test_reap(self):
+        sessions = Session.objects.bulk_create(Session(user="u", hits=i) for i in range(5))
+        for s in sessions[1:3]:
+            self.expire(s)
+        # scored as expired, but its hash is still there
+        self.db.zadd("Session:all", {"1": 1})
+        self.assertEqual(2, Session.objects.reap(batch_size=1))
+        self.assertEqual({"1", "4", "5"}, set(self.db.zrange("Session:all", 0, -1)))
+        self.assertEqual({"1", "4", "5"}, self.db.smembers("Session:user:u"))
+        self.assertEqual({"1", "4", "5"}, set(self.db.zrange("Session:hits:_zindex", 0, -1)))
+        self.assertEqual({"1:user", "4:user", "5:user"}, set(self.db.hkeys("Session:_expiring")))
+        self.assertEqual({"Session": 0}, model.Reaper(Session).reap())
+        sessions[0].save()
+        sessions[3].delete()
+        self.assertEqual({"1:user", "5:user"}, set(self.db.hkeys("Session:_expiring")))
+        self.assertEqual(["1", "5"], sorted(s.id for s in Session.objects.all()))
+
+    def test_blob_storage(self):
+        t = Token(name="t")
+        t.save()
+        self.assertTrue(0 < self.db.ttl("Token:1") <= 60)
+        self.assertEqual("t", Token.objects[0].name)
+        self.expire(t)
+        self.assertEqual(0, Token.objects.all().count())
+        self.assertEqual(1, Token.objects.reap())
+
+    def test_invalid_models(self):
+        with self.assertRaises(TypeError):
+            class Bucketed(model.Model):
+                __ttl__ = 10
+                __storage__ = model.BucketStorage()
+                name = model.StringField(name='name')
+        with self.assertRaises(ValueError):
+            model.Reaper(Persistent)
+
+
+if __name__ == "__main__":
+    unittest.main()